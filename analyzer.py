@@ -0,0 +1,127 @@
+import os
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+
+# Analyzer mặc định của chỉ mục ("vi" hoặc "english" = TfidfVectorizer cũ)
+DEFAULT_ANALYZER = os.getenv("RAG_ANALYZER", "vi")
+# Số câu ngắn (truy vấn) và số từ giữ kết quả phân tích trong LRU cache
+ANALYZER_CACHE_SIZE = int(os.getenv("RAG_ANALYZER_CACHE_SIZE", "4096"))
+# Chỉ cache cả câu khi đủ ngắn (truy vấn); văn bản dài chỉ dùng cache theo từ
+_CACHE_TEXT_CHARS = 512
+
+# Letters that only occur in Vietnamese (with diacritics) among the corpus' languages
+_VI_LETTERS = frozenset(
+    "àáạảãâầấậẩẫăằắặẳẵèéẹẻẽêềếệểễìíịỉĩòóọỏõôồốộổỗơờớợởỡùúụủũưừứựửữỳýỵỷỹđ"
+)
+
+# Function words and question words that carry no topic (syllables, lowercase, NFC)
+VIETNAMESE_STOP_WORDS: FrozenSet[str] = frozenset("""
+    à ạ ai anh bị bởi các cái cần càng chỉ chiếc cho chứ chưa có còn của cùng cũng
+    đã đang đây để đến đều do đó được gì hay hoặc khi không là lại lên làm mà mình
+    mỗi một nào này nên nếu nhiều như những nơi nữa ơi phải qua ra rằng rất rồi sau
+    sẽ sự tại thì theo thế tôi trên trong từ vào vẫn về vì với vậy bao nhiêu bạn hãy
+    hỏi xin giúp em sao đâu ta chúng và
+""".split())
+
+@lru_cache(maxsize=1)
+def default_stop_words() -> FrozenSet[str]:
+    # sklearn is imported on first use only (it is slow to import)
+    from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+    return frozenset(ENGLISH_STOP_WORDS) | VIETNAMESE_STOP_WORDS
+
+# A word, or a dotted/dashed/slashed code identifier such as req.body or express-generator
+_TOKEN_RE = re.compile(r"\w+(?:[./\-]\w+)*", re.UNICODE)
+_SEP_RE = re.compile(r"[./\-_]+")
+_CAMEL_RE = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+
+def is_vietnamese(word: str) -> bool:
+    return any(c in _VI_LETTERS for c in word)
+
+class Analyzer:
+    """Text -> index terms, tuned for mixed Vietnamese/English course material.
+
+    - Unicode NFC + lowercase; Vietnamese diacritics are kept (``phân`` and
+      ``phần`` stay distinct).
+    - Code identifiers keep the whole token and add its parts:
+      ``req.body`` -> ``req.body, req, body``; ``user_id`` -> ``user_id,
+      user, id``; ``bodyParser`` -> ``bodyparser, body, parser``.
+    - English + Vietnamese stop words and 1-character terms are dropped.
+    - Adjacent syllables of Vietnamese text also yield a bigram term
+      (``sinh viên``, ``phản biện``) so multi-syllable words match as a unit.
+
+    Expansions are cached per word and whole analyses per short text
+    (queries), so a repeated query costs a dict lookup.
+    """
+
+    name = "vi"
+
+    def __init__(self, stop_words: Optional[FrozenSet[str]] = None, bigrams: bool = True,
+                 cache_size: int = ANALYZER_CACHE_SIZE):
+        self.stop_words = default_stop_words() if stop_words is None else stop_words
+        self.bigrams = bigrams
+        self._expand = lru_cache(maxsize=cache_size * 8)(self._expand_word)
+        self._cached = lru_cache(maxsize=cache_size)(self._analyze)
+
+    def __call__(self, text: str) -> List[str]:
+        if not text:
+            return []
+        if len(text) <= _CACHE_TEXT_CHARS:
+            return list(self._cached(text))
+        return list(self._analyze(text))
+
+    def cache_info(self) -> Dict[str, object]:
+        return {"texts": self._cached.cache_info(), "words": self._expand.cache_info()}
+
+    def _expand_word(self, raw: str) -> Tuple[Tuple[str, ...], str]:
+        """``(terms, syllable)``: the terms for one raw token, and the token as
+        a plain lowercase syllable for bigrams ("" if it cannot be one)."""
+        lower = raw.lower()
+        parts = [p for p in _SEP_RE.split(raw) if p]
+        if raw.isascii():
+            pieces = [m for p in parts for m in (_CAMEL_RE.findall(p) or [p])]
+        else:
+            pieces = parts
+        terms = []
+        if len(pieces) > 1 and lower not in self.stop_words:
+            terms.append(lower)
+        for piece in pieces:
+            piece = piece.lower()
+            if len(piece) > 1 and piece not in self.stop_words and piece not in terms:
+                terms.append(piece)
+        syllable = lower if len(pieces) == 1 and lower.isalpha() else ""
+        return tuple(terms), syllable
+
+    def _analyze(self, text: str) -> Tuple[str, ...]:
+        text = unicodedata.normalize("NFC", text)
+        out: List[str] = []
+        prev = ""   # previous syllable, if it can start a bigram
+        for raw in _TOKEN_RE.findall(text):
+            terms, syllable = self._expand(raw)
+            out.extend(terms)
+            if not self.bigrams:
+                continue
+            if syllable and syllable not in self.stop_words:
+                if prev and (is_vietnamese(prev) or is_vietnamese(syllable)):
+                    out.append(f"{prev} {syllable}")
+                prev = syllable
+            else:
+                prev = ""
+        return tuple(out)
+
+def english_analyzer() -> Callable[[str], List[str]]:
+    """The original analyzer: ASCII-folded unigrams with English stop words."""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    return TfidfVectorizer(strip_accents="unicode", lowercase=True, stop_words="english").build_analyzer()
+
+ANALYZERS: Dict[str, Callable[[], Callable[[str], List[str]]]] = {
+    "vi": Analyzer,
+    "english": english_analyzer,
+}
+
+def get_analyzer(name: str = DEFAULT_ANALYZER) -> Callable[[str], List[str]]:
+    name = name.lower().strip()
+    if name not in ANALYZERS:
+        raise ValueError(f"Analyzer must be one of {', '.join(ANALYZERS)}.")
+    return ANALYZERS[name]()
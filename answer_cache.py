@@ -0,0 +1,164 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import unicodedata
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+import numpy as np
+
+# Cache câu trả lời dùng chung giữa các phiên/process (SQLite trên đĩa)
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", os.path.join(".cache", "answers.sqlite3"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", str(7 * 24 * 3600)))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+# Ngưỡng cosine để coi hai câu hỏi (cùng ngữ cảnh) là một
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.9"))
+
+_VECTOR_DIM = 512
+_SPACE_RE = re.compile(r"\s+")
+_EDGE_PUNCT_RE = re.compile(r"^[\W_]+|[\W_]+$", re.UNICODE)
+
+def normalize_question(question: str) -> str:
+    q = unicodedata.normalize("NFC", question or "").lower()
+    q = _SPACE_RE.sub(" ", q).strip()
+    return _EDGE_PUNCT_RE.sub("", q)
+
+def chunk_id(chunk: Dict) -> str:
+    raw = f"{chunk.get('source', '')}\0{chunk.get('text', '')}"
+    return hashlib.sha1(raw.encode("utf-8", errors="ignore")).hexdigest()[:16]
+
+def question_vector(question: str) -> np.ndarray:
+    """Hashed character-trigram vector (L2-normalized) for near-duplicate lookup."""
+    q = f" {normalize_question(question)} "
+    vec = np.zeros(_VECTOR_DIM, dtype=np.float32)
+    for i in range(len(q) - 2):
+        h = int.from_bytes(hashlib.blake2b(q[i:i + 3].encode("utf-8"), digest_size=4).digest(), "little")
+        vec[h % _VECTOR_DIM] += 1.0
+    norm = float(np.linalg.norm(vec))
+    return vec / norm if norm else vec
+
+class AnswerCache:
+    """Answers keyed by question + retrieved chunks + model settings.
+
+    The context key combines the retrieved chunk ids, the model, the
+    temperature (rounded to 0.1) and a hash of the system prompt; an answer is
+    only reused under the same context key. Within it, an exact normalized
+    question match is tried first, then the most similar cached question above
+    ``similarity``. Entries expire after ``ttl`` seconds and the least recently
+    used ones are evicted beyond ``max_entries``.
+    """
+
+    def __init__(self, path: str = ANSWER_CACHE_PATH, ttl: float = ANSWER_CACHE_TTL,
+                 max_entries: int = ANSWER_CACHE_MAX_ENTRIES, similarity: float = ANSWER_CACHE_SIMILARITY):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity = similarity
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS answers (
+                key TEXT PRIMARY KEY,
+                context_key TEXT NOT NULL,
+                question TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                answer TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0)""")
+            db.execute("CREATE INDEX IF NOT EXISTS answers_context ON answers(context_key)")
+            db.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    @contextmanager
+    def _connect(self):
+        # Mỗi thao tác một connection: dùng được từ nhiều thread/process
+        db = sqlite3.connect(self.path, timeout=10)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    @staticmethod
+    def context_key(chunks: List[Dict], model: str, temperature: float, system_prompt: str) -> str:
+        parts = [
+            ",".join(chunk_id(c) for c in chunks),
+            model,
+            f"{round(float(temperature), 1):.1f}",
+            hashlib.sha256((system_prompt or "").encode("utf-8")).hexdigest(),
+        ]
+        return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _key(question: str, context_key: str) -> str:
+        return hashlib.sha256(f"{normalize_question(question)}\n{context_key}".encode("utf-8")).hexdigest()
+
+    def _bump(self, db: sqlite3.Connection, name: str):
+        db.execute("INSERT INTO stats(name, value) VALUES(?, 1) "
+                   "ON CONFLICT(name) DO UPDATE SET value = value + 1", (name,))
+
+    def get(self, question: str, chunks: List[Dict], model: str, temperature: float,
+            system_prompt: str) -> Optional[str]:
+        ctx = self.context_key(chunks, model, temperature, system_prompt)
+        key = self._key(question, ctx)
+        now = time.time()
+        try:
+            with self._connect() as db:
+                row = db.execute("SELECT key, answer FROM answers WHERE key = ? AND created >= ?",
+                                 (key, now - self.ttl)).fetchone()
+                kind = "hits"
+                if row is None and self.similarity < 1.0:
+                    kind = "near_hits"
+                    vec = question_vector(question)
+                    best, best_sim = None, self.similarity
+                    for cand_key, blob, answer in db.execute(
+                            "SELECT key, vector, answer FROM answers WHERE context_key = ? AND created >= ?",
+                            (ctx, now - self.ttl)):
+                        sim = float(np.frombuffer(blob, dtype=np.float32) @ vec)
+                        if sim >= best_sim:
+                            best, best_sim = (cand_key, answer), sim
+                    row = best
+                if row is None:
+                    self._bump(db, "misses")
+                    return None
+                db.execute("UPDATE answers SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, row[0]))
+                self._bump(db, kind)
+                return row[1]
+        except sqlite3.Error:
+            return None
+
+    def put(self, question: str, chunks: List[Dict], model: str, temperature: float,
+            system_prompt: str, answer: str):
+        ctx = self.context_key(chunks, model, temperature, system_prompt)
+        now = time.time()
+        try:
+            with self._connect() as db:
+                db.execute(
+                    "INSERT OR REPLACE INTO answers(key, context_key, question, vector, answer, created, last_used) "
+                    "VALUES(?, ?, ?, ?, ?, ?, ?)",
+                    (self._key(question, ctx), ctx, normalize_question(question),
+                     question_vector(question).tobytes(), answer, now, now))
+                db.execute("DELETE FROM answers WHERE created < ?", (now - self.ttl,))
+                db.execute("DELETE FROM answers WHERE key IN (SELECT key FROM answers "
+                           "ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+        except sqlite3.Error:
+            pass
+
+    def stats(self) -> Dict:
+        try:
+            with self._connect() as db:
+                counts = dict(db.execute("SELECT name, value FROM stats").fetchall())
+                entries = db.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        except sqlite3.Error:
+            counts, entries = {}, 0
+        hits, near, misses = counts.get("hits", 0), counts.get("near_hits", 0), counts.get("misses", 0)
+        total = hits + near + misses
+        return {
+            "entries": entries,
+            "hits": hits,
+            "near_hits": near,
+            "misses": misses,
+            "hit_rate": (hits + near) / total if total else 0.0,
+        }
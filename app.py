@@ -1,10 +1,14 @@
 import os
 import requests  # để bắt lỗi timeout rõ ràng
 import streamlit as st
-from rag import RAGIndex
+import tracing
+from rag import SessionIndex, available_backends, SESSION_UPLOAD_MB
 from models import LLMProvider
+from hedging import HedgedProvider
 from prompts import SYSTEM_PROMPT
-from web_ingest import load_vendor_urls, fetch_vendor_docs
+from answer_cache import AnswerCache
+from vendor_sync import VendorSync
+from extract import text_cache
 
 st.set_page_config(page_title="SDN302 NodeJS Course Assistant", page_icon="📱", layout="wide")
 
@@ -35,7 +39,21 @@ with st.sidebar:
     use_local_docs = st.checkbox("Dùng tài liệu nội bộ (data/)", value=True)
     use_vendor_docs = st.checkbox("Dùng nguồn vendor (sources.yaml)", value=True)
     top_k = st.slider("Số đoạn trích dẫn (k)", 1, 8, 4)
+    retriever = st.selectbox("Thuật toán truy hồi", available_backends(), index=0,
+                             help="tfidf: cosine TF‑IDF; bm25: BM25 trên inverted index (MaxScore); "
+                                  "hybrid: TF‑IDF + embedding (cần sentence-transformers)")
     temperature = st.slider("Nhiệt độ (creativity)", 0.0, 1.0, 0.3)
+    hedge = st.checkbox("Gọi song song provider dự phòng khi chậm", value=os.getenv("LLM_HEDGE", "0") == "1",
+                        help="Nếu provider chính chưa trả byte đầu tiên sau p95 thời gian thường lệ, gửi thêm "
+                             "request tới provider còn lại và dùng câu trả lời về trước (cần key của cả hai).")
+
+    # Số liệu hiệu năng chỉ dành cho người vận hành: RAG_ADMIN=1 (chạy nội bộ)
+    # hoặc nhập đúng ADMIN_PASSWORD (nếu có trong Secrets)
+    ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD")
+    is_admin = os.getenv("RAG_ADMIN", "0") == "1"
+    if not is_admin and ADMIN_PASSWORD:
+        admin_pw = st.text_input("Mật khẩu quản trị", type="password", help="Chỉ dành cho giảng viên/admin.")
+        is_admin = (admin_pw or "") == ADMIN_PASSWORD
 
     # Nút test + placeholder hiển thị kết quả
     test_clicked = st.button("🧪 Test kết nối LLM")
@@ -50,26 +68,35 @@ if APP_PASSWORD and (pw or "") != APP_PASSWORD:
     st.stop()
 
 # Cache resources
-@st.cache_resource(show_spinner=True)
-def load_index():
-    idx = RAGIndex(data_dir="data")
-    idx.build()  # chỉ nội bộ trước
-    return idx
+# Chỉ mục gốc (data/ + vendor) dùng chung cho mọi phiên và không bị sửa sau khi
+# freeze; upload của từng phiên nằm trong overlay riêng (SessionIndex).
+# Worker nền xây chỉ mục đầu tiên (không chặn lần render đầu), rồi làm mới nguồn
+# vendor theo chu kỳ và thay chỉ mục gốc bằng một thế hệ mới.
+@st.cache_resource(show_spinner=False)
+def load_vendor_sync():
+    return VendorSync().start()
 
 @st.cache_resource(show_spinner=True)
-def load_llm(provider_choice: str, ui_model: str):
+def load_llm(provider_choice: str, ui_model: str, hedge: bool = False):
     # Áp dụng lựa chọn từ UI vào env trước khi khởi tạo LLM
     os.environ["PROVIDER"] = provider_choice
     if provider_choice == "github":
         os.environ["GITHUB_MODELS_MODEL"] = ui_model
     else:
         os.environ["GOOGLE_MODEL"] = ui_model
-    return LLMProvider.from_env()
+    llm = LLMProvider.from_env()
+    if not hedge:
+        return llm
+    # Provider dự phòng là provider còn lại, dùng model mặc định trong Secrets
+    try:
+        backup = LLMProvider("google" if provider_choice == "github" else "github")
+    except ValueError:
+        return llm
+    return HedgedProvider([llm, backup])
 
-@st.cache_data(show_spinner=True, ttl=60*60*12)  # cache 12h
-def get_vendor_docs():
-    urls = load_vendor_urls("sources.yaml")
-    return fetch_vendor_docs(urls)
+@st.cache_resource(show_spinner=False)
+def load_answer_cache():
+    return AnswerCache()
 
 st.title("📱 Trợ lý môn SDN302 NodeJS (Giảng viên & Học viên)")
 st.caption("Hỏi về khái niệm, best practices, lab/bài tập (gợi ý), quy định môn học...")
@@ -77,21 +104,22 @@ st.caption("Hỏi về khái niệm, best practices, lab/bài tập (gợi ý),
 # Session state
 if "messages" not in st.session_state:
     st.session_state.messages = []
-if "index" not in st.session_state:
-    with st.spinner("Đang nạp tài liệu nội bộ và xây dựng chỉ mục..."):
-        st.session_state.index = load_index()
 
 # Khởi tạo hoặc reload LLM khi đổi provider/model
 need_reload_llm = (
     ("llm" not in st.session_state) or
     (st.session_state.get("llm_provider") != provider) or
-    (st.session_state.get("llm_model") != model_name)
+    (st.session_state.get("llm_model") != model_name) or
+    (st.session_state.get("llm_hedge") != hedge)
 )
 if need_reload_llm:
     with st.spinner("Đang khởi tạo mô hình..."):
-        st.session_state.llm = load_llm(provider, model_name)
+        st.session_state.llm = load_llm(provider, model_name, hedge)
     st.session_state.llm_provider = provider
     st.session_state.llm_model = model_name
+    st.session_state.llm_hedge = hedge
+    if hedge and not isinstance(st.session_state.llm, HedgedProvider):
+        st.sidebar.warning("Thiếu key của provider dự phòng; chỉ dùng một provider.")
 
 # Test ping
 if test_clicked:
@@ -112,32 +140,70 @@ uploaded_files = st.file_uploader(
     "Tải thêm tài liệu (.md/.txt/.pdf) để tăng chất lượng trả lời",
     type=["md", "txt", "pdf"], accept_multiple_files=True
 )
-if uploaded_files:
-    added = st.session_state.index.add_uploaded_files(uploaded_files)
-    if added:
-        st.success(f"Đã thêm {added} tài liệu tải lên vào chỉ mục.")
 
-# Vendor sync
-vendor_docs = []
-if use_vendor_docs:
+# Vendor sync (trang vendor thuộc chỉ mục gốc dùng chung, bật/tắt theo từng phiên)
+vendor_sync = load_vendor_sync()
+warming_up = not vendor_sync.ready
+if warming_up:
+    # Chỉ mục đang được xây ở nền: trang vẫn hiển thị, chat tạm khoá, tự chạy lại khi xong
+    generation = None
+    st.info("⏳ Đang khởi động: nạp tài liệu nội bộ và xây dựng chỉ mục ở nền...")
+    if vendor_sync.last_error:
+        st.error(f"Xây chỉ mục lỗi, đang thử lại: {vendor_sync.last_error}")
+
+    # Mỗi giây chỉ chạy lại fragment này; khi chỉ mục xong thì chạy lại cả trang
+    @st.experimental_fragment(run_every=1)
+    def wait_for_index():
+        if vendor_sync.ready:
+            st.rerun()
+    wait_for_index()
+else:
+    generation = vendor_sync.current   # đọc con trỏ một lần cho cả lượt chạy này
+if generation is not None and use_vendor_docs:
+    sync_status = vendor_sync.status()
     col1, col2 = st.columns([1,1])
     with col1:
-        if st.button("🔄 Sync nguồn vendor"):
-            st.cache_data.clear()  # làm mới cache vendor docs
-            st.rerun()
+        if st.button("🔄 Sync nguồn vendor", disabled=sync_status["running"]):
+            vendor_sync.request_refresh()  # chạy ở nền, không chặn trang
+            st.toast("Đã yêu cầu làm mới nguồn vendor; chỉ mục mới sẽ được dùng khi xây xong.")
     with col2:
         st.caption("Sửa URLs trong sources.yaml nếu muốn bổ sung/giảm bớt nguồn.")
-    with st.spinner("Đang tải nguồn vendor..."):
-        vendor_docs = get_vendor_docs()
-    if vendor_docs:
-        st.info(f"Đã nạp {len(vendor_docs)} trang vendor. Sẽ dùng để trích dẫn khi RAG bật.")
-
-# Kết hợp nguồn theo lựa chọn
-st.session_state.index.reset_external_docs()
-if use_vendor_docs and vendor_docs:
-    st.session_state.index.add_external_docs(vendor_docs)
-if not use_local_docs:
-    st.session_state.index.disable_local_docs()
+    n_pages = sum(1 for p in sync_status["pages"] if p["chars"])
+    state = "đang làm mới…" if sync_status["running"] else f"cập nhật {sync_status['age'] / 60:.0f} phút trước"
+    st.info(f"Chỉ mục thế hệ {sync_status['generation']} ({state}): {n_pages} trang vendor. "
+            "Sẽ dùng để trích dẫn khi RAG bật.")
+    with st.expander("Trạng thái từng URL vendor"):
+        if sync_status["last_error"]:
+            st.error(f"Lần làm mới gần nhất lỗi: {sync_status['last_error']}")
+        st.dataframe(
+            [{"url": p["url"], "trạng thái": p["status"], "ký tự": p["chars"],
+              "ms": round(p["elapsed"] * 1e3), "chi tiết": p["detail"]} for p in sync_status["pages"]],
+            hide_index=True, use_container_width=True,
+        )
+
+if generation is not None:
+    if "index" not in st.session_state:
+        st.session_state.index = SessionIndex(generation.index)
+    else:
+        st.session_state.index.rebase(generation.index)  # giữ upload khi chỉ mục gốc được làm mới
+
+    # Lựa chọn nguồn/thuật toán chỉ là tham số tìm kiếm của phiên này
+    st.session_state.index.use_local = use_local_docs
+    st.session_state.index.use_vendor = use_vendor_docs
+    st.session_state.index.set_backend(retriever)
+
+    # Gọi cả khi danh sách rỗng: file đã index chỉ tốn một lần hash, không trích xuất lại
+    added = st.session_state.index.add_uploaded_files(uploaded_files or [])
+    if added:
+        st.success(f"Đã thêm {added} tài liệu tải lên vào chỉ mục.")
+    if st.session_state.index.evicted_uploads:
+        st.warning(f"{st.session_state.index.evicted_uploads} tài liệu tải lên cũ đã bị loại khỏi chỉ mục "
+                   f"do vượt giới hạn {SESSION_UPLOAD_MB:g} MB text (UTF-8, tiếng Việt có dấu tốn 1–3 byte/ký tự) "
+                   "của phiên (RAG_SESSION_UPLOAD_MB).")
+    if st.session_state.index.rejected_uploads:
+        st.warning(f"{st.session_state.index.rejected_uploads} tài liệu tải lên không được thêm vào chỉ mục vì riêng "
+                   f"nội dung text của nó đã vượt giới hạn {SESSION_UPLOAD_MB:g} MB (UTF-8) của phiên "
+                   "(RAG_SESSION_UPLOAD_MB).")
 
 # Hiển thị lịch sử chat + trích dẫn
 for msg in st.session_state.messages:
@@ -148,49 +214,126 @@ for msg in st.session_state.messages:
                 for c in msg["citations"]:
                     st.write(f"- {c['source']} (score: {c['score']:.3f})")
 
-question = st.chat_input("Đặt câu hỏi về SDN302 NodeJS, bài tập, lab, yêu cầu môn học...")
-
-def format_context(chunks):
-    parts = []
-    for i, ch in enumerate(chunks, 1):
-        parts.append(f"[{i}] {ch['text']}\nSource: {ch['source']}")
-    return "\n\n".join(parts)
+question = st.chat_input("Đặt câu hỏi về SDN302 NodeJS, bài tập, lab, yêu cầu môn học...",
+                         disabled=warming_up)
 
 if question:
     st.session_state.messages.append({"role": "user", "content": question})
     with st.chat_message("user"):
         st.markdown(question)
 
-    with st.chat_message("assistant"):
-        with st.spinner("Đang suy nghĩ..."):
-            retrieved = []
-            context = ""
-            if use_rag:
+    # Mọi span của câu hỏi này (retrieval, context, LLM...) gắn chung một trace id
+    with st.chat_message("assistant"), tracing.trace(), tracing.span("request", rag=use_rag):
+        retrieved = []
+        context = ""
+        if use_rag:
+            with st.spinner("Đang tìm tài liệu liên quan..."):
                 retrieved = st.session_state.index.search(question, top_k=top_k)
-                context = format_context(retrieved) if retrieved else ""
-            try:
-                answer = st.session_state.llm.generate_answer(
+            if retrieved:
+                # Xếp nguyên đoạn theo score vào ngân sách token của model
+                packed = st.session_state.llm.pack_context(question, retrieved, SYSTEM_PROMPT)
+                retrieved, context = packed["chunks"], packed["context"]
+                tok = packed["tokens"]
+                st.caption(f"Ngữ cảnh: {tok['context']}/{tok['context_budget']} token "
+                           f"({len(retrieved)} đoạn, bỏ {packed['dropped']}); prompt ≈ {tok['prompt']} token"
+                           + ("" if packed["exact"] else " (ước lượng)"))
+        answer_cache = load_answer_cache()
+        cache_args = dict(chunks=retrieved, model=f"{provider}:{model_name}",
+                          temperature=temperature, system_prompt=SYSTEM_PROMPT)
+        try:
+            with tracing.span("answer_cache.lookup") as attrs:
+                answer = answer_cache.get(question, **cache_args)
+                attrs["hit"] = answer is not None
+            if answer is not None:
+                st.markdown(answer)
+                st.caption("⚡ Trả lời từ cache (câu hỏi tương tự, cùng ngữ cảnh).")
+            else:
+                # Hiển thị dần từng đoạn text ngay khi model trả về
+                stream = st.session_state.llm.generate_answer_stream(
                     question=question,
                     context=context,
                     system_prompt=SYSTEM_PROMPT,
                     temperature=temperature
                 )
-                st.markdown(answer)
-                citations = [{"source": r["source"], "score": r["score"]} for r in retrieved] if retrieved else []
-                if citations:
-                    with st.expander("Nguồn trích dẫn"):
-                        for c in citations:
-                            st.write(f"- {c['source']} (score: {c['score']:.3f})")
-            except (requests.exceptions.ReadTimeout, requests.exceptions.ConnectTimeout) as e:
-                st.error("LLM timeout. Thử giảm 'Số đoạn trích dẫn (k)', hoặc hỏi ngắn hơn. Bạn cũng có thể tăng timeout bằng cách đặt GITHUB_MODELS_TIMEOUT_READ trong Secrets (ví dụ 180).")
-                st.caption(f"Chi tiết: {e}")
-                answer, citations = "Xin lỗi, yêu cầu mất quá lâu để xử lý. Vui lòng thử lại.", []
-            except Exception as e:
-                st.error("Có lỗi khi gọi mô hình. Xem Logs để biết chi tiết.")
-                st.caption(f"Chi tiết: {e}")
-                answer, citations = "Xin lỗi, tôi không thể trả lời lúc này.", []
+                answer = st.write_stream(stream)
+                # Hedged: lưu cache theo model đã thực sự trả lời (có thể là provider dự phòng)
+                if getattr(stream, "winner", None):
+                    cache_args["model"] = st.session_state.llm.model_label(stream.winner)
+                if answer:
+                    answer_cache.put(question, answer=answer, **cache_args)
+            citations = [{"source": r["source"], "score": r["score"]} for r in retrieved] if retrieved else []
+            if citations:
+                with st.expander("Nguồn trích dẫn"):
+                    for c in citations:
+                        st.write(f"- {c['source']} (score: {c['score']:.3f})")
+        except (requests.exceptions.ReadTimeout, requests.exceptions.ConnectTimeout) as e:
+            st.error("LLM timeout. Thử giảm 'Số đoạn trích dẫn (k)', hoặc hỏi ngắn hơn. Bạn cũng có thể tăng timeout bằng cách đặt GITHUB_MODELS_TIMEOUT_READ trong Secrets (ví dụ 180).")
+            st.caption(f"Chi tiết: {e}")
+            answer, citations = "Xin lỗi, yêu cầu mất quá lâu để xử lý. Vui lòng thử lại.", []
+        except Exception as e:
+            st.error("Có lỗi khi gọi mô hình. Xem Logs để biết chi tiết.")
+            st.caption(f"Chi tiết: {e}")
+            answer, citations = "Xin lỗi, tôi không thể trả lời lúc này.", []
     st.session_state.messages.append({
         "role": "assistant",
         "content": answer,
         "citations": citations if use_rag else []
     })
+
+# Bảng đo hiệu năng (p50/p95/p99 theo span, tỉ lệ cache hit) cho giảng viên/admin
+with st.sidebar:
+    if is_admin and st.checkbox("📊 Hiện số liệu hiệu năng", value=False):
+        summary = tracing.tracer.summary()
+        if summary:
+            st.dataframe(
+                [{"span": name, "n": row["count"], "lỗi": row["errors"],
+                  "p50 ms": round(row["p50"] * 1e3, 1), "p95 ms": round(row["p95"] * 1e3, 1),
+                  "p99 ms": round(row["p99"] * 1e3, 1)} for name, row in summary.items()],
+                hide_index=True, use_container_width=True,
+            )
+        else:
+            st.caption("Chưa có span nào được ghi.")
+        answer_stats = load_answer_cache().stats()
+        fetches = tracing.tracer.spans("vendor.fetch")
+        reused = sum(1 for s in fetches if s.get("status") in ("not_modified", "unchanged"))
+        gauges = {
+            "answer_cache_hit_rate": answer_stats["hit_rate"],
+            "answer_cache_entries": answer_stats["entries"],
+            "http_cache_hit_rate": reused / len(fetches) if fetches else 0.0,
+        }
+        if generation is not None:
+            gauges["index_generation"] = generation.number
+            gauges["index_age_seconds"] = vendor_sync.status()["age"]
+            search_stats = generation.index.search_cache_stats()
+            searches = search_stats["hits"] + search_stats["misses"]
+            gauges["search_cache_hit_rate"] = search_stats["hits"] / searches if searches else 0.0
+            gauges["search_cache_entries"] = search_stats["entries"]
+        upload_stats = text_cache.stats()
+        lookups = upload_stats["hits"] + upload_stats["misses"]
+        gauges["upload_text_cache_hit_rate"] = upload_stats["hits"] / lookups if lookups else 0.0
+        gauges["upload_text_cache_chars"] = upload_stats["chars"]
+        st.caption(f"Cache câu trả lời: {answer_stats['hit_rate']:.0%} hit "
+                   f"({answer_stats['hits']} khớp, {answer_stats['near_hits']} gần giống, "
+                   f"{answer_stats['misses']} miss, {answer_stats['entries']} mục)")
+        if fetches:
+            st.caption(f"Cache HTTP vendor: {gauges['http_cache_hit_rate']:.0%} trang không phải tải lại "
+                       f"({reused}/{len(fetches)})")
+        if generation is not None and searches:
+            st.caption(f"Cache truy hồi: {gauges['search_cache_hit_rate']:.0%} hit "
+                       f"({search_stats['hits']}/{searches}, {search_stats['entries']} mục)")
+        if lookups:
+            st.caption(f"Cache text upload: {gauges['upload_text_cache_hit_rate']:.0%} hit "
+                       f"({upload_stats['entries']} file, {upload_stats['chars'] / 2 ** 20:.1f}M ký tự)")
+        if isinstance(st.session_state.llm, HedgedProvider):
+            st.dataframe(
+                [{"provider": name, "thắng": row["wins"], "hedge": row["hedged"], "lỗi": row["errors"],
+                  "p95 byte đầu ms": round(row["p95"] * 1e3) if row["p95"] is not None else None,
+                  "deadline ms": round(row["deadline"] * 1e3), "breaker": row["breaker"]}
+                 for name, row in st.session_state.llm.stats().items()],
+                hide_index=True, use_container_width=True,
+            )
+        col_a, col_b = st.columns(2)
+        col_a.download_button("Prometheus", tracing.tracer.to_prometheus(gauges),
+                              file_name="metrics.prom", mime="text/plain")
+        col_b.download_button("JSONL", tracing.tracer.to_jsonl(),
+                              file_name="spans.jsonl", mime="application/json")
@@ -0,0 +1,247 @@
+"""Answer a whole question bank without the Streamlit UI.
+
+Usage (from the repo root):
+    python batch_qa.py questions.jsonl -o answers.jsonl
+    python batch_qa.py faq.csv -o answers.jsonl --providers github,google --rpm 30 --workers 8
+
+Questions come from JSONL (one object per line) or CSV (header row); the
+question is in ``--field`` (default ``question``) and the id in ``id`` (the
+line/row number when missing). Every other field is copied to the output.
+
+Retrieval runs in batches (``SessionIndex.search_batch``: one sparse product
+per batch for TF-IDF) over the same shared index as the app. Generation is
+dispatched to a bounded thread pool; each provider is limited to ``--rpm``
+requests per minute and a question goes to whichever provider has the
+earliest free slot. Each answer is appended to the output as soon as it is
+ready, so the output file is also the checkpoint: rerunning the same command
+skips ids that already have an ``ok`` row and retries the failed ones.
+"""
+import os
+import csv
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Iterator, List, Set
+import tracing
+from prompts import SYSTEM_PROMPT
+
+# Số câu hỏi gọi LLM song song
+BATCH_WORKERS = int(os.getenv("BATCH_QA_WORKERS", "4"))
+# Số request tối đa mỗi phút cho mỗi provider (0 = không giới hạn)
+BATCH_RPM = float(os.getenv("BATCH_QA_RPM", "60"))
+# Số câu hỏi truy hồi chung một lần
+BATCH_SIZE = int(os.getenv("BATCH_QA_SIZE", "32"))
+
+def read_questions(path: str, field: str = "question") -> List[Dict]:
+    """Records from a JSONL or CSV file, each with a unique ``id`` and a non-empty ``field``."""
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    records, seen = [], set()
+    for n, row in enumerate(rows, 1):
+        question = str(row.get(field) or "").strip()
+        if not question:
+            continue
+        rec = dict(row, id=str(row["id"]) if row.get("id") not in (None, "") else str(n))
+        rec[field] = question
+        if rec["id"] in seen:
+            raise ValueError(f"Duplicate question id {rec['id']!r} in {path}.")
+        seen.add(rec["id"])
+        records.append(rec)
+    return records
+
+def done_ids(path: str) -> Set[str]:
+    """Ids already answered in an existing output file (a torn last line is ignored)."""
+    ids = set()
+    if not os.path.exists(path):
+        return ids
+    # Bytes, decoded per line: a crash can tear the last line inside a multi-byte character
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                row = json.loads(line.decode("utf-8"))
+            except ValueError:   # includes UnicodeDecodeError
+                continue
+            if row.get("status") == "ok":
+                ids.add(str(row.get("id")))
+    return ids
+
+class ProviderRateLimiter:
+    """At most ``rpm`` requests per minute per provider, evenly spaced."""
+
+    def __init__(self, rpm: float = BATCH_RPM):
+        self.min_interval = 60.0 / rpm if rpm > 0 else 0.0
+        self._next: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, names: List[str]) -> str:
+        """Wait for the provider (among ``names``) with the earliest free slot and return it."""
+        with self._lock:
+            now = time.monotonic()
+            name = min(names, key=lambda n: self._next.get(n, 0.0))
+            slot = max(now, self._next.get(name, 0.0))
+            self._next[name] = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+        return name
+
+class BatchRunner:
+    """Retrieval in batches, generation in a bounded pool, results appended as JSONL.
+
+    ``llms`` maps a provider name to an ``LLMProvider``-like object
+    (``pack_context`` and ``generate_answer``); ``index`` needs
+    ``search_batch(queries, top_k)``, or is ``None`` to answer without RAG.
+    """
+
+    def __init__(self, llms: Dict, index=None, top_k: int = 4, temperature: float = 0.3,
+                 workers: int = BATCH_WORKERS, rpm: float = BATCH_RPM, batch_size: int = BATCH_SIZE,
+                 field: str = "question", system_prompt: str = SYSTEM_PROMPT):
+        if not llms:
+            raise ValueError("BatchRunner needs at least one LLM provider.")
+        if workers < 1 or batch_size < 1:
+            raise ValueError("workers and batch_size must be >= 1.")
+        self.llms = dict(llms)
+        self.index = index
+        self.top_k = top_k
+        self.temperature = temperature
+        self.workers = workers
+        self.batch_size = batch_size
+        self.field = field
+        self.system_prompt = system_prompt
+        self.limiter = ProviderRateLimiter(rpm)
+        self._write_lock = threading.Lock()
+        self.counts = {"ok": 0, "error": 0, "skipped": 0}
+
+    def _retrieve(self, records: List[Dict]) -> Iterator[tuple]:
+        for start in range(0, len(records), self.batch_size):
+            batch = records[start:start + self.batch_size]
+            if self.index is None:
+                hits = [[] for _ in batch]
+            else:
+                hits = self.index.search_batch([r[self.field] for r in batch], top_k=self.top_k)
+            yield from zip(batch, hits)
+
+    def answer(self, record: Dict, chunks: List) -> Dict:
+        """One output row: the input record plus answer, citations and timing."""
+        question = record[self.field]
+        name = self.limiter.acquire(list(self.llms))
+        llm = self.llms[name]
+        t = time.perf_counter()
+        row = dict(record, provider=name)
+        try:
+            with tracing.trace(), tracing.span("batch.answer", provider=name):
+                context = ""
+                if chunks:
+                    packed = llm.pack_context(question, chunks, self.system_prompt)
+                    chunks, context = packed["chunks"], packed["context"]
+                answer = llm.generate_answer(question=question, context=context,
+                                             system_prompt=self.system_prompt, temperature=self.temperature)
+            row.update(status="ok", answer=answer,
+                       citations=[{"source": c["source"], "score": round(float(c["score"]), 4)} for c in chunks])
+        except Exception as e:
+            row.update(status="error", error=f"{type(e).__name__}: {e}")
+        row["elapsed"] = round(time.perf_counter() - t, 3)
+        return row
+
+    def _write(self, out, row: Dict):
+        with self._write_lock:
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            out.flush()
+            self.counts[row["status"]] += 1
+
+    def run(self, records: List[Dict], output: str, progress=None) -> Dict[str, int]:
+        """Answer ``records`` not yet ``ok`` in ``output``; returns counts of ok/error/skipped rows."""
+        finished = done_ids(output)
+        todo = [r for r in records if r["id"] not in finished]
+        self.counts["skipped"] += len(records) - len(todo)
+        max_pending = self.workers * 2   # bounds memory: retrieval runs at most this far ahead
+        # A run killed mid-write leaves a torn last line: start the new rows on a line of their own.
+        # The last byte is checked in binary, as the tear may split a multi-byte character.
+        torn = False
+        if os.path.exists(output):
+            with open(output, "rb") as f:
+                if f.seek(0, os.SEEK_END):
+                    f.seek(-1, os.SEEK_END)
+                    torn = f.read(1) != b"\n"
+        with open(output, "a", encoding="utf-8") as out, ThreadPoolExecutor(self.workers) as pool:
+            if torn:
+                out.write("\n")
+            pending = set()
+            try:
+                for record, chunks in self._retrieve(todo):
+                    if len(pending) >= max_pending:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for fut in done:
+                            self._write(out, fut.result())
+                            if progress:
+                                progress(self.counts)
+                    pending.add(pool.submit(self.answer, record, chunks))
+                for fut in pending:
+                    self._write(out, fut.result())
+                    if progress:
+                        progress(self.counts)
+            except KeyboardInterrupt:
+                # Answers already written stay as the checkpoint; in-flight ones are redone on resume
+                for fut in pending:
+                    fut.cancel()
+                raise
+        return dict(self.counts)
+
+def load_index(backend: str, use_local: bool = True, use_vendor: bool = True):
+    """The app's shared index (data/ + cached vendor pages) behind a ``SessionIndex``."""
+    from rag import SessionIndex
+    from vendor_sync import VendorSync
+    index = SessionIndex(VendorSync().current.index)
+    index.set_backend(backend)
+    index.use_local = use_local
+    index.use_vendor = use_vendor
+    return index
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("questions", help="JSONL or CSV file of questions")
+    ap.add_argument("-o", "--output", required=True, help="JSONL answers (appended; also the resume checkpoint)")
+    ap.add_argument("--field", default="question", help="name of the question field/column")
+    ap.add_argument("--providers", default=os.getenv("PROVIDER", "github"),
+                    help="comma-separated providers to spread questions over (github, google)")
+    ap.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    ap.add_argument("--rpm", type=float, default=BATCH_RPM, help="requests per minute per provider (0 = no limit)")
+    ap.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    ap.add_argument("--top-k", type=int, default=4)
+    ap.add_argument("--temperature", type=float, default=0.3)
+    ap.add_argument("--backend", default="tfidf", help="retrieval backend (tfidf, bm25, hybrid)")
+    ap.add_argument("--no-rag", action="store_true", help="answer without retrieved context")
+    ap.add_argument("--no-local", action="store_true", help="skip data/ documents")
+    ap.add_argument("--no-vendor", action="store_true", help="skip vendor pages")
+    args = ap.parse_args()
+
+    from models import LLMProvider
+    records = read_questions(args.questions, args.field)
+    llms = {name: LLMProvider(name) for name in dict.fromkeys(p.strip() for p in args.providers.split(",") if p.strip())}
+    index = None if args.no_rag else load_index(args.backend, not args.no_local, not args.no_vendor)
+    runner = BatchRunner(llms, index, top_k=args.top_k, temperature=args.temperature, workers=args.workers,
+                         rpm=args.rpm, batch_size=args.batch_size, field=args.field)
+    start = time.perf_counter()
+
+    def progress(counts):
+        print(f"\r{counts['ok'] + counts['error']}/{len(records) - counts['skipped']} "
+              f"(ok {counts['ok']}, error {counts['error']})", end="", flush=True)
+
+    try:
+        counts = runner.run(records, args.output, progress=progress)
+    except KeyboardInterrupt:
+        print(f"\nInterrupted; rerun the same command to resume from {args.output}.")
+        raise SystemExit(130)
+    finally:
+        for llm in llms.values():
+            llm.close()
+    print(f"\n{counts['ok']} ok, {counts['error']} errors, {counts['skipped']} already answered "
+          f"in {time.perf_counter() - start:.1f}s -> {args.output}")
+    raise SystemExit(1 if counts["error"] else 0)
+
+if __name__ == "__main__":
+    main()
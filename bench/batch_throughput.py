@@ -0,0 +1,89 @@
+"""Batch Q&A throughput against the stub LLM, plus an interrupted-run resume check.
+
+Usage (from the repo root):
+    python -m bench.batch_throughput --questions 200 --latency 0.2 --workers 1 4 16
+    python -m bench.batch_throughput --rpm 120          # show the per-provider limit holding
+
+Questions are the labelled ones in ``bench/questions.jsonl`` repeated up to
+``--questions``. Retrieval uses the real shared index (data/ + cached vendor
+pages); generation goes through ``LLMProvider("github")`` to the in-process
+stub from ``bench.stub_llm``, so only the runner's scheduling differs between
+rows. The resume check fails a fraction of calls with 429 (one attempt per
+call), reruns the same command until no errors are left and verifies that
+every id ends up answered exactly once.
+"""
+import os
+import json
+import time
+import argparse
+import tempfile
+from bench.stub_llm import start_stub
+
+def questions(n: int):
+    with open(os.path.join("bench", "questions.jsonl"), "r", encoding="utf-8") as f:
+        base = [json.loads(line)["question"] for line in f if line.strip()]
+    return [{"id": str(i), "question": base[i % len(base)]} for i in range(n)]
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--questions", type=int, default=200)
+    ap.add_argument("--latency", type=float, default=0.2, help="stub time to first byte (s)")
+    ap.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    ap.add_argument("--rpm", type=float, default=0.0, help="per-provider limit (0 = none)")
+    ap.add_argument("--batch-size", type=int, default=32)
+    ap.add_argument("--fail-rate", type=float, default=0.2, help="429 fraction for the resume check")
+    args = ap.parse_args()
+
+    server, base_url, cfg = start_stub(latency=args.latency, retry_after=0)
+    os.environ.update(GITHUB_MODELS_BASE_URL=base_url, GITHUB_MODELS_TOKEN="bench",
+                      GITHUB_MODELS_POOL_SIZE=str(max(args.workers)))
+    from models import LLMProvider
+    from batch_qa import BatchRunner, load_index
+
+    t = time.perf_counter()
+    index = load_index("tfidf")
+    print(f"index ready in {time.perf_counter() - t:.1f}s")
+    records = questions(args.questions)
+    t = time.perf_counter()
+    index.search_batch([r["question"] for r in records], top_k=4)
+    print(f"retrieval only: {len(records) / (time.perf_counter() - t):.0f} questions/s\n")
+
+    print(f"{'workers':>7} {'q/s':>8} {'wall s':>7} {'ok':>5} {'errors':>6}  (stub latency {args.latency * 1e3:.0f} ms"
+          + (f", {args.rpm:g} rpm)" if args.rpm else ")"))
+    llm = LLMProvider("github")
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as d:
+            runner = BatchRunner({"github": llm}, index, workers=workers, rpm=args.rpm, batch_size=args.batch_size)
+            t = time.perf_counter()
+            counts = runner.run(records, os.path.join(d, "answers.jsonl"))
+            wall = time.perf_counter() - t
+        print(f"{workers:>7} {len(records) / wall:>8.1f} {wall:>7.1f} {counts['ok']:>5} {counts['error']:>6}")
+    llm.close()
+
+    # Resume: failed rows are retried on the next run, ok rows are never redone
+    os.environ["GITHUB_MODELS_RETRIES"] = "1"   # a single attempt: 429s surface as errors
+    cfg.rate_limit = args.fail_rate
+    llm = LLMProvider("github")
+    workers = max(args.workers)
+    with tempfile.TemporaryDirectory() as d:
+        out = os.path.join(d, "answers.jsonl")
+        runs = []
+        for _ in range(20):
+            before = cfg.requests
+            counts = BatchRunner({"github": llm}, index, workers=workers, rpm=0).run(records, out)
+            runs.append((counts["ok"], counts["error"], cfg.requests - before))
+            if not counts["error"]:
+                break
+        with open(out, "r", encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f]
+    llm.close()
+    ok_ids = [r["id"] for r in rows if r["status"] == "ok"]
+    print(f"\nresume with {args.fail_rate:.0%} failures: "
+          + " -> ".join(f"{ok} ok/{err} err ({calls} calls)" for ok, err, calls in runs))
+    complete = sorted(ok_ids) == sorted(r["id"] for r in records)
+    print(f"every id answered exactly once: {complete}")
+    server.shutdown()
+    raise SystemExit(0 if complete else 1)
+
+if __name__ == "__main__":
+    main()
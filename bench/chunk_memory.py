@@ -0,0 +1,97 @@
+"""Memory of the chunk store vs. the previous list of ``{text, source}`` dicts.
+
+Usage (from the repo root):
+    python -m bench.chunk_memory --chunks 100000 --sources 2000
+
+Chunks are copies of the data/ corpus' own chunks (distinct string objects,
+as after extraction), spread over ``--sources`` source names. Reports the
+Python heap used by each layout (tracemalloc), build time, the cost of
+reading ``--reads`` random rows as search results, and the on-disk size of
+the snapshot columns vs. the former ``chunks.json``.
+"""
+import os
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+from rag import RAGIndex
+from chunk_store import ChunkStore
+
+def corpus(args):
+    idx = RAGIndex(data_dir=args.data_dir, cache_dir=None, dedup=False)
+    idx.build()
+    texts = list(idx._chunks.texts())
+    sources = [f"data/source_{i:05d}.pdf" for i in range(args.sources)]
+    # "".join(list(...)) forces a new str object per row, like freshly extracted text
+    return [("".join(list(texts[i % len(texts)])), sources[i % len(sources)]) for i in range(args.chunks)]
+
+def measure(build):
+    tracemalloc.start()
+    t = time.perf_counter()
+    obj = build()
+    elapsed = time.perf_counter() - t
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, size, elapsed
+
+def _fill(store: ChunkStore, rows):
+    for text, source in rows:
+        store.append(text, source)
+    return store
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--data-dir", default="data")
+    ap.add_argument("--chunks", type=int, default=100_000)
+    ap.add_argument("--sources", type=int, default=2000)
+    ap.add_argument("--reads", type=int, default=20_000)
+    ap.add_argument("--seed", type=int, default=302)
+    args = ap.parse_args()
+
+    rows = corpus(args)
+    text_bytes = sum(len(t.encode("utf-8")) for t, _ in rows)
+    print(f"{len(rows)} chunks, {args.sources} sources, {text_bytes / 2 ** 20:.1f} MiB of UTF-8 text\n")
+
+    # The text objects already exist in both cases; the dict layout keeps them,
+    # the store copies them into its buffer and lets them go.
+    dicts, dict_mem, dict_s = measure(lambda: [{"text": "".join(list(t)), "source": s} for t, s in rows])
+    store, store_mem, store_s = measure(lambda: _fill(ChunkStore(), rows))
+
+    picks = np.random.default_rng(args.seed).integers(0, len(rows), size=args.reads)
+    t = time.perf_counter()
+    for r in picks:
+        dict(dicts[r], score=0.0)
+    dict_read = (time.perf_counter() - t) / args.reads
+    t = time.perf_counter()
+    for r in picks:
+        store.view(int(r), 0.0)
+    store_read = (time.perf_counter() - t) / args.reads
+
+    with tempfile.TemporaryDirectory() as d:
+        json_path = os.path.join(d, "chunks.json")
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump([x["text"] for x in dicts], f, ensure_ascii=False)
+        json_disk = os.path.getsize(json_path)
+        store.save(d, "chunks")
+        store_disk = sum(os.path.getsize(os.path.join(d, n)) for n in os.listdir(d) if n.startswith("chunks_"))
+        t = time.perf_counter()
+        with open(json_path, "r", encoding="utf-8") as f:
+            json.load(f)
+        json_load = time.perf_counter() - t
+        t = time.perf_counter()
+        ChunkStore.load(d, "chunks")
+        store_load = time.perf_counter() - t
+
+    print(f"{'layout':<14} {'heap MiB':>9} {'B/chunk':>8} {'build s':>8} {'read us':>8} {'disk MiB':>9} {'load ms':>8}")
+    for name, mem, build_s, read, disk, load in (
+        ("list[dict]", dict_mem, dict_s, dict_read, json_disk, json_load),
+        ("ChunkStore", store_mem, store_s, store_read, store_disk, store_load),
+    ):
+        print(f"{name:<14} {mem / 2 ** 20:>9.1f} {mem / len(rows):>8.0f} {build_s:>8.2f} {read * 1e6:>8.2f} "
+              f"{disk / 2 ** 20:>9.1f} {load * 1e3:>8.1f}")
+    print(f"\nheap ratio: {dict_mem / max(store_mem, 1):.2f}x smaller with ChunkStore")
+
+if __name__ == "__main__":
+    main()
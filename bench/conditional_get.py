@@ -0,0 +1,109 @@
+"""Conditional GET of vendor pages (``web_ingest.fetch_page``) against a stub server.
+
+Usage (from the repo root):
+    python -m bench.conditional_get
+
+A local HTTP server serves one HTML page with an ``ETag`` and
+``Last-Modified`` and answers 304 when ``If-None-Match`` matches. The check
+walks the page through its life and fails (exit 1) if any step differs:
+
+1. first fetch: no validators sent, ``fetched``.
+2. refetch: ``If-None-Match``/``If-Modified-Since`` sent, 304, ``not_modified``.
+3. new ETag, same body: ``unchanged`` (nothing re-extracted).
+4. new ETag, new body: ``fetched`` with the new text.
+5. server down: ``stale`` with the cached text.
+"""
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from web_ingest import HttpCache, fetch_page
+
+PAGE = ("<html><head><title>{title}</title></head><body><article><h1>{title}</h1>"
+        "<p>{body}</p></article></body></html>")
+
+class PageState:
+    def __init__(self):
+        self.etag = '"v1"'
+        self.last_modified = "Wed, 01 Oct 2025 08:00:00 GMT"
+        self.body = "Express middleware nhận req, res và next; gọi next() để chuyển sang middleware tiếp theo."
+        self.seen = []   # request headers, one dict per request
+
+    def html(self) -> bytes:
+        return PAGE.format(title="Express middleware", body=self.body).encode("utf-8")
+
+def start_server(state: PageState):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            state.seen.append(dict(self.headers))
+            if self.headers.get("If-None-Match") == state.etag:
+                self.send_response(304)
+                self.send_header("ETag", state.etag)
+                self.end_headers()
+                return
+            body = state.html()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("ETag", state.etag)
+            self.send_header("Last-Modified", state.last_modified)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    state = PageState()
+    server = start_server(state)
+    url = f"http://127.0.0.1:{server.server_port}/guide/middleware"
+    failures = []
+
+    def check(step: str, page: dict, status: str, cond: bool = True, sent=None):
+        sent = state.seen[-1] if sent is None else sent
+        validators = [h for h in ("If-None-Match", "If-Modified-Since") if h in sent]
+        ok = page["status"] == status and cond
+        print(f"{'ok  ' if ok else 'FAIL'} {step:<28} status={page['status']:<13} "
+              f"sent={','.join(validators) or '-':<30} {page['detail']}")
+        if not ok:
+            failures.append(step)
+
+    with tempfile.TemporaryDirectory() as d, requests.Session() as session:
+        cache = HttpCache(d)
+        fetch = lambda: fetch_page(url, session, cache, timeout=5)
+
+        first = fetch()
+        check("first fetch", first, "fetched", "middleware" in first["text"]
+              and "If-None-Match" not in state.seen[-1])
+
+        again = fetch()
+        sent = state.seen[-1]
+        check("refetch", again, "not_modified", again["text"] == first["text"]
+              and sent.get("If-None-Match") == '"v1"' and sent.get("If-Modified-Since") == state.last_modified)
+
+        state.etag = '"v2"'
+        same = fetch()
+        check("new etag, same body", same, "unchanged", same["text"] == first["text"])
+        check("  then 304 on the new etag", fetch(), "not_modified", state.seen[-1].get("If-None-Match") == '"v2"')
+
+        state.etag = '"v3"'
+        state.body = "Router-level middleware được gắn vào express.Router() thay vì app."
+        changed = fetch()
+        check("new etag, new body", changed, "fetched", "Router-level" in changed["text"])
+
+        server.shutdown()
+        server.server_close()
+        down = fetch()
+        check("server down", down, "stale", down["text"] == changed["text"], sent={})
+
+    print(f"\n{len(state.seen)} requests to the stub")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
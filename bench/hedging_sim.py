@@ -0,0 +1,136 @@
+"""Hedged requests vs. a single provider, with local fake providers.
+
+Usage (from the repo root):
+    python -m bench.hedging_sim --requests 300 --slow-prob 0.03
+    python -m bench.hedging_sim --outage 50 120      # primary fails for requests 50..119
+
+The fake primary answers after a lognormal time to first byte, and with
+probability ``--slow-prob`` it is ``--slow-factor`` times slower (a tail like
+a congested backend). The fake secondary is slower on average but has no
+tail. Reports time to first piece and to the full answer for the primary
+alone and for ``HedgedProvider`` (p95-based hedge deadline plus circuit
+breaker), and how many requests fired a second call. Then checks that a
+half-open trial abandoned mid-stream frees its circuit (exit 1 if not).
+"""
+import time
+import argparse
+import numpy as np
+from hedging import HedgedProvider, LatencyTracker, CircuitBreaker
+
+class FakeProvider:
+    """Streams a fixed answer after a random delay; fails while ``down`` is set."""
+
+    def __init__(self, name: str, ttfb: float, sigma: float = 0.3, slow_prob: float = 0.0,
+                 slow_factor: float = 10.0, token_delay: float = 0.002, pieces: int = 20, seed: int = 302):
+        self.provider = name
+        self.ttfb = ttfb
+        self.sigma = sigma
+        self.slow_prob = slow_prob
+        self.slow_factor = slow_factor
+        self.token_delay = token_delay
+        self.pieces = pieces
+        self.rng = np.random.default_rng(seed)
+        self.down = False
+        self.calls = 0
+
+    def generate_answer_stream(self, question, context, system_prompt, temperature=0.3):
+        self.calls += 1
+        delay = self.ttfb * float(self.rng.lognormal(0.0, self.sigma))
+        if self.rng.random() < self.slow_prob:
+            delay *= self.slow_factor
+        down = self.down
+        return self._stream(delay, down)
+
+    def _stream(self, delay: float, down: bool):
+        time.sleep(delay if not down else min(delay, 0.05))
+        if down:
+            raise ConnectionError(f"{self.provider} is down")
+        for i in range(self.pieces):
+            yield f"{self.provider}-{i} "
+            time.sleep(self.token_delay)
+
+    def generate_answer(self, question, context, system_prompt, temperature=0.3):
+        return "".join(self.generate_answer_stream(question, context, system_prompt, temperature))
+
+def run(llm, n: int, outage, primary: FakeProvider):
+    ttfb, total, failed = [], [], 0
+    for i in range(n):
+        primary.down = outage is not None and outage[0] <= i < outage[1]
+        t = time.perf_counter()
+        first = None
+        try:
+            for _ in llm.generate_answer_stream("q", "", "sys"):
+                if first is None:
+                    first = time.perf_counter() - t
+        except Exception:
+            failed += 1
+            continue
+        ttfb.append(first)
+        total.append(time.perf_counter() - t)
+    return np.array(ttfb), np.array(total), failed
+
+def report(name: str, ttfb, total, failed: int, extra: str = ""):
+    q = lambda a, p: np.percentile(a, p) * 1e3 if len(a) else float("nan")
+    print(f"{name:<12} {q(ttfb, 50):>8.0f} {q(ttfb, 95):>8.0f} {q(ttfb, 99):>8.0f} "
+          f"{q(total, 50):>8.0f} {q(total, 99):>8.0f} {failed:>6}  {extra}")
+
+def check_abandoned_trial() -> bool:
+    """A half-open trial whose stream the caller closes early must not keep the circuit shut.
+
+    Streamlit closes the answer stream when a rerun interrupts it; the
+    primary's trial slot has to be freed so its next call is let through.
+    """
+    primary, secondary = FakeProvider("primary", 0.01), FakeProvider("secondary", 0.01, seed=303)
+    breaker = CircuitBreaker(failures=1, cooldown=0.05)
+    hedged = HedgedProvider([primary, secondary], tracker=LatencyTracker(default_delay=1.0), breaker=breaker)
+    primary.down = True
+    backup = hedged.generate_answer_stream("q", "", "sys")
+    "".join(backup)                            # primary fails, opens its circuit; secondary answers
+    time.sleep(0.06)                           # cooldown over: the next call is the half-open trial
+    primary.down = False
+    trial = hedged.generate_answer_stream("q", "", "sys")
+    next(trial)
+    trial.close()                              # consumer goes away mid-answer
+    allowed = breaker.allow("primary")
+    breaker.release("primary")
+    ok = allowed and backup.winner == "secondary" and trial.winner == "primary"
+    print(f"\nabandoned half-open trial: winners {backup.winner}/{trial.winner}, "
+          f"primary allowed afterwards: {allowed} -> {'ok' if ok else 'FAIL'}")
+    return ok
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--primary-ttfb", type=float, default=0.05)
+    ap.add_argument("--secondary-ttfb", type=float, default=0.08)
+    ap.add_argument("--slow-prob", type=float, default=0.03)
+    ap.add_argument("--slow-factor", type=float, default=10.0)
+    ap.add_argument("--outage", type=int, nargs=2, metavar=("START", "END"),
+                    help="request indexes during which the primary fails")
+    ap.add_argument("--min-samples", type=int, default=20)
+    args = ap.parse_args()
+
+    def providers():
+        return (FakeProvider("primary", args.primary_ttfb, slow_prob=args.slow_prob, slow_factor=args.slow_factor),
+                FakeProvider("secondary", args.secondary_ttfb, seed=303))
+
+    print(f"{'mode':<12} {'ttfb p50':>8} {'p95':>8} {'p99':>8} {'total p50':>8} {'p99':>8} {'failed':>6}  (ms)")
+    primary, _ = providers()
+    report("primary", *run(primary, args.requests, args.outage, primary))
+
+    primary, secondary = providers()
+    tracker = LatencyTracker(min_samples=args.min_samples, default_delay=args.primary_ttfb * 3, min_delay=0.0)
+    # Short cooldown so the simulated outage shows close -> open -> half-open -> close
+    hedged = HedgedProvider([primary, secondary], tracker=tracker, breaker=CircuitBreaker(cooldown=1.0))
+    ttfb, total, failed = run(hedged, args.requests, args.outage, primary)
+    stats = hedged.stats()
+    report("hedged", ttfb, total, failed,
+           f"secondary calls {secondary.calls} ({secondary.calls / args.requests:.0%}), "
+           f"primary calls {primary.calls}, deadline {stats['primary']['deadline'] * 1e3:.0f} ms")
+    for name, row in stats.items():
+        print(f"  {name:<10} wins {row['wins']:>4}  hedged {row['hedged']:>4}  errors {row['errors']:>3}  "
+              f"breaker {row['breaker']}")
+    raise SystemExit(0 if check_abandoned_trial() else 1)
+
+if __name__ == "__main__":
+    main()
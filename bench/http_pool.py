@@ -0,0 +1,118 @@
+"""LLM call overhead: fresh connection per call vs pooled session vs async.
+
+Usage (from the repo root):
+    python -m bench.http_pool --requests 200 --concurrency 16 --latency 0.05
+
+Runs against the in-process stub from ``bench.stub_llm`` so that only client
+overhead (TCP/TLS setup, retries, scheduling) differs between the modes.
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from bench.stub_llm import start_stub
+
+def percentile(values, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+def report(name: str, results, wall: float, connections: int):
+    latencies = [t for t, ok in results]
+    failed = sum(1 for _, ok in results if not ok)
+    print(f"{name:<18} {len(latencies) / wall:>8.1f} {statistics.mean(latencies) * 1e3:>9.1f} "
+          f"{percentile(latencies, 0.95) * 1e3:>9.1f} {connections:>6} {failed:>7}")
+
+def timed_call(call):
+    t = time.perf_counter()
+    try:
+        call()
+        ok = True
+    except Exception:
+        ok = False
+    return time.perf_counter() - t, ok
+
+def run_threads(call, n: int, concurrency: int):
+    def one(_):
+        return timed_call(call)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(one, range(n)))
+    return latencies, time.perf_counter() - start
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--latency", type=float, default=0.05, help="stub time to first byte (s)")
+    ap.add_argument("--rate-limit", type=float, default=0.0, help="fraction of 429 responses")
+    args = ap.parse_args()
+
+    server, base_url, cfg = start_stub(latency=args.latency, rate_limit=args.rate_limit, retry_after=0)
+    os.environ.update(GITHUB_MODELS_BASE_URL=base_url, GITHUB_MODELS_TOKEN="bench",
+                      GITHUB_MODELS_POOL_SIZE=str(args.concurrency), GITHUB_MODELS_BACKOFF_BASE="1.1")
+    from models import LLMProvider
+    url = f"{base_url}/chat/completions"
+    payload = {"model": "stub", "messages": [{"role": "user", "content": "ping"}]}
+
+    print(f"{'mode':<18} {'req/s':>8} {'mean ms':>9} {'p95 ms':>9} {'conns':>6} {'failed':>7}")
+
+    # 1. Legacy: requests.post opens a new connection for every call
+    before = cfg.connections
+    def legacy_call():
+        resp = requests.post(url, data=json.dumps(payload), timeout=30)
+        resp.raise_for_status()
+        return resp.json()
+
+    lat, wall = run_threads(legacy_call, args.requests, args.concurrency)
+    report("requests.post", lat, wall, cfg.connections - before)
+
+    # 2. Pooled keep-alive session with adapter-level retries
+    llm = LLMProvider("github")
+    before = cfg.connections
+    lat, wall = run_threads(lambda: llm.generate_answer("ping", "", "You are a stub."),
+                            args.requests, args.concurrency)
+    report("pooled session", lat, wall, cfg.connections - before)
+    llm.close()
+
+    # 3. aiohttp: one event loop, concurrency bounded by a semaphore
+    try:
+        import aiohttp  # noqa: F401
+    except ImportError:
+        print("async (aiohttp)    skipped: aiohttp is not installed")
+        server.shutdown()
+        return
+
+    async def run_async():
+        sem = asyncio.Semaphore(args.concurrency)
+
+        async def one():
+            async with sem:
+                t = time.perf_counter()
+                try:
+                    await llm.agenerate_answer("ping", "", "You are a stub.")
+                    ok = True
+                except Exception:
+                    ok = False
+                return time.perf_counter() - t, ok
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*(one() for _ in range(args.requests)))
+        wall = time.perf_counter() - start
+        await llm.aclose()
+        return latencies, wall
+
+    llm = LLMProvider("github")
+    before = cfg.connections
+    lat, wall = asyncio.run(run_async())
+    report("async (aiohttp)", lat, wall, cfg.connections - before)
+    if cfg.throttled:
+        print(f"\n{cfg.throttled} of {cfg.requests} stub responses were 429 (retried by the clients "
+              f"except plain requests.post)")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
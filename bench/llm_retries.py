@@ -0,0 +1,91 @@
+"""Retry behaviour of ``LLMProvider`` against the stub LLM.
+
+Usage (from the repo root):
+    python -m bench.llm_retries --retries 3
+
+Each scenario points a fresh ``LLMProvider("github")`` at the in-process stub
+from ``bench.stub_llm`` and checks how many requests reached the stub, what
+was raised and how long it took; exit 1 if any scenario differs:
+
+- stalled response (stub slower than ``GITHUB_MODELS_TIMEOUT_READ``), plain,
+  streaming and async: retried ``--retries`` times, then ``ReadTimeout``.
+- 429 with a fractional ``Retry-After`` ("0.2"): obeyed, retried.
+- 429 with ``Retry-After: 3600``: retried after at most ``LLM_RETRY_MAX_WAIT``.
+- 429 with an unparseable ``Retry-After``: retried with jittered backoff.
+"""
+import os
+import time
+import asyncio
+import argparse
+from bench.stub_llm import start_stub
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--retries", type=int, default=3)
+    ap.add_argument("--read-timeout", type=float, default=0.3)
+    ap.add_argument("--max-wait", type=float, default=0.5, help="LLM_RETRY_MAX_WAIT for the run")
+    args = ap.parse_args()
+
+    server, base_url, cfg = start_stub(latency=0.0)
+    # Timed-out requests leave the stub writing to closed sockets; not worth a traceback
+    server.handle_error = lambda request, client_address: None
+    os.environ.update(GITHUB_MODELS_BASE_URL=base_url, GITHUB_MODELS_TOKEN="bench",
+                      GITHUB_MODELS_RETRIES=str(args.retries), GITHUB_MODELS_BACKOFF_BASE="1.1",
+                      GITHUB_MODELS_TIMEOUT_READ=str(args.read_timeout), LLM_RETRY_MAX_WAIT=str(args.max_wait))
+    import requests
+    from models import LLMProvider
+
+    def plain(llm):
+        return llm.generate_answer("q", "", "s")
+
+    def stream(llm):
+        return "".join(llm.generate_answer_stream("q", "", "s"))
+
+    def run_async(llm):
+        async def go():
+            try:
+                return await llm.agenerate_answer("q", "", "s")
+            finally:
+                await llm.aclose()
+        return asyncio.run(go())
+
+    # (name, stub settings, call, expected exception name, max seconds)
+    n, wait = args.retries, args.max_wait
+    stall = dict(latency=args.read_timeout * 3, rate_limit=0.0)
+    scenarios = [
+        ("stalled response", stall, plain, "ReadTimeout", None),
+        ("stalled stream", stall, stream, "ReadTimeout", None),
+        ("stalled async", stall, run_async, "TimeoutError", None),
+        ("Retry-After 0.2", dict(latency=0.0, rate_limit=1.0, retry_after="0.2"), plain, "RuntimeError",
+         0.2 * (n - 1) + 1.0),
+        ("Retry-After 3600", dict(latency=0.0, rate_limit=1.0, retry_after="3600"), plain, "RuntimeError",
+         wait * (n - 1) + 1.0),
+        ("Retry-After garbage", dict(latency=0.0, rate_limit=1.0, retry_after="soon"), plain, "RuntimeError",
+         wait * (n - 1) + 1.0),
+    ]
+    failures = 0
+    print(f"{'scenario':<22} {'requests':>8} {'seconds':>8}  raised")
+    for name, settings, call, expected, max_seconds in scenarios:
+        for k, v in settings.items():
+            setattr(cfg, k, v)
+        llm = LLMProvider("github")
+        before = cfg.requests
+        t = time.perf_counter()
+        try:
+            call(llm)
+            raised = "-"
+        except (requests.exceptions.RequestException, RuntimeError, asyncio.TimeoutError) as e:
+            raised = type(e).__name__
+        elapsed = time.perf_counter() - t
+        llm.close()
+        requests_seen = cfg.requests - before
+        # asyncio.TimeoutError subclasses (aiohttp's ServerTimeoutError) count as a timeout
+        ok = (requests_seen == n and (raised == expected or expected == "TimeoutError" and "Timeout" in raised)
+              and (max_seconds is None or elapsed <= max_seconds))
+        failures += not ok
+        print(f"{name:<22} {requests_seen:>8} {elapsed:>8.2f}  {raised:<22} {'ok' if ok else 'FAIL'}")
+    server.shutdown()
+    raise SystemExit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Load test of ``server.py`` against the stub LLM: throughput, tail latency, coalescing, 503s.
+
+Usage (from the repo root, needs ``aiohttp``):
+    python -m bench.load_test --requests 400 --concurrency 32 --latency 0.3
+
+Starts the stub from ``bench.stub_llm`` in-process and ``server.py`` as a
+subprocess pointed at it, then runs with an ``aiohttp`` client:
+
+- ``search``: ``GET /search`` over the labelled questions.
+- ``answer distinct``: streaming ``/answer``, every question different.
+- ``answer hot``: streaming ``/answer``, everyone asks the same question at
+  once; run with single-flight on and off (``API_SINGLE_FLIGHT``) to show the
+  upstream calls it saves.
+- ``overload``: a server with ``--overload-limit`` LLM slots and queue;
+  requests beyond that are answered 503 quickly instead of piling up.
+
+Reports requests/s, p50/p95/p99 latency, time to the first answer piece,
+503s, errors and upstream (stub) LLM calls per scenario.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import subprocess
+from contextlib import contextmanager
+import numpy as np
+import aiohttp
+from bench.stub_llm import start_stub
+
+def questions():
+    with open(os.path.join("bench", "questions.jsonl"), "r", encoding="utf-8") as f:
+        return [json.loads(line)["question"] for line in f if line.strip()]
+
+@contextmanager
+def run_server(port: int, stub_url: str, **env):
+    env = dict(os.environ, GITHUB_MODELS_BASE_URL=stub_url, GITHUB_MODELS_TOKEN="bench", PROVIDER="github",
+               GITHUB_MODELS_POOL_SIZE="256", VENDOR_SYNC_INTERVAL="86400", **{k: str(v) for k, v in env.items()})
+    proc = subprocess.Popen([sys.executable, "server.py", "--host", "127.0.0.1", "--port", str(port)], env=env,
+                            stdout=subprocess.DEVNULL)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+async def wait_ready(base: str, timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as s:
+        while time.monotonic() < deadline:
+            try:
+                async with s.get(f"{base}/healthz") as r:
+                    if r.status == 200:
+                        return
+            except aiohttp.ClientConnectionError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("server did not become ready")
+
+async def one_search(s, base: str, q: str):
+    t = time.perf_counter()
+    async with s.get(f"{base}/search", params={"q": q, "k": "4"}) as r:
+        await r.read()
+        return r.status, time.perf_counter() - t, None
+
+async def one_answer(s, base: str, q: str):
+    t = time.perf_counter()
+    first = None
+    async with s.post(f"{base}/answer", json={"question": q}) as r:
+        if r.status != 200:
+            await r.read()
+            return r.status, time.perf_counter() - t, None
+        event = None
+        async for raw in r.content:
+            line = raw.decode("utf-8").strip()
+            if line.startswith("event: "):
+                event = line[7:]
+                if event == "message" and first is None:
+                    first = time.perf_counter() - t
+                elif event == "error":
+                    return 502, time.perf_counter() - t, first
+    return 200, time.perf_counter() - t, first
+
+async def scenario(base: str, call, items, concurrency: int):
+    sem = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=120)) as s:
+        async def run(q):
+            async with sem:
+                try:
+                    return await call(s, base, q)
+                except aiohttp.ClientError:
+                    return 0, 0.0, None
+        start = time.perf_counter()
+        results = await asyncio.gather(*(run(q) for q in items))
+        return results, time.perf_counter() - start
+
+def report(name: str, results, wall: float, upstream: int):
+    ok = [r for r in results if r[0] == 200]
+    lat = np.array([r[1] for r in ok]) * 1e3
+    ttfb = np.array([r[2] for r in ok if r[2] is not None]) * 1e3
+    q = lambda a, p: f"{np.percentile(a, p):.0f}" if len(a) else "-"
+    busy = sum(1 for r in results if r[0] == 503)
+    errors = len(results) - len(ok) - busy
+    print(f"{name:<22} {len(ok) / wall:>7.1f} {q(lat, 50):>6} {q(lat, 95):>6} {q(lat, 99):>6} "
+          f"{q(ttfb, 50):>6} {q(ttfb, 99):>6} {busy:>5} {errors:>5} {upstream:>8}")
+
+async def main_async(args, cfg, stub_url):
+    qs = questions()
+    print(f"{'scenario':<22} {'req/s':>7} {'p50':>6} {'p95':>6} {'p99':>6} {'ttfb50':>6} {'ttfb99':>6} "
+          f"{'503':>5} {'err':>5} {'upstream':>8}  (ms)")
+
+    async def measure(name, base, call, items, concurrency):
+        before = cfg.requests
+        results, wall = await scenario(base, call, items, concurrency)
+        report(name, results, wall, cfg.requests - before)
+
+    n, c = args.requests, args.concurrency
+    distinct = [f"{qs[i % len(qs)]} (#{i})" for i in range(n)]
+    for single_flight in (1, 0):
+        with run_server(args.port, stub_url, API_SINGLE_FLIGHT=single_flight,
+                        API_LLM_CONCURRENCY=c, API_QUEUE_SIZE=n) as base:
+            await wait_ready(base)
+            if single_flight:
+                await measure("search", base, one_search, [qs[i % len(qs)] for i in range(n)], c)
+                await measure("answer distinct", base, one_answer, distinct, c)
+            # Waves of `c` identical questions arriving together
+            await measure(f"answer hot (sf={'on' if single_flight else 'off'})", base, one_answer, [qs[0]] * n, c)
+
+    limit = args.overload_limit
+    with run_server(args.port, stub_url, API_LLM_CONCURRENCY=limit, API_QUEUE_SIZE=limit) as base:
+        await wait_ready(base)
+        await measure(f"overload ({limit}+{limit} slots)", base, one_answer, distinct, c)
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--requests", type=int, default=400)
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--latency", type=float, default=0.3, help="stub time to first byte (s)")
+    ap.add_argument("--token-delay", type=float, default=0.01, help="stub delay between pieces (s)")
+    ap.add_argument("--overload-limit", type=int, default=4, help="LLM slots and queue size in the overload run")
+    ap.add_argument("--port", type=int, default=8791)
+    args = ap.parse_args()
+    server, stub_url, cfg = start_stub(latency=args.latency, token_delay=args.token_delay)
+    # Stopping a server resets its keep-alive connections to the stub; not worth a traceback
+    server.handle_error = lambda request, client_address: None
+    try:
+        asyncio.run(main_async(args, cfg, stub_url))
+    finally:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""Offline retrieval quality and latency benchmark for RAGIndex.
+
+Usage (from the repo root):
+    python -m bench.retrieval_eval
+    python -m bench.retrieval_eval --backends tfidf bm25 --chunking 1200:150 800:100
+    python -m bench.retrieval_eval --scale 10 100 1000 --backends tfidf bm25
+    python -m bench.retrieval_eval --save bench/baseline.json
+    python -m bench.retrieval_eval --baseline bench/baseline.json   # exit 1 on a quality regression
+
+Questions come from ``bench/questions.jsonl`` (``{"question", "expected": [file
+names]}``); a hit is a result whose source file name is in ``expected``.
+For each backend x chunking config the data/ corpus is indexed from scratch
+(no snapshot, and no search result cache, so every timed query is scored)
+and the report gives recall@k, MRR, build/fit time, peak Python memory,
+index size and per-query latency. Peak memory comes from a second build
+under tracemalloc (PDF extraction runs in worker processes and is not
+counted); ``--no-memory`` skips it.
+
+Latency depends on the machine, so each run also times a fixed reference
+workload (``calib_ms``: regex tokenization plus a sparse mat-vec and top-k,
+like one search) and reports p95 as a multiple of it (``p95_rel``). The
+``--baseline`` check fails on recall/MRR drops only; a ``p95_rel`` above
+``--max-latency-ratio`` times the baseline's is printed as a warning.
+
+``--scale N`` adds N times the size of data/ in synthetic chunks (words drawn
+from the corpus' own unigram distribution) to show where each backend stops
+being interactive and how much quality the extra noise costs.
+"""
+import os
+import sys
+import json
+import time
+import re
+import argparse
+import tracemalloc
+from typing import Dict, List
+import numpy as np
+import scipy.sparse as sp
+from rag import RAGIndex, available_backends
+
+DEFAULT_QUESTIONS = os.path.join(os.path.dirname(__file__), "questions.jsonl")
+# Ngưỡng "tương tác": p95 latency của một truy vấn
+INTERACTIVE_MS = 100.0
+
+def load_questions(path: str) -> List[Dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def parse_chunking(value: str):
+    chars, _, overlap = value.partition(":")
+    return int(chars), int(overlap or 0)
+
+def first_hit_rank(results: List[Dict], expected: List[str]) -> int:
+    for rank, r in enumerate(results, 1):
+        if os.path.basename(r["source"]) in expected:
+            return rank
+    return 0
+
+def quality(idx: RAGIndex, questions: List[Dict], ks: List[int]) -> Dict:
+    ranks = [first_hit_rank(idx.search(q["question"], top_k=max(ks)), q["expected"]) for q in questions]
+    out = {f"recall@{k}": float(np.mean([0 < r <= k for r in ranks])) for k in ks}
+    out["mrr"] = float(np.mean([1.0 / r if r else 0.0 for r in ranks]))
+    out["misses"] = [q["question"] for q, r in zip(questions, ranks) if not r]
+    return out
+
+def latency(idx: RAGIndex, questions: List[Dict], top_k: int, repeat: int) -> Dict:
+    times = []
+    for _ in range(repeat):
+        for q in questions:
+            t = time.perf_counter()
+            idx.search(q["question"], top_k=top_k)
+            times.append(time.perf_counter() - t)
+    t = time.perf_counter()
+    idx.search_batch([q["question"] for q in questions], top_k=top_k)
+    batch = (time.perf_counter() - t) / len(questions)
+    return {"p50_ms": float(np.percentile(times, 50) * 1e3), "p95_ms": float(np.percentile(times, 95) * 1e3),
+            "batch_ms": batch * 1e3}
+
+def calibrate(repeat: int = 200) -> float:
+    """Fastest of ``repeat`` runs (ms) of a fixed search-like workload; the unit of ``p95_rel``."""
+    rng = np.random.default_rng(0)
+    matrix = sp.random(2000, 5000, density=0.01, format="csr", random_state=0)
+    text = " ".join(rng.choice(["middleware", "express", "route", "mongoose", "schema", "jwt"], size=400))
+    word_re = re.compile(r"\w+", re.UNICODE)
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        ids = np.unique([hash(w) % 5000 for w in word_re.findall(text.lower())])
+        scores = matrix @ np.bincount(ids, minlength=5000).astype(np.float64)
+        np.argpartition(-scores, 5)[:5]
+        times.append(time.perf_counter() - t)
+    # The minimum is far steadier than the median on a shared or throttled CPU
+    return float(min(times) * 1e3)
+
+def synthetic_docs(idx: RAGIndex, n_chunks: int, seed: int) -> List[Dict]:
+    """Random documents (~one chunk each) drawn from the corpus word distribution."""
+    words, counts = np.unique(" ".join(idx._chunks.texts()).split(), return_counts=True)
+    p = counts / counts.sum()
+    lengths = [len(t.split()) for t in idx._chunks.texts()] or [150]
+    rng = np.random.default_rng(seed)
+    docs = []
+    for i in range(n_chunks):
+        n = int(rng.choice(lengths))
+        docs.append({"text": " ".join(rng.choice(words, size=n, p=p)), "source": f"synthetic://{i}"})
+    return docs
+
+def build_index(args, backend: str, chunking):
+    """Cold build of data/; returns ``(index, build seconds, fit seconds)``."""
+    t0 = time.perf_counter()
+    idx = RAGIndex(data_dir=args.data_dir, cache_dir=None, backend=backend,
+                   chunk_chars=chunking[0], chunk_overlap=chunking[1], search_cache_size=0)
+    idx.build()
+    t1 = time.perf_counter()
+    idx.search("warm up", top_k=1)   # fits the backend model
+    return idx, t1 - t0, time.perf_counter() - t1
+
+def peak_memory_mb(args, backend: str, chunking) -> float:
+    tracemalloc.start()
+    try:
+        build_index(args, backend, chunking)
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+def run_config(args, questions, backend: str, chunking) -> Dict:
+    idx, build_s, fit_s = build_index(args, backend, chunking)
+    row = {"backend": backend, "chunking": f"{chunking[0]}:{chunking[1]}", "chunks": len(idx._chunks),
+           "build_s": build_s, "fit_s": fit_s,
+           "peak_mb": peak_memory_mb(args, backend, chunking) if args.memory else float("nan"),
+           "index_mb": idx.size_stats()["total"] / 2 ** 20}
+    row.update(quality(idx, questions, args.k))
+    row.update(latency(idx, questions, max(args.k), args.repeat))
+    return row
+
+def run_scale(args, questions, backend: str, factor: int, idx: RAGIndex) -> Dict:
+    idx.set_backend(backend)
+    t0 = time.perf_counter()
+    idx.search("warm up", top_k=1)   # flush (first backend only) + fit
+    t1 = time.perf_counter()
+    row = {"backend": backend, "scale": factor, "chunks": int(idx._alive.sum()), "fit_s": t1 - t0,
+           "index_mb": idx.size_stats()["total"] / 2 ** 20}
+    row.update(quality(idx, questions, args.k))
+    row.update(latency(idx, questions, max(args.k), 1))
+    row["interactive"] = row["p95_ms"] <= args.interactive_ms
+    return row
+
+def print_table(rows: List[Dict], cols: List[str]):
+    print("  ".join(f"{c:>12}" for c in cols))
+    for row in rows:
+        cells = []
+        for c in cols:
+            v = row.get(c, "")
+            cells.append(f"{v:>12.3f}" if isinstance(v, float) else f"{str(v):>12}")
+        print("  ".join(cells))
+
+def compare(rows: List[Dict], baseline_path: str, max_recall_drop: float, max_latency_ratio: float):
+    """Return ``(problems, warnings)``: quality regressions and relative latency regressions."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(r["backend"], r["chunking"]): r for r in json.load(f)["configs"]}
+    problems, warnings = [], []
+    for row in rows:
+        ref = baseline.get((row["backend"], row["chunking"]))
+        if ref is None:
+            continue
+        name = f"{row['backend']} {row['chunking']}"
+        for key in [k for k in row if k.startswith("recall@") or k == "mrr"]:
+            if key in ref and row[key] < ref[key] - max_recall_drop:
+                problems.append(f"{name}: {key} {row[key]:.3f} < baseline {ref[key]:.3f}")
+        # Absolute milliseconds are not comparable across machines; p95_rel is
+        if ref.get("p95_rel") and row["p95_rel"] > ref["p95_rel"] * max_latency_ratio:
+            warnings.append(f"{name}: p95 {row['p95_rel']:.2f}x reference > {max_latency_ratio:g}x baseline "
+                            f"{ref['p95_rel']:.2f}x ({row['p95_ms']:.2f} ms here, {ref['p95_ms']:.2f} ms there)")
+    return problems, warnings
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--questions", default=DEFAULT_QUESTIONS)
+    ap.add_argument("--data-dir", default="data")
+    ap.add_argument("--backends", nargs="+", default=available_backends())
+    ap.add_argument("--chunking", nargs="+", type=parse_chunking, default=[(1200, 150)],
+                    help="chunk_chars:overlap pairs, e.g. 1200:150 800:100")
+    ap.add_argument("--k", type=int, nargs="+", default=[1, 3, 5])
+    ap.add_argument("--repeat", type=int, default=3, help="latency passes over the question set")
+    ap.add_argument("--scale", type=int, nargs="*", default=[], help="synthetic corpus multipliers, e.g. 10 100 1000")
+    ap.add_argument("--interactive-ms", type=float, default=INTERACTIVE_MS)
+    ap.add_argument("--no-memory", dest="memory", action="store_false", help="skip the tracemalloc build")
+    ap.add_argument("--seed", type=int, default=302)
+    ap.add_argument("--save", help="write results as JSON (e.g. a new baseline)")
+    ap.add_argument("--baseline", help="compare against a saved JSON; exit 1 on regression")
+    ap.add_argument("--max-recall-drop", type=float, default=0.02)
+    ap.add_argument("--max-latency-ratio", type=float, default=2.0, help="warn when p95_rel exceeds this x baseline")
+    args = ap.parse_args()
+
+    questions = load_questions(args.questions)
+    calib_ms = calibrate()
+    print(f"{len(questions)} questions, backends: {', '.join(args.backends)}, reference workload {calib_ms:.3f} ms\n")
+    rows = [run_config(args, questions, b, c) for c in args.chunking for b in args.backends]
+    for row in rows:
+        row["calib_ms"] = calib_ms
+        row["p95_rel"] = row["p95_ms"] / calib_ms
+    recall_cols = [f"recall@{k}" for k in args.k]
+    print_table(rows, ["backend", "chunking", "chunks", *recall_cols, "mrr", "build_s", "fit_s",
+                       "peak_mb", "index_mb", "p50_ms", "p95_ms", "p95_rel", "batch_ms"])
+    for row in rows:
+        for q in row["misses"]:
+            print(f"  miss [{row['backend']} {row['chunking']}]: {q}")
+
+    scale_rows = []
+    for factor in args.scale:
+        base = RAGIndex(data_dir=args.data_dir, cache_dir=None, dedup=False,
+                        chunk_chars=args.chunking[0][0], chunk_overlap=args.chunking[0][1], search_cache_size=0)
+        base.build()
+        docs = synthetic_docs(base, factor * len(base._chunks), args.seed)
+        t = time.perf_counter()
+        base.add_external_docs(docs)
+        ingest = time.perf_counter() - t
+        del docs
+        for b in args.backends:
+            row = run_scale(args, questions, b, factor, base)
+            row["ingest_s"] = ingest
+            scale_rows.append(row)
+        del base
+    if scale_rows:
+        print(f"\nSynthetic scaling (interactive = p95 <= {args.interactive_ms:g} ms)")
+        print_table(scale_rows, ["backend", "scale", "chunks", "ingest_s", "fit_s", "index_mb",
+                                 *recall_cols, "mrr", "p50_ms", "p95_ms", "interactive"])
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"configs": rows, "scaling": scale_rows}, f, ensure_ascii=False, indent=1)
+    if args.baseline:
+        problems, warnings = compare(rows, args.baseline, args.max_recall_drop, args.max_latency_ratio)
+        for w in warnings:
+            print(f"WARNING {w}")
+        for p in problems:
+            print(f"REGRESSION {p}")
+        if problems:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Search latency: legacy dense path vs sparse top-k vs batched search.
+
+Usage (from the repo root):
+    python -m bench.search_latency --sizes 10000 100000 1000000
+
+The corpus is synthetic (Zipf-distributed terms) so that sizes far beyond
+data/ can be measured; the scoring kernels are the ones used by RAGIndex.
+"""
+import argparse
+import time
+import numpy as np
+import scipy.sparse as sp
+from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
+from rag import top_k_rows
+
+def synthetic_matrix(n_rows: int, n_terms: int, terms_per_row: int, rng) -> sp.csr_matrix:
+    cols = np.minimum(rng.zipf(1.3, size=n_rows * terms_per_row), n_terms) - 1
+    cols = rng.permutation(n_terms)[cols]   # do not cluster frequent terms at id 0
+    rows = np.repeat(np.arange(n_rows), terms_per_row)
+    data = rng.integers(1, 4, size=len(cols)).astype(np.float64)
+    m = sp.csr_matrix((data, (rows, cols)), shape=(n_rows, n_terms))
+    m.sum_duplicates()
+    return normalize(m, norm="l2", copy=False)
+
+def legacy_search(q, weights, active, top_k):
+    sims = cosine_similarity(q, weights)[0]
+    sims[~active] = -1.0
+    return sims.argsort()[::-1][:top_k]
+
+def timed(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    ap.add_argument("--terms", type=int, default=60_000, help="vocabulary size")
+    ap.add_argument("--terms-per-chunk", type=int, default=40)
+    ap.add_argument("--queries", type=int, default=64)
+    ap.add_argument("--top-k", type=int, default=4)
+    ap.add_argument("--seed", type=int, default=302)
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'chunks':>10} {'legacy ms/q':>12} {'sparse ms/q':>12} {'batch ms/q':>11} {'speedup':>8}")
+    for n in args.sizes:
+        weights = synthetic_matrix(n, args.terms, args.terms_per_chunk, rng)
+        weights_t = weights.T.tocsr()
+        queries = synthetic_matrix(args.queries, args.terms, 5, rng)
+        active = np.ones(n, dtype=bool)
+
+        # The legacy path is O(chunks) per query, so only a few queries at scale
+        n_legacy = max(1, min(args.queries, 2_000_000 // n))
+        legacy = timed(lambda: [legacy_search(queries[i], weights, active, args.top_k)
+                                for i in range(n_legacy)], 1) / n_legacy
+        single = timed(lambda: [top_k_rows(queries[i] @ weights_t, active, args.top_k)
+                                for i in range(args.queries)], 1) / args.queries
+        batch = timed(lambda: top_k_rows(queries @ weights_t, active, args.top_k), 1) / args.queries
+
+        # Sanity check: both paths must agree on the best chunk
+        best_new = top_k_rows(queries[0] @ weights_t, active, 1)[0][0]
+        best_old = legacy_search(queries[0], weights, active, 1)
+        ok = "" if not len(best_new) or best_new[0] == best_old[0] else "  (top-1 differs)"
+        print(f"{n:>10} {legacy * 1e3:>12.2f} {single * 1e3:>12.3f} {batch * 1e3:>11.3f} "
+              f"{legacy / single:>7.0f}x{ok}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Search result cache and hot-query warmup: first-ask and repeat latency.
+
+Usage (from the repo root):
+    python -m bench.search_warmup --log 2000 --backends tfidf bm25
+
+Builds the shared index (data/ only) and reports, per backend:
+
+- warmup: time to precompute the hot queries (``search_cache.hot_queries``).
+- first ask of a hot query on a cold index (fit included, like the first
+  student after a rebuild) vs. after warmup.
+- a replayed query log: Zipf-distributed picks from the hot queries and the
+  labelled questions in ``bench/questions.jsonl``, with and without the cache
+  (hit rate, mean and p99 latency).
+"""
+import os
+import json
+import time
+import argparse
+import numpy as np
+from rag import RAGIndex
+from search_cache import hot_queries
+
+def labelled_questions():
+    with open(os.path.join("bench", "questions.jsonl"), "r", encoding="utf-8") as f:
+        return [json.loads(line)["question"] for line in f if line.strip()]
+
+def fresh_index(data_dir: str, backend: str, cache_size: int) -> RAGIndex:
+    idx = RAGIndex(data_dir=data_dir, backend=backend, search_cache_size=cache_size)
+    idx.freeze()
+    return idx
+
+def timed(fn):
+    t = time.perf_counter()
+    fn()
+    return time.perf_counter() - t
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--data-dir", default="data")
+    ap.add_argument("--backends", nargs="+", default=["tfidf", "bm25"])
+    ap.add_argument("--log", type=int, default=2000, help="queries in the replayed log")
+    ap.add_argument("--top-k", type=int, default=4)
+    ap.add_argument("--seed", type=int, default=302)
+    args = ap.parse_args()
+
+    hot = hot_queries(args.data_dir)
+    pool = hot + labelled_questions()
+    rng = np.random.default_rng(args.seed)
+    ranks = np.minimum(rng.zipf(1.2, size=args.log), len(pool)) - 1
+    log = [pool[r] for r in ranks]
+    print(f"{len(hot)} hot queries, log of {len(log)} queries over {len(set(log))} distinct\n")
+
+    print(f"{'backend':<8} {'warmup ms':>9} {'cold 1st ms':>11} {'warm 1st us':>11} "
+          f"{'log':>9} {'hit rate':>8} {'mean us':>8} {'p99 us':>8}")
+    for backend in args.backends:
+        # First ask on a cold index: includes fitting the backend, as for the first student today
+        cold = fresh_index(args.data_dir, backend, 0)
+        cold_first = timed(lambda: cold.search(hot[0], args.top_k))
+
+        warm = fresh_index(args.data_dir, backend, 1024)
+        warmup = timed(lambda: warm.warmup(hot, args.top_k))
+        warm_first = timed(lambda: warm.search(hot[0], args.top_k))
+
+        for name, idx in (("no cache", cold), ("cache", warm)):
+            stats = idx.search_cache_stats()
+            lat = np.array([timed(lambda q=q: idx.search(q, args.top_k)) for q in log]) * 1e6
+            after = idx.search_cache_stats()
+            lookups = (after["hits"] - stats["hits"]) + (after["misses"] - stats["misses"])
+            hit_rate = (after["hits"] - stats["hits"]) / lookups if lookups else 0.0
+            first = (f"{warmup * 1e3:>9.1f} {'':>11} {warm_first * 1e6:>11.0f}" if idx is warm
+                     else f"{'':>9} {cold_first * 1e3:>11.1f} {'':>11}")
+            print(f"{backend:<8} {first} {name:>9} {hit_rate:>8.0%} {lat.mean():>8.0f} {np.percentile(lat, 99):>8.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Upload lifecycle of a ``SessionIndex`` (what the app does on every rerun).
+
+Usage (from the repo root):
+    python -m bench.session_uploads
+
+A frozen base over a one-file corpus gets a session whose uploader list is
+changed step by step; after each step the check searches for a marker word
+and fails (exit 1) if a file is found that should be gone, or missing when
+it should be indexed:
+
+1. upload, then remove from the uploader: no longer found.
+2. same name, new content: only the new text is found.
+3. a file larger than the whole session cap: rejected, reported, not counted.
+4. tight cap: the older upload is evicted, the new one is indexed.
+5. a near-duplicate of another upload comes back when that upload is removed.
+"""
+import os
+import sys
+import tempfile
+from rag import RAGIndex, SessionIndex
+
+class Upload:
+    """Minimal stand-in for Streamlit's ``UploadedFile``."""
+
+    def __init__(self, name: str, text: str):
+        self.name = name
+        self._data = text.encode("utf-8")
+
+    def getvalue(self) -> bytes:
+        return self._data
+
+def doc(marker: str, words: int = 60) -> str:
+    return f"{marker} " + " ".join(f"express middleware route handler {i}" for i in range(words))
+
+def main():
+    failures = []
+
+    def check(step: str, cond: bool, detail: str = ""):
+        print(f"{'ok  ' if cond else 'FAIL'} {step:<48} {detail}")
+        if not cond:
+            failures.append(step)
+
+    with tempfile.TemporaryDirectory() as d:
+        with open(os.path.join(d, "course.md"), "w", encoding="utf-8") as f:
+            f.write(doc("mongoose"))
+        base = RAGIndex(data_dir=d, cache_dir=None)
+        base.freeze()
+        session = SessionIndex(base)
+
+        def found(marker: str):
+            return sorted({r.source for r in session.search(marker, top_k=5) if marker in r.text})
+
+        added = session.add_uploaded_files([Upload("secret.md", doc("zebracorn"))])
+        check("upload is indexed", added == 1 and found("zebracorn") == ["uploaded:secret.md"], f"added={added}")
+        added = session.add_uploaded_files([])
+        check("removed upload is not found", added == 0 and not found("zebracorn"), str(found("zebracorn")))
+
+        session.add_uploaded_files([Upload("notes.md", doc("quokka"))])
+        added = session.add_uploaded_files([Upload("notes.md", doc("narwhal"))])
+        check("new version replaces the old one", added == 1 and not found("quokka")
+              and found("narwhal") == ["uploaded:notes.md"], f"quokka={found('quokka')}")
+        session.add_uploaded_files([])
+
+        # Room for one small upload (chunks overlap, so count chunk bytes), not two
+        one = sum(len(c.encode("utf-8")) for c in session.overlay._chunk(doc("axolotl")))
+        session.overlay.upload_cap = one * 3 // 2
+        added = session.add_uploaded_files([Upload("huge.md", doc("okapi", words=400))])
+        check("file over the cap is rejected", added == 0 and session.rejected_uploads == 1
+              and not found("okapi"), f"added={added} rejected={session.rejected_uploads}")
+
+        older = Upload("older.md", doc("axolotl"))
+        session.add_uploaded_files([older])
+        added = session.add_uploaded_files([older, Upload("newer.md", doc("pangolin"))])
+        check("older upload makes room for the new one", added == 1 and session.evicted_uploads == 1
+              and found("pangolin") == ["uploaded:newer.md"] and not found("axolotl"),
+              f"added={added} evicted={session.evicted_uploads}")
+        session.add_uploaded_files([])
+        check("counters clear when files leave", session.evicted_uploads == 0 and session.rejected_uploads == 0)
+
+        session.overlay.upload_cap = None
+        text = doc("capybara")
+        session.add_uploaded_files([Upload("a.md", text), Upload("copy.md", text + " ")])
+        before = found("capybara")
+        session.add_uploaded_files([Upload("copy.md", text + " ")])
+        check("near-duplicate restored after removal", len(before) == 1
+              and found("capybara") == ["uploaded:copy.md"], f"before={before} after={found('capybara')}")
+
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
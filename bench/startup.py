@@ -0,0 +1,99 @@
+"""Import time of the app's modules and time to the app's first render.
+
+Usage (from the repo root):
+    python -m bench.startup
+    python -m bench.startup --max-import-ms 1500 --max-render-ms 4000   # exit 1 over budget
+
+Each module imported by app.py is timed in a fresh interpreter with
+``python -X importtime`` (cumulative time of its top-level import, so shared
+dependencies are counted once per module). The same run checks that
+libraries which are only needed on some code paths (scikit-learn, the
+Gemini SDK, trafilatura, pypdf, sentence-transformers) are not pulled in at
+import time. The first render is ``AppTest.from_file("app.py").run()``: the
+whole script with the index still warming up in the background, which is
+what a user waits for before the page appears.
+"""
+import os
+import ast
+import sys
+import time
+import argparse
+import subprocess
+
+# Imported on the code path that needs them, never by ``import app``
+DEFERRED = ("sklearn", "google.generativeai", "trafilatura", "pypdf", "sentence_transformers")
+
+def app_imports(path: str = "app.py"):
+    """Top-level modules imported by ``path``, in order."""
+    with open(path, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    names = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names += [a.name for a in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.append(node.module)
+    return list(dict.fromkeys(names))
+
+def import_time(modules):
+    """``(total_ms, per_module_ms, loaded_deferred)`` for importing ``modules`` in one fresh interpreter."""
+    code = "; ".join(f"import {m}" for m in modules)
+    code += f"; import sys; print(','.join(m for m in {DEFERRED!r} if m in sys.modules))"
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                         capture_output=True, text=True, check=True)
+    per_module = {}
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # Top-level imports only (nested ones are indented further)
+        if name.startswith(" ") and not name.startswith("  ") and name.strip() in modules:
+            per_module[name.strip()] = int(cumulative) / 1e3
+    loaded = [m for m in out.stdout.strip().split(",") if m]
+    return sum(per_module.values()), per_module, loaded
+
+def first_render(path: str = "app.py", timeout: float = 60):
+    from streamlit.testing.v1 import AppTest
+    # ping/LLM are never called on the first render; a token only lets the provider initialise
+    os.environ.setdefault("GITHUB_MODELS_TOKEN", "bench-startup")
+    t = time.perf_counter()
+    at = AppTest.from_file(path, default_timeout=timeout).run()
+    elapsed = time.perf_counter() - t
+    return elapsed, [e.value for e in at.exception], [i.value for i in at.info]
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--app", default="app.py")
+    ap.add_argument("--max-import-ms", type=float, default=None, help="fail if importing app's modules takes longer")
+    ap.add_argument("--max-render-ms", type=float, default=None, help="fail if the first render takes longer")
+    ap.add_argument("--no-render", action="store_true", help="only measure imports")
+    args = ap.parse_args()
+
+    failed = []
+    modules = app_imports(args.app)
+    total, per_module, loaded = import_time(modules)
+    print(f"{'module':<16} {'import ms':>10}")
+    for name in modules:
+        if name in per_module:
+            print(f"{name:<16} {per_module[name]:>10.0f}")
+    print(f"{'total':<16} {total:>10.0f}")
+    if loaded:
+        failed.append(f"loaded at import time: {', '.join(loaded)}")
+    if args.max_import_ms is not None and total > args.max_import_ms:
+        failed.append(f"import {total:.0f} ms > {args.max_import_ms:.0f} ms")
+
+    if not args.no_render:
+        elapsed, errors, infos = first_render(args.app)
+        print(f"\nfirst render: {elapsed * 1e3:.0f} ms"
+              + (" (index warming up)" if any(i.startswith("⏳") for i in infos) else ""))
+        if errors:
+            failed.append(f"app raised: {errors[0]}")
+        if args.max_render_ms is not None and elapsed * 1e3 > args.max_render_ms:
+            failed.append(f"first render {elapsed * 1e3:.0f} ms > {args.max_render_ms:.0f} ms")
+
+    for msg in failed:
+        print(f"FAIL: {msg}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""OpenAI-compatible stub for ``/chat/completions`` (streaming and not).
+
+Usage (from the repo root):
+    python -m bench.stub_llm --port 8765 --latency 0.2 --rate-limit 0.1
+
+Then point the app or a benchmark at it with
+``GITHUB_MODELS_BASE_URL=http://127.0.0.1:8765 GITHUB_MODELS_TOKEN=x``.
+Benchmarks can also start it in-process with ``start_stub()``.
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from typing import Union
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_ANSWER = "Đây là câu trả lời mẫu từ stub LLM cho mục đích benchmark."
+
+class StubConfig:
+    def __init__(self, latency: float = 0.05, token_delay: float = 0.0, rate_limit: float = 0.0,
+                 retry_after: Union[float, str] = 0.0, answer: str = STUB_ANSWER, seed: int = 302):
+        self.latency = latency          # seconds before the first byte
+        self.token_delay = token_delay  # seconds between streamed pieces
+        self.rate_limit = rate_limit    # fraction of requests answered with 429
+        self.retry_after = retry_after  # seconds, or a raw header value
+        self.answer = answer
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.throttled = 0
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, so connection reuse is measurable
+    cfg: StubConfig = None
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.cfg.lock:
+            self.cfg.connections += 1
+
+    def _send(self, status: int, body: bytes, headers=None):
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_POST(self):
+        cfg = self.cfg
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        with cfg.lock:
+            cfg.requests += 1
+            throttle = cfg.rate_limit > 0 and cfg.rng.random() < cfg.rate_limit
+            if throttle:
+                cfg.throttled += 1
+        if throttle:
+            retry_after = cfg.retry_after if isinstance(cfg.retry_after, str) else f"{cfg.retry_after:g}"
+            self._send(429, b'{"error": "rate limited"}', {"Retry-After": retry_after})
+            return
+        time.sleep(cfg.latency)
+        if not payload.get("stream"):
+            body = {"choices": [{"message": {"role": "assistant", "content": cfg.answer}}]}
+            self._send(200, json.dumps(body).encode("utf-8"))
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for word in cfg.answer.split(" "):
+            event = {"choices": [{"delta": {"content": word + " "}}]}
+            self._chunk(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+            if cfg.token_delay:
+                time.sleep(cfg.token_delay)
+        self._chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+def start_stub(host: str = "127.0.0.1", port: int = 0, **config):
+    """Start the stub in a daemon thread; returns ``(server, base_url, config)``."""
+    cfg = StubConfig(**config)
+    handler = type("StubHandler", (_Handler,), {"cfg": cfg})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_port}", cfg
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency", type=float, default=0.2, help="seconds before the first byte")
+    ap.add_argument("--token-delay", type=float, default=0.02, help="seconds between streamed pieces")
+    ap.add_argument("--rate-limit", type=float, default=0.0, help="fraction of requests answered with 429")
+    ap.add_argument("--retry-after", type=float, default=1.0)
+    args = ap.parse_args()
+    server, url, _ = start_stub(args.host, args.port, latency=args.latency, token_delay=args.token_delay,
+                                rate_limit=args.rate_limit, retry_after=args.retry_after)
+    print(f"stub LLM listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
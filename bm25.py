@@ -0,0 +1,122 @@
+import heapq
+from array import array
+from bisect import bisect_left
+from typing import List, Optional, Tuple
+import numpy as np
+import scipy.sparse as sp
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+class BM25Index:
+    """BM25 over an array-backed inverted index, queried with MaxScore.
+
+    Postings are stored term-major in flat arrays (``offsets`` per term id,
+    then doc ids and precomputed BM25 impacts), so a query only touches the
+    postings of its own terms. MaxScore keeps a per-term upper bound and skips
+    documents that cannot enter the current top-k.
+    """
+
+    def __init__(self, tf, doc_ids: np.ndarray, k1: float = BM25_K1, b: float = BM25_B,
+                 background: Optional[Tuple[int, np.ndarray, float]] = None):
+        # tf: raw term counts (docs x terms); doc_ids maps local rows to caller ids.
+        # background: (documents, document frequencies, total length) of other
+        # documents counted in idf and the average length but not indexed here.
+        tf = sp.csr_matrix(tf, dtype=np.float64)
+        n_docs, n_terms = tf.shape
+        dl = np.asarray(tf.sum(axis=1)).ravel()
+        n_all, total_len = n_docs, float(dl.sum())
+        if background is not None:
+            n_all += background[0]
+            total_len += background[2]
+        avgdl = total_len / n_all if n_all else 0.0
+        norm = k1 * (1.0 - b + b * dl / avgdl) if avgdl > 0 else np.full(n_docs, k1)
+
+        csc = tf.tocsc()
+        csc.sort_indices()
+        df = np.diff(csc.indptr)
+        df_all = df
+        if background is not None:
+            df_all = df.copy()
+            m = min(n_terms, len(background[1]))
+            df_all[:m] += np.asarray(background[1][:m], dtype=df.dtype)
+        idf = np.log(1.0 + (n_all - df_all + 0.5) / (df_all + 0.5))
+        term_of = np.repeat(np.arange(n_terms), df)
+        rows = csc.indices
+        impacts = idf[term_of] * csc.data * (k1 + 1.0) / (csc.data + norm[rows])
+
+        self.n_docs = n_docs
+        self.offsets = array("q", csc.indptr.astype(np.int64).tobytes())
+        self.docs = array("i", rows.astype(np.int32).tobytes())
+        self.impacts = array("d", impacts.astype(np.float64).tobytes())
+        upper = np.zeros(n_terms)
+        if len(impacts):
+            nonempty = df > 0
+            upper[nonempty] = np.maximum.reduceat(impacts, csc.indptr[:-1][nonempty])
+        self.upper = upper.tolist()
+        self.doc_ids = np.asarray(doc_ids)
+
+    @classmethod
+    def from_rows(cls, tf, rows: np.ndarray, **kwargs) -> "BM25Index":
+        return cls(tf[rows], rows, **kwargs)
+
+    def search(self, term_ids: np.ndarray, counts: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        n_terms = len(self.upper)
+        terms = []
+        for t, qtf in zip(term_ids.tolist(), counts.tolist()):
+            if t < n_terms and self.offsets[t] < self.offsets[t + 1]:
+                terms.append((self.upper[t] * qtf, t, qtf))
+        if not terms or top_k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        # MaxScore: terms in ascending upper-bound order
+        terms.sort()
+        ubs = [u for u, _, _ in terms]
+        prefix = list(np.cumsum(ubs))
+        lo = [self.offsets[t] for _, t, _ in terms]
+        hi = [self.offsets[t + 1] for _, t, _ in terms]
+        qtfs = [q for _, _, q in terms]
+        docs, impacts = self.docs, self.impacts
+
+        heap: List[Tuple[float, int]] = []
+        threshold = 0.0
+        first_essential = 0   # terms[:first_essential] alone cannot reach the top-k
+        cursors = lo[:]
+        while True:
+            # next candidate: smallest current doc among essential lists
+            doc = None
+            for i in range(first_essential, len(terms)):
+                if cursors[i] < hi[i]:
+                    d = docs[cursors[i]]
+                    if doc is None or d < doc:
+                        doc = d
+            if doc is None:
+                break
+            score = 0.0
+            for i in range(first_essential, len(terms)):
+                c = cursors[i]
+                if c < hi[i] and docs[c] == doc:
+                    score += impacts[c] * qtfs[i]
+                    cursors[i] = c + 1
+            # non-essential lists, largest bound first, with early exit
+            for i in range(first_essential - 1, -1, -1):
+                if score + prefix[i] <= threshold:
+                    break
+                c = bisect_left(docs, doc, cursors[i], hi[i])
+                cursors[i] = c
+                if c < hi[i] and docs[c] == doc:
+                    score += impacts[c] * qtfs[i]
+            if len(heap) < top_k:
+                heapq.heappush(heap, (score, -doc))
+            elif score > heap[0][0]:
+                heapq.heapreplace(heap, (score, -doc))
+            else:
+                continue
+            if len(heap) == top_k:
+                threshold = heap[0][0]
+                while first_essential < len(terms) and prefix[first_essential] <= threshold:
+                    first_essential += 1
+                if first_essential == len(terms):
+                    break
+        best = sorted(heap, reverse=True)
+        idx = self.doc_ids[[-d for _, d in best]] if best else np.zeros(0, dtype=np.int64)
+        return np.asarray(idx, dtype=np.int64), np.array([s for s, _ in best])
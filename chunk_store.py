@@ -0,0 +1,149 @@
+import os
+import json
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional
+import numpy as np
+
+class ChunkView:
+    """One retrieved chunk: ``text``, ``source`` and ``score``.
+
+    Reads like the ``{text, source, score}`` dicts the rest of the app uses
+    (``view["text"]``, ``.get()``, ``dict(view)``) but without a per-chunk dict.
+    """
+    __slots__ = ("text", "source", "score")
+    _FIELDS = ("text", "source", "score")
+
+    def __init__(self, text: str, source: str, score: float = 0.0):
+        self.text = text
+        self.source = source
+        self.score = score
+
+    def __getitem__(self, key: str):
+        if key not in self._FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default=None):
+        return getattr(self, key) if key in self._FIELDS else default
+
+    def keys(self):
+        return self._FIELDS
+
+    def __iter__(self):
+        return iter(self._FIELDS)
+
+    def __len__(self) -> int:
+        return len(self._FIELDS)
+
+    def __contains__(self, key) -> bool:
+        return key in self._FIELDS
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (ChunkView, dict)):
+            return all(self[k] == other.get(k) for k in self._FIELDS) and len(other) == len(self)
+        return NotImplemented
+
+    def with_score(self, score: float) -> "ChunkView":
+        return ChunkView(self.text, self.source, score)
+
+    def to_dict(self) -> Dict:
+        return {"text": self.text, "source": self.source, "score": self.score}
+
+    def __repr__(self) -> str:
+        return f"ChunkView(source={self.source!r}, score={self.score:.4f}, text={self.text[:40]!r})"
+
+class ChunkStore:
+    """Append-only columnar storage for chunk texts and their sources.
+
+    All texts live in one UTF-8 buffer addressed by an int64 offset array, and
+    sources are interned: each row stores a 4-byte source id. Text is decoded
+    only when a row is read. ``save``/``load`` write the same columns as
+    ``.npy`` files (``load`` memory-maps them), so the on-disk snapshot and
+    the in-memory index share one layout.
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._offsets = array("q", [0])
+        self._source_ids = array("i")
+        self._source_names: List[str] = []
+        self._source_index: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._source_ids)
+
+    def _intern(self, source: str) -> int:
+        sid = self._source_index.get(source)
+        if sid is None:
+            sid = len(self._source_names)
+            self._source_names.append(source)
+            self._source_index[source] = sid
+        return sid
+
+    def append(self, text: str, source: str) -> int:
+        row = len(self._source_ids)
+        self._buf += text.encode("utf-8")
+        self._offsets.append(len(self._buf))
+        self._source_ids.append(self._intern(source))
+        return row
+
+    def text(self, row: int) -> str:
+        return bytes(self._buf[self._offsets[row]:self._offsets[row + 1]]).decode("utf-8")
+
+    def source(self, row: int) -> str:
+        return self._source_names[self._source_ids[row]]
+
+    def text_bytes(self, row: int) -> int:
+        return int(self._offsets[row + 1] - self._offsets[row])
+
+    def texts(self, rows: Optional[Iterable[int]] = None) -> Iterator[str]:
+        for r in (range(len(self)) if rows is None else rows):
+            yield self.text(r)
+
+    def view(self, row: int, score: float = 0.0) -> ChunkView:
+        return ChunkView(self.text(row), self.source(row), score)
+
+    def take(self, rows: Iterable[int]) -> "ChunkStore":
+        """A new store holding ``rows`` in the given order (used to compact)."""
+        out = ChunkStore()
+        for r in rows:
+            out.append(self.text(r), self.source(r))
+        return out
+
+    def nbytes(self) -> int:
+        return (len(self._buf) + self._offsets.itemsize * len(self._offsets)
+                + self._source_ids.itemsize * len(self._source_ids)
+                + sum(len(s.encode("utf-8")) for s in self._source_names))
+
+    # ---------- on-disk columns ----------
+    def save(self, directory: str, prefix: str = "chunks", save=None):
+        """Write ``<prefix>_text.npy``, ``_offsets.npy``, ``_sources.npy`` and ``_source_names.json``.
+
+        ``save(path, write, mode)`` may be passed to write atomically.
+        """
+        def plain(path, write, mode="wb"):
+            with open(path, mode, **({} if "b" in mode else {"encoding": "utf-8"})) as f:
+                write(f)
+        save = save or plain
+        base = os.path.join(directory, prefix)
+        save(f"{base}_text.npy", lambda f: np.save(f, np.frombuffer(bytes(self._buf), dtype=np.uint8)))
+        save(f"{base}_offsets.npy", lambda f: np.save(f, np.asarray(self._offsets, dtype=np.int64)))
+        save(f"{base}_sources.npy", lambda f: np.save(f, np.asarray(self._source_ids, dtype=np.int32)))
+        save(f"{base}_source_names.json", lambda f: json.dump(self._source_names, f, ensure_ascii=False), "w")
+
+    @classmethod
+    def load(cls, directory: str, prefix: str = "chunks", mmap: bool = True) -> "ChunkStore":
+        """Read a saved store; with ``mmap`` the text buffer stays on disk until rows are read."""
+        base = os.path.join(directory, prefix)
+        mode = "r" if mmap else None
+        store = cls()
+        store._buf = np.load(f"{base}_text.npy", mmap_mode=mode)
+        store._offsets = np.load(f"{base}_offsets.npy", mmap_mode=mode)
+        store._source_ids = np.load(f"{base}_sources.npy", mmap_mode=mode)
+        with open(f"{base}_source_names.json", "r", encoding="utf-8") as f:
+            store._source_names = json.load(f)
+        store._source_index = {s: i for i, s in enumerate(store._source_names)}
+        if (len(store._offsets) != len(store._source_ids) + 1 or int(store._offsets[-1]) != len(store._buf)
+                or (len(store._source_ids) and int(store._source_ids.max()) >= len(store._source_names))):
+            raise ValueError(f"Inconsistent chunk store at {base}")
+        return store
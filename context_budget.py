@@ -0,0 +1,170 @@
+import os
+import re
+import math
+import logging
+from typing import Dict, List, Optional
+
+# Tokenizer cục bộ là tuỳ chọn; không có thì dùng ước lượng (hơi dư để an toàn)
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - optional
+    tiktoken = None
+
+# Cửa sổ ngữ cảnh của model (GitHub Models giới hạn input ~8000 token ở gói miễn phí)
+LLM_CONTEXT_WINDOW = int(os.getenv("LLM_CONTEXT_WINDOW", "8000"))
+# Ký tự trên mỗi token khi quy đổi MAX_CONTEXT_CHARS cũ (12000 ký tự -> 3000 token, như mặc định)
+_LEGACY_CHARS_PER_TOKEN = 4
+
+logger = logging.getLogger(__name__)
+
+def _max_context_tokens() -> int:
+    """``MAX_CONTEXT_TOKENS``, or the deprecated ``MAX_CONTEXT_CHARS`` converted to tokens."""
+    tokens = os.getenv("MAX_CONTEXT_TOKENS")
+    legacy = os.getenv("MAX_CONTEXT_CHARS")
+    if legacy is None:
+        return int(tokens or "3000")
+    if tokens is not None:
+        logger.warning("MAX_CONTEXT_CHARS is deprecated and ignored because MAX_CONTEXT_TOKENS is set.")
+        return int(tokens)
+    converted = int(legacy) // _LEGACY_CHARS_PER_TOKEN
+    logger.warning("MAX_CONTEXT_CHARS is deprecated; using MAX_CONTEXT_TOKENS=%d (%s chars / %d). "
+                   "Set MAX_CONTEXT_TOKENS instead.", converted, legacy, _LEGACY_CHARS_PER_TOKEN)
+    return converted
+
+# Trần riêng cho phần trích dẫn: prompt nhỏ hơn -> nhanh hơn, rẻ hơn (<= 0: không giới hạn thêm)
+MAX_CONTEXT_TOKENS = _max_context_tokens()
+# Token phụ cho mỗi message (role, phân tách) trong chat format
+_MESSAGE_OVERHEAD = 4
+# Overlap ngắn hơn mức này coi là trùng ngẫu nhiên, không phải cửa sổ chồng nhau
+_MIN_OVERLAP = 32
+_MAX_OVERLAP = 400
+
+_PIECE_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+def estimate_tokens(text: str) -> int:
+    """Conservative BPE token estimate when no tokenizer is installed.
+
+    ASCII words cost about one token per 4 characters, words with
+    diacritics (Vietnamese) about one per 2, punctuation one each; the
+    total is padded by 10% so packed prompts stay under the real limit.
+    """
+    n = 0
+    for piece in _PIECE_RE.findall(text or ""):
+        if piece.isascii():
+            n += max(1, math.ceil(len(piece) / 4)) if piece[0].isalnum() or piece[0] == "_" else 1
+        else:
+            n += max(1, math.ceil(len(piece) / 2))
+    return math.ceil(n * 1.1)
+
+class TokenCounter:
+    """Counts tokens with tiktoken when available, else with ``estimate_tokens``."""
+
+    def __init__(self, model: str = ""):
+        self._enc = None
+        if tiktoken is not None:
+            try:
+                self._enc = tiktoken.encoding_for_model(model)
+            except KeyError:
+                try:
+                    self._enc = tiktoken.get_encoding("o200k_base")
+                except Exception:
+                    self._enc = None
+            except Exception:
+                # BPE file chưa có sẵn và không tải được
+                self._enc = None
+
+    @property
+    def exact(self) -> bool:
+        return self._enc is not None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._enc is not None:
+            return len(self._enc.encode(text, disallowed_special=()))
+        return estimate_tokens(text)
+
+def format_context(chunks: List[Dict]) -> str:
+    parts = []
+    for i, ch in enumerate(chunks, 1):
+        parts.append(f"[{i}] {ch['text']}\nSource: {ch['source']}")
+    return "\n\n".join(parts)
+
+def _overlap(a: str, b: str) -> int:
+    """Length of the longest suffix of ``a`` that is a prefix of ``b``."""
+    for n in range(min(len(a), len(b), _MAX_OVERLAP), _MIN_OVERLAP - 1, -1):
+        if a.endswith(b[:n]):
+            return n
+    return 0
+
+class ContextPacker:
+    """Fits retrieved chunks into the prompt's token budget.
+
+    Chunks are taken whole, in score order, and skipped when they do not fit
+    (a smaller, lower-ranked one may still fit). Exact duplicates are dropped
+    and, for chunks of the same source, the window overlap produced by
+    ``rag._chunk_text`` is sent only once. The budget is the context window
+    minus ``max_tokens`` reserved for the answer, the system prompt and the
+    question, capped at ``max_context_tokens``.
+    """
+
+    def __init__(self, counter: Optional[TokenCounter] = None, context_window: int = LLM_CONTEXT_WINDOW,
+                 max_context_tokens: int = MAX_CONTEXT_TOKENS):
+        self.counter = counter or TokenCounter()
+        self.context_window = context_window
+        self.max_context_tokens = max_context_tokens
+
+    def budget(self, question: str, system_prompt: str, max_tokens: int) -> Dict[str, int]:
+        system = self.counter.count(system_prompt) + _MESSAGE_OVERHEAD
+        q = self.counter.count(question) + _MESSAGE_OVERHEAD
+        available = self.context_window - max_tokens - system - q - _MESSAGE_OVERHEAD
+        if self.max_context_tokens > 0:
+            available = min(available, self.max_context_tokens)
+        return {"system": system, "question": q, "reserved_output": max_tokens,
+                "context_budget": max(0, available)}
+
+    def pack(self, chunks: List[Dict], question: str, system_prompt: str, max_tokens: int) -> Dict:
+        """Return ``{context, chunks, tokens, dropped, exact}`` for the prompt.
+
+        ``chunks`` are the packed (possibly overlap-trimmed) chunks in prompt
+        order; ``tokens`` reports the budget and the tokens actually used.
+        """
+        tokens = self.budget(question, system_prompt, max_tokens)
+        limit = tokens["context_budget"]
+        ordered = sorted(chunks, key=lambda c: -float(c.get("score", 0.0)))
+        packed: List[Dict] = []
+        seen_texts = set()
+        used = dropped = 0
+        for ch in ordered:
+            text = (ch.get("text") or "").strip()
+            if not text or text in seen_texts:
+                dropped += 1
+                continue
+            for prev in packed:
+                if prev["source"] != ch.get("source"):
+                    continue
+                # prev ... | overlap | ... text  (hoặc ngược lại)
+                n = _overlap(prev["text"], text)
+                if n:
+                    text = text[n:].lstrip()
+                    continue
+                n = _overlap(text, prev["text"])
+                if n:
+                    text = text[:len(text) - n].rstrip()
+            if not text:
+                dropped += 1
+                continue
+            item = dict(ch, text=text)
+            # Chi phí mỗi đoạn gồm cả "[i] ... Source: ..." và dòng trống phân tách
+            cost = self.counter.count(format_context([item])) + 2
+            if used + cost > limit:
+                dropped += 1
+                continue
+            packed.append(item)
+            seen_texts.add((ch.get("text") or "").strip())
+            used += cost
+        context = format_context(packed)
+        tokens["context"] = self.counter.count(context) if packed else 0
+        tokens["prompt"] = tokens["system"] + tokens["question"] + tokens["context"] + _MESSAGE_OVERHEAD
+        return {"context": context, "chunks": packed, "tokens": tokens,
+                "dropped": dropped, "exact": self.counter.exact}
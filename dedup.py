@@ -0,0 +1,91 @@
+import re
+import zlib
+import hashlib
+from typing import Dict, Optional, Set, Tuple
+import numpy as np
+
+# 64 hash functions split into 8 bands of 8 rows: pairs with Jaccard similarity
+# around 0.77 or more collide in at least one band with high probability.
+NUM_PERM = 64
+BANDS = 8
+SHINGLE_WORDS = 5
+DUP_THRESHOLD = 0.85
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_rng = np.random.RandomState(1302)
+_PERM_A = _rng.randint(1, 1 << 31, size=NUM_PERM, dtype=np.int64).astype(np.uint64)
+_PERM_B = _rng.randint(0, 1 << 31, size=NUM_PERM, dtype=np.int64).astype(np.uint64)
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+def _normalize(text: str) -> str:
+    return " ".join(_WORD_RE.findall(text.lower()))
+
+def minhash(text: str) -> np.ndarray:
+    """MinHash signature over word shingles (``SHINGLE_WORDS`` words each)."""
+    words = _WORD_RE.findall(text.lower())
+    if len(words) <= SHINGLE_WORDS:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    hv = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+    # Universal hashing (a*x + b) mod p; uint64 wrap-around is fine for hashing
+    with np.errstate(over="ignore"):
+        perms = (np.outer(hv, _PERM_A) + _PERM_B) % _MERSENNE_PRIME
+    return perms.min(axis=0)
+
+class NearDuplicateIndex:
+    """MinHash-LSH registry of indexed chunks, used to drop near-duplicates.
+
+    Entries are namespaced so that, for example, a vendor page is only compared
+    with other vendor chunks and never suppresses a course document.
+    """
+
+    def __init__(self, threshold: float = DUP_THRESHOLD):
+        self.threshold = threshold
+        self._exact: Dict[Tuple[int, str], Set[int]] = {}
+        self._buckets: Dict[Tuple[int, int, bytes], Set[int]] = {}
+        self._entries: Dict[int, Tuple[int, str, np.ndarray]] = {}
+
+    def _bands(self, sig: np.ndarray):
+        rows = NUM_PERM // BANDS
+        for b in range(BANDS):
+            yield b, sig[b * rows:(b + 1) * rows].tobytes()
+
+    def find(self, namespace: int, text: str) -> Tuple[Optional[int], str, np.ndarray]:
+        """Return ``(duplicate id or None, exact key, signature)`` for ``text``."""
+        key = hashlib.sha1(_normalize(text).encode("utf-8")).hexdigest()
+        exact = self._exact.get((namespace, key))
+        sig = minhash(text)
+        if exact:
+            return next(iter(exact)), key, sig
+        seen: Set[int] = set()
+        for b, band in self._bands(sig):
+            for cand in self._buckets.get((namespace, b, band), ()):
+                if cand in seen:
+                    continue
+                seen.add(cand)
+                if float(np.mean(self._entries[cand][2] == sig)) >= self.threshold:
+                    return cand, key, sig
+        return None, key, sig
+
+    def add(self, item_id: int, namespace: int, key: str, sig: np.ndarray):
+        self._entries[item_id] = (namespace, key, sig)
+        self._exact.setdefault((namespace, key), set()).add(item_id)
+        for b, band in self._bands(sig):
+            self._buckets.setdefault((namespace, b, band), set()).add(item_id)
+
+    def remove(self, item_id: int):
+        entry = self._entries.pop(item_id, None)
+        if entry is None:
+            return
+        namespace, key, sig = entry
+        self._exact.get((namespace, key), set()).discard(item_id)
+        for b, band in self._bands(sig):
+            self._buckets.get((namespace, b, band), set()).discard(item_id)
+
+    def renumber(self, remap: Dict[int, int]):
+        entries = self._entries
+        self._exact, self._buckets, self._entries = {}, {}, {}
+        for old, (namespace, key, sig) in entries.items():
+            if old in remap:
+                self.add(remap[old], namespace, key, sig)
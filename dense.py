@@ -0,0 +1,245 @@
+import os
+import re
+import json
+import hashlib
+import threading
+import importlib.util
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+
+# Optional dependencies: the dense retriever is only offered when the
+# embedding model can be loaded; hnswlib is used for ANN when installed.
+# sentence-transformers (and torch) is only imported when an encoder is built.
+try:
+    import hnswlib
+except ImportError:  # pragma: no cover - optional
+    hnswlib = None
+
+# Model nhỏ, đa ngôn ngữ (có tiếng Việt), chạy CPU; có thể trỏ tới thư mục model offline
+EMBED_MODEL = os.getenv("RAG_EMBED_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+EMBED_BATCH = int(os.getenv("RAG_EMBED_BATCH", "32"))
+RRF_K = 60
+
+def is_available() -> bool:
+    return importlib.util.find_spec("sentence_transformers") is not None
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8", errors="ignore")).hexdigest()
+
+class SentenceEncoder:
+    """CPU sentence-transformers model returning L2-normalized float32 vectors."""
+
+    def __init__(self, model_name: str = EMBED_MODEL, batch_size: int = EMBED_BATCH):
+        if not is_available():
+            raise RuntimeError("sentence-transformers is not installed; dense retrieval is unavailable.")
+        from sentence_transformers import SentenceTransformer
+        self.name = model_name
+        self.batch_size = batch_size
+        self._model = SentenceTransformer(model_name, device="cpu")
+        self.dim = int(self._model.get_sentence_embedding_dimension())
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        vecs = self._model.encode(
+            list(texts),
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        return np.asarray(vecs, dtype=np.float32)
+
+class EmbeddingCache:
+    """Append-only float16 vectors on disk, keyed by chunk hash.
+
+    ``vectors.f16`` is memory-mapped for reading, so a rebuild only embeds
+    chunks whose text was never seen by this model.
+    """
+
+    def __init__(self, cache_dir: Optional[str], model_name: str, dim: int):
+        self.dim = dim
+        self.dir = None
+        if cache_dir:
+            self.dir = os.path.join(cache_dir, "emb", re.sub(r"[^\w.-]+", "_", model_name))
+        self._rows: Dict[str, int] = {}
+        self._keys: List[str] = []
+        self._mm = np.zeros((0, dim), dtype=np.float16)
+        self._mem: List[np.ndarray] = []   # used when there is no cache dir
+        self._load()
+
+    def _paths(self):
+        return os.path.join(self.dir, "keys.json"), os.path.join(self.dir, "vectors.f16")
+
+    def _load(self):
+        if self.dir is None:
+            return
+        keys_path, vec_path = self._paths()
+        try:
+            with open(keys_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            keys = meta["keys"] if meta.get("dim") == self.dim else []
+            n = min(len(keys), os.path.getsize(vec_path) // (2 * self.dim))
+        except Exception:
+            keys, n = [], 0
+        self._keys = keys[:n]
+        self._rows = {k: i for i, k in enumerate(self._keys)}
+        self._mm = (np.memmap(vec_path, dtype=np.float16, mode="r", shape=(n, self.dim))
+                    if n else np.zeros((0, self.dim), dtype=np.float16))
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._rows
+
+    def get(self, keys: Sequence[str]) -> np.ndarray:
+        rows = [self._rows[k] for k in keys]
+        if self.dir is None:
+            return np.stack([self._mem[r] for r in rows]) if rows else np.zeros((0, self.dim), np.float16)
+        return np.asarray(self._mm[rows])
+
+    def add(self, keys: Sequence[str], vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float16).reshape(len(keys), self.dim)
+        if self.dir is None:
+            for k, v in zip(keys, vectors):
+                self._rows[k] = len(self._mem)
+                self._mem.append(v)
+            return
+        keys_path, vec_path = self._paths()
+        try:
+            os.makedirs(self.dir, exist_ok=True)
+            with open(vec_path, "ab") as f:
+                f.seek(len(self._keys) * 2 * self.dim)
+                f.truncate()
+                f.write(vectors.tobytes())
+            tmp = f"{keys_path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"dim": self.dim, "keys": self._keys + list(keys)}, f)
+            os.replace(tmp, keys_path)
+            self._load()
+        except Exception:
+            # Read-only disk: keep the new vectors in memory only
+            self.dir = None
+            self._mem = [v for v in np.asarray(self._mm)] + list(vectors)
+            self._keys = self._keys + list(keys)
+            self._rows = {k: i for i, k in enumerate(self._keys)}
+
+class DenseIndex:
+    """Vectors of indexed chunks (label = RAGIndex row) with ANN search.
+
+    Uses an HNSW graph when hnswlib is installed, otherwise (or when the
+    filtered graph search cannot fill k results) exact inner product over the
+    float16 vectors. Rows can be added and removed without rebuilding.
+    """
+
+    def __init__(self, dim: int, capacity: int = 1024):
+        self.dim = dim
+        self._labels: Dict[int, int] = {}     # row -> position in _vectors
+        self._vectors = np.zeros((0, dim), dtype=np.float16)
+        self._hnsw = None
+        if hnswlib is not None:
+            self._hnsw = hnswlib.Index(space="ip", dim=dim)
+            self._hnsw.init_index(max_elements=max(capacity, 16), ef_construction=200, M=16,
+                                  allow_replace_deleted=True)
+            self._hnsw.set_ef(64)
+
+    def __contains__(self, row: int) -> bool:
+        return row in self._labels
+
+    def rows(self) -> Iterable[int]:
+        return self._labels.keys()
+
+    def add(self, rows: Sequence[int], vectors: np.ndarray):
+        if not len(rows):
+            return
+        vectors = np.asarray(vectors, dtype=np.float16)
+        start = len(self._vectors)
+        self._vectors = np.concatenate([self._vectors, vectors])
+        for i, r in enumerate(rows):
+            self._labels[int(r)] = start + i
+        if self._hnsw is not None:
+            needed = self._hnsw.get_current_count() + len(rows)
+            if needed > self._hnsw.get_max_elements():
+                self._hnsw.resize_index(max(needed, 2 * self._hnsw.get_max_elements()))
+            self._hnsw.add_items(vectors.astype(np.float32), np.asarray(rows, dtype=np.int64),
+                                 replace_deleted=True)
+
+    def remove(self, rows: Iterable[int]):
+        for r in rows:
+            if self._labels.pop(int(r), None) is not None and self._hnsw is not None:
+                self._hnsw.mark_deleted(int(r))
+
+    def search(self, query: np.ndarray, active: np.ndarray, k: int) -> List[int]:
+        rows = np.fromiter((r for r in self._labels if r < len(active) and active[r]), dtype=np.int64)
+        if not len(rows) or k <= 0:
+            return []
+        k = min(k, len(rows))
+        query = np.asarray(query, dtype=np.float32).reshape(1, -1)
+        if self._hnsw is not None:
+            try:
+                labels, _ = self._hnsw.knn_query(
+                    query, k=k, filter=lambda label: label < len(active) and bool(active[label]))
+                return [int(label) for label in labels[0]]
+            except RuntimeError:
+                pass   # too few reachable active nodes; fall back to exact search
+        pos = np.array([self._labels[r] for r in rows])
+        sims = self._vectors[pos].astype(np.float32) @ query[0]
+        k = min(k, len(rows))
+        best = np.argpartition(-sims, k - 1)[:k]
+        return rows[best[np.argsort(-sims[best])]].tolist()
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = RRF_K) -> List[Tuple[int, float]]:
+    """Fuse ranked id lists: score(d) = sum over lists of 1 / (k + rank)."""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, 1):
+            scores[doc] = scores.get(doc, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]))
+
+class DenseRetriever:
+    """Keeps a DenseIndex in sync with RAGIndex rows, embedding through the cache."""
+
+    def __init__(self, cache_dir: Optional[str], encoder_factory: Callable[[], object] = SentenceEncoder):
+        self._encoder_factory = encoder_factory
+        self._cache_dir = cache_dir
+        self.encoder = None
+        self.cache: Optional[EmbeddingCache] = None
+        self.index: Optional[DenseIndex] = None
+        self._lock = threading.Lock()   # guards the encoder/cache, which may be shared
+
+    def share(self) -> "DenseRetriever":
+        """A retriever with its own index that reuses this encoder and embedding cache."""
+        self._ensure()
+        other = DenseRetriever(self._cache_dir, self._encoder_factory)
+        other.encoder, other.cache, other._lock = self.encoder, self.cache, self._lock
+        other.index = DenseIndex(self.encoder.dim)
+        return other
+
+    def _ensure(self):
+        with self._lock:
+            if self.encoder is None:
+                self.encoder = self._encoder_factory()
+                self.cache = EmbeddingCache(self._cache_dir, self.encoder.name, self.encoder.dim)
+                self.index = DenseIndex(self.encoder.dim)
+
+    def reset(self):
+        # Row ids changed (index compaction): start a fresh graph, vectors stay cached
+        if self.encoder is not None:
+            self.index = DenseIndex(self.encoder.dim)
+
+    def sync(self, rows: Sequence[int], texts: Sequence[str]):
+        """Make the index hold exactly ``rows``; only unseen texts are embedded."""
+        self._ensure()
+        wanted = set(int(r) for r in rows)
+        self.index.remove([r for r in list(self.index.rows()) if r not in wanted])
+        new = [(int(r), t) for r, t in zip(rows, texts) if int(r) not in self.index]
+        if not new:
+            return
+        keys = [chunk_hash(t) for _, t in new]
+        with self._lock:
+            missing = list(dict.fromkeys(k for k in keys if k not in self.cache))
+            if missing:
+                text_of = {k: t for k, (_, t) in zip(keys, new)}
+                self.cache.add(missing, self.encoder.encode([text_of[k] for k in missing]))
+            vectors = self.cache.get(keys)
+        self.index.add([r for r, _ in new], vectors)
+
+    def search(self, query: str, active: np.ndarray, k: int) -> List[int]:
+        self._ensure()
+        return self.index.search(self.encoder.encode([query])[0], active, k)
@@ -0,0 +1,233 @@
+import os
+import time
+import hashlib
+import threading
+import multiprocessing
+from collections import OrderedDict
+from io import BytesIO
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+# Số process trích xuất PDF và timeout cho mỗi file (giây); override qua env/Secrets
+EXTRACT_WORKERS = int(os.getenv("RAG_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+EXTRACT_TIMEOUT = float(os.getenv("RAG_EXTRACT_TIMEOUT", "60"))
+# PDF dài được chia thành nhiều đoạn trang để chạy song song
+PAGES_PER_TASK = int(os.getenv("RAG_EXTRACT_PAGES_PER_TASK", "16"))
+# Text đã trích xuất từ file upload, giữ theo sha256 nội dung và dùng chung cho mọi phiên (MB ký tự)
+TEXT_CACHE_MB = float(os.getenv("RAG_TEXT_CACHE_MB", "64"))
+
+# A document is a path on disk or the raw bytes of an upload
+Source = Union[str, bytes]
+
+def _decode_text(raw: bytes) -> str:
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        if raw[:2] in (b"\xff\xfe", b"\xfe\xff"):
+            return raw.decode("utf-16", errors="ignore")
+        # Legacy Windows exports (e.g. the SE1810 schedule .txt)
+        return raw.decode("cp1252", errors="replace")
+
+def _read_text(src: Source) -> str:
+    if isinstance(src, bytes):
+        return _decode_text(src)
+    with open(src, "rb") as f:
+        return _decode_text(f.read())
+
+def _open_pdf(src: Source):
+    from pypdf import PdfReader   # only needed once a PDF is actually read
+    return PdfReader(BytesIO(src) if isinstance(src, bytes) else src)
+
+def _pdf_page_count(src: Source) -> int:
+    # Runs in a worker process: opening a pathological PDF can hang as well
+    return len(_open_pdf(src).pages)
+
+def _extract_pdf_pages(src: Source, start: int, end: int) -> List[str]:
+    # Runs in a worker process; a broken page must not fail the whole file
+    reader = _open_pdf(src)
+    texts = []
+    for i in range(start, min(end, len(reader.pages))):
+        try:
+            texts.append(reader.pages[i].extract_text() or "")
+        except Exception:
+            texts.append("")
+    return texts
+
+def is_pdf(name: str) -> bool:
+    return name.lower().endswith(".pdf")
+
+def _mp_context():
+    # Not fork: extract_documents also runs from VendorSync's background
+    # thread, and forking a process that has threads can deadlock the child
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+class _PdfPool:
+    """Process pool for PDF tasks that is replaced when a task stalls.
+
+    Tasks are keyed by ``(doc index, first page)``. When one does not finish
+    in time its pool is terminated (killing the stalled worker) and the other
+    unfinished tasks are resubmitted to a fresh pool, so one pathological
+    file cannot starve the rest even with a single worker.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = max(1, workers)
+        self._pool = None
+        self._tasks: Dict[Tuple[int, int], tuple] = {}
+
+    def submit(self, key: Tuple[int, int], fn, *args):
+        if self._pool is None:
+            self._pool = _mp_context().Pool(processes=self.workers)
+        self._tasks[key] = (fn, args, self._pool.apply_async(fn, args))
+
+    def result(self, key: Tuple[int, int], deadline: float):
+        """The task's result; raises ``multiprocessing.TimeoutError`` past
+        ``deadline`` (``time.monotonic()``) or whatever the task raised."""
+        _, _, fut = self._tasks.pop(key)
+        try:
+            return fut.get(timeout=max(0.0, deadline - time.monotonic()))
+        except multiprocessing.TimeoutError:
+            self._restart(skip_doc=key[0])
+            raise
+
+    def discard(self, doc: int):
+        for key in [k for k in self._tasks if k[0] == doc]:
+            del self._tasks[key]
+
+    def _restart(self, skip_doc: int):
+        self.discard(skip_doc)
+        self._pool.terminate()
+        self._pool.join()
+        self._pool = None
+        for key, (fn, args, fut) in list(self._tasks.items()):
+            if not fut.ready():
+                self.submit(key, fn, *args)
+
+    def close(self):
+        if self._pool is None:
+            return
+        # Not close(): join() would wait for tasks left behind by an early
+        # exit or a failed file, which may be the ones that are stalled
+        self._pool.terminate()
+        self._pool.join()
+        self._pool = None
+        self._tasks.clear()
+
+def extract_documents(
+    docs: List[Tuple[str, Source]],
+    workers: Optional[int] = None,
+    timeout: Optional[float] = None,
+) -> Iterator[Tuple[str, Optional[str]]]:
+    """Yield ``(name, text)`` for every ``(name, source)`` in input order.
+
+    Text files are decoded in-process. PDFs always go to worker processes,
+    page count included, split into page ranges of ``PAGES_PER_TASK``, so a
+    file that hangs the parser can be killed. ``text`` is ``None`` when a PDF
+    cannot be parsed or its page count or pages do not come back within
+    ``timeout`` seconds (each); callers should not remember that result and
+    try the file again later. A PDF without a text layer yields ``""``.
+    """
+    workers = EXTRACT_WORKERS if workers is None else workers
+    timeout = EXTRACT_TIMEOUT if timeout is None else timeout
+
+    pdfs = [i for i, (name, _) in enumerate(docs) if is_pdf(name)]
+    pool = _PdfPool(workers)
+    try:
+        # Page counts first (in parallel), then every file's page ranges are queued
+        for i in pdfs:
+            pool.submit((i, -1), _pdf_page_count, docs[i][1])
+        starts: Dict[int, List[int]] = {}
+        for i in pdfs:
+            try:
+                n_pages = pool.result((i, -1), time.monotonic() + timeout)
+            except Exception:
+                continue
+            starts[i] = list(range(0, n_pages, PAGES_PER_TASK))
+            for s in starts[i]:
+                pool.submit((i, s), _extract_pdf_pages, docs[i][1], s, min(s + PAGES_PER_TASK, n_pages))
+
+        for i, (name, src) in enumerate(docs):
+            if not is_pdf(name):
+                try:
+                    yield name, _read_text(src)
+                except Exception:
+                    yield name, ""
+                continue
+            if i not in starts:
+                yield name, None
+                continue
+            deadline = time.monotonic() + timeout
+            pages: List[str] = []
+            try:
+                for s in starts[i]:
+                    pages.extend(pool.result((i, s), deadline))
+            except Exception:
+                pool.discard(i)
+                yield name, None
+                continue
+            yield name, "\n".join(pages).strip()
+    finally:
+        pool.close()
+
+def content_sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+class TextCache:
+    """Thread-safe LRU of extracted text keyed by content hash, bounded by total characters."""
+
+    def __init__(self, max_chars: int):
+        self.max_chars = max_chars
+        self._texts: "OrderedDict[str, str]" = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            text = self._texts.get(key)
+            if text is None:
+                self.misses += 1
+                return None
+            self._texts.move_to_end(key)
+            self.hits += 1
+            return text
+
+    def put(self, key: str, text: str):
+        if len(text) > self.max_chars:
+            return
+        with self._lock:
+            old = self._texts.pop(key, None)
+            if old is not None:
+                self._chars -= len(old)
+            self._texts[key] = text
+            self._chars += len(text)
+            while self._chars > self.max_chars:
+                _, evicted = self._texts.popitem(last=False)
+                self._chars -= len(evicted)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._texts), "chars": self._chars, "hits": self.hits, "misses": self.misses}
+
+# Cache mặc định của process
+text_cache = TextCache(int(TEXT_CACHE_MB * 2 ** 20))
+
+def extract_cached(docs: List[Tuple[str, bytes]], digests: Optional[List[str]] = None,
+                   cache: Optional[TextCache] = None) -> List[Tuple[str, str]]:
+    """``extract_documents`` for in-memory files, reusing text already extracted
+    from identical bytes (by any session). ``digests`` are the files'
+    ``content_sha256`` when the caller has computed them already.
+    """
+    cache = text_cache if cache is None else cache
+    if digests is None:
+        digests = [content_sha256(data) for _, data in docs]
+    texts = [cache.get(h) for h in digests]
+    todo = [i for i, t in enumerate(texts) if t is None]
+    for i, (_, text) in zip(todo, extract_documents([docs[i] for i in todo])):
+        # A failed or timed-out extraction is not cached, so a later session
+        # can try the file again (the uploading session keeps it as seen)
+        if text is not None:
+            cache.put(digests[i], text)
+        texts[i] = text or ""
+    return [(name, text) for (name, _), text in zip(docs, texts)]
@@ -0,0 +1,333 @@
+import os
+import time
+import queue
+import threading
+import contextvars
+from collections import deque
+from typing import Callable, Dict, Iterator, List, Optional
+import numpy as np
+import tracing
+
+# Chờ tối thiểu/tối đa trước khi gửi request dự phòng (giây); deadline = p95 first byte của provider chính
+HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+HEDGE_MAX_DELAY = float(os.getenv("LLM_HEDGE_MAX_DELAY", "10"))
+# Khi chưa đủ mẫu để tính p95 thì dùng deadline mặc định
+HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "3"))
+HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+HEDGE_WINDOW = int(os.getenv("LLM_HEDGE_WINDOW", "200"))
+# Circuit breaker: số lỗi liên tiếp để ngắt provider và thời gian nghỉ (giây) trước khi thử lại
+BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+class LatencyTracker:
+    """Sliding window of time-to-first-byte per provider.
+
+    Attempts cancelled before their first byte are recorded with the time
+    they had been waiting (a lower bound), so a provider that keeps losing
+    races still shows up as slow.
+    """
+
+    def __init__(self, window: int = HEDGE_WINDOW, min_samples: int = HEDGE_MIN_SAMPLES,
+                 default_delay: float = HEDGE_DEFAULT_DELAY, min_delay: float = HEDGE_MIN_DELAY,
+                 max_delay: float = HEDGE_MAX_DELAY):
+        self.window = window
+        self.min_samples = min_samples
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(name, deque(maxlen=self.window)).append(float(seconds))
+
+    def quantile(self, name: str, q: float) -> Optional[float]:
+        with self._lock:
+            samples = list(self._samples.get(name, ()))
+        return float(np.quantile(samples, q)) if samples else None
+
+    def deadline(self, name: str) -> float:
+        """How long to wait for ``name``'s first byte before hedging."""
+        with self._lock:
+            samples = list(self._samples.get(name, ()))
+        if len(samples) < self.min_samples:
+            return self.default_delay
+        return min(self.max_delay, max(self.min_delay, float(np.quantile(samples, 0.95))))
+
+    def count(self, name: str) -> int:
+        with self._lock:
+            return len(self._samples.get(name, ()))
+
+class CircuitBreaker:
+    """Per-provider closed -> open -> half-open breaker.
+
+    ``failures`` consecutive errors open the circuit: the provider is skipped
+    for ``cooldown`` seconds, then one trial request is let through
+    (half-open). Its success closes the circuit; its failure re-opens it.
+    """
+
+    def __init__(self, failures: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._clock = clock
+        self._state: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name: str) -> Dict:
+        return self._state.setdefault(name, {"state": "closed", "errors": 0, "opened": 0.0, "trial": False})
+
+    def allow(self, name: str) -> bool:
+        with self._lock:
+            s = self._get(name)
+            if s["state"] == "closed":
+                return True
+            if s["state"] == "open":
+                if self._clock() - s["opened"] < self.cooldown:
+                    return False
+                s["state"] = "half_open"
+            if s["trial"]:
+                return False
+            s["trial"] = True
+            return True
+
+    def success(self, name: str):
+        with self._lock:
+            self._state[name] = {"state": "closed", "errors": 0, "opened": 0.0, "trial": False}
+
+    def failure(self, name: str):
+        with self._lock:
+            s = self._get(name)
+            s["errors"] += 1
+            s["trial"] = False
+            if s["state"] == "half_open" or s["errors"] >= self.failures:
+                s["state"] = "open"
+                s["opened"] = self._clock()
+
+    def release(self, name: str):
+        """An attempt ended without an outcome (cancelled): free the half-open trial slot."""
+        with self._lock:
+            self._get(name)["trial"] = False
+
+    def state(self, name: str) -> str:
+        with self._lock:
+            s = self._get(name)
+            if s["state"] == "open" and self._clock() - s["opened"] >= self.cooldown:
+                return "half_open"
+            return s["state"]
+
+class _Attempt:
+    """One provider call running on a daemon thread, feeding ``(attempt, kind, value)`` events."""
+
+    def __init__(self, name: str, provider, call: Callable, events: "queue.Queue"):
+        self.name = name
+        self.cancel = threading.Event()
+        self.started = time.perf_counter()
+        # Run in a copy of the caller's context so provider spans keep the request's trace id
+        ctx = contextvars.copy_context()
+        self._thread = threading.Thread(target=ctx.run, args=(self._run, provider, call, events),
+                                        name=f"hedge-{name}", daemon=True)
+        self._thread.start()
+
+    def _run(self, provider, call: Callable, events: "queue.Queue"):
+        pieces = None
+        try:
+            pieces = call(provider)
+            for piece in pieces:
+                # A cancelled loser stops at its next piece and closes its stream
+                if self.cancel.is_set():
+                    return
+                events.put((self, "piece", piece))
+            events.put((self, "done", None))
+        except BaseException as e:
+            events.put((self, "error", e))
+        finally:
+            close = getattr(pieces, "close", None)
+            if close is not None:
+                try:
+                    close()
+                except Exception:
+                    pass
+
+class HedgedStream:
+    """Iterator over the winning provider's pieces.
+
+    ``winner`` is the winning provider's name (``None`` until the race is
+    decided), so callers can attribute the answer to the model that wrote it.
+    """
+
+    def __init__(self, hedged: "HedgedProvider", call: Callable):
+        self.winner: Optional[str] = None
+        self._pieces = hedged._race(call, self)
+
+    def __iter__(self) -> "HedgedStream":
+        return self
+
+    def __next__(self) -> str:
+        return next(self._pieces)
+
+    def close(self):
+        self._pieces.close()
+
+class HedgedProvider:
+    """Races several ``LLMProvider``-like objects with hedged requests.
+
+    The first provider whose circuit is closed is called; if it has not
+    produced its first piece within its p95 time-to-first-byte (see
+    ``LatencyTracker.deadline``), the next provider is called in parallel.
+    Whichever produces a first piece first is streamed to the caller and the
+    others are cancelled. A provider that fails before its first piece hands
+    over to the next one immediately; errors after the first piece are raised
+    (an answer is never spliced from two models).
+
+    Providers only need ``provider`` (a name), ``generate_answer`` and
+    ``generate_answer_stream``, so fakes work for tests and benchmarks.
+    Cancellation is cooperative: a losing call stops (and closes its HTTP
+    stream) when its next piece arrives.
+    """
+
+    def __init__(self, providers: List, names: Optional[List[str]] = None,
+                 tracker: Optional[LatencyTracker] = None, breaker: Optional[CircuitBreaker] = None):
+        if not providers:
+            raise ValueError("HedgedProvider needs at least one provider.")
+        self.providers = list(providers)
+        self.names = list(names) if names else [getattr(p, "provider", f"p{i}") for i, p in enumerate(providers)]
+        if len(set(self.names)) != len(self.names):
+            raise ValueError("Provider names must be unique.")
+        self.provider = "+".join(self.names)
+        self.tracker = tracker or LatencyTracker()
+        self.breaker = breaker or CircuitBreaker()
+        self._lock = threading.Lock()
+        self._counts = {name: {"wins": 0, "hedged": 0, "errors": 0} for name in self.names}
+
+    @property
+    def primary(self):
+        return self.providers[0]
+
+    def pack_context(self, question: str, chunks: List[Dict], system_prompt: str) -> Dict:
+        # Token budget follows the primary model
+        return self.primary.pack_context(question, chunks, system_prompt)
+
+    def generate_answer(self, question: str, context: str, system_prompt: str, temperature: float = 0.3) -> str:
+        return "".join(self._race(lambda p: iter([p.generate_answer(question, context, system_prompt, temperature)])))
+
+    def generate_answer_stream(self, question: str, context: str, system_prompt: str,
+                               temperature: float = 0.3) -> HedgedStream:
+        return HedgedStream(self, lambda p: p.generate_answer_stream(question, context, system_prompt, temperature))
+
+    def model_label(self, name: str) -> str:
+        """``provider:model`` of the provider called ``name``."""
+        provider = self.providers[self.names.index(name)]
+        return f"{name}:{getattr(provider, 'model', '')}"
+
+    def _count(self, name: str, key: str):
+        with self._lock:
+            self._counts[name][key] += 1
+
+    def _race(self, call: Callable, stream: Optional[HedgedStream] = None) -> Iterator[str]:
+        candidates = list(zip(self.names, self.providers))
+        events: "queue.Queue" = queue.Queue()
+        running: List[_Attempt] = []
+        settled = set()   # attempts whose outcome (or cancellation) the breaker has been told
+        winner: Optional[_Attempt] = None
+        first, kind = None, None
+        launched = 0
+
+        def launch() -> Optional[float]:
+            # Next provider whose circuit lets a request through; its hedge deadline
+            nonlocal launched
+            while candidates:
+                name, provider = candidates.pop(0)
+                if self.breaker.allow(name):
+                    running.append(_Attempt(name, provider, call, events))
+                    launched += 1
+                    return time.monotonic() + self.tracker.deadline(name)
+            return None
+
+        try:
+            with tracing.span("llm.hedge") as attrs:
+                deadline = launch()
+                if deadline is None:
+                    raise RuntimeError("All LLM providers are unavailable (circuit open): " + ", ".join(self.names))
+                while winner is None:
+                    timeout = max(0.0, deadline - time.monotonic()) if candidates else None
+                    try:
+                        att, kind, value = events.get(timeout=timeout)
+                    except queue.Empty:
+                        # The running call is slower than its p95: fire the next provider too
+                        n = len(running)
+                        deadline = launch() or float("inf")
+                        if len(running) > n:
+                            self._count(running[-1].name, "hedged")
+                            attrs["hedged"] = True
+                        continue
+                    if att not in running:
+                        continue
+                    if kind == "error":
+                        running.remove(att)
+                        settled.add(att)
+                        self.breaker.failure(att.name)
+                        self._count(att.name, "errors")
+                        if not running:
+                            deadline = launch()
+                            if deadline is None:
+                                raise value
+                        continue
+                    winner, first = att, value
+                    self.tracker.record(att.name, time.perf_counter() - att.started)
+                for att in running:
+                    if att is not winner:
+                        att.cancel.set()
+                        self.tracker.record(att.name, time.perf_counter() - att.started)
+                        self.breaker.release(att.name)
+                        settled.add(att)
+                self._count(winner.name, "wins")
+                attrs.update(winner=winner.name, attempts=launched)
+                if stream is not None:
+                    stream.winner = winner.name
+
+            if first is not None:
+                yield first
+            while kind != "done":
+                att, kind, value = events.get()
+                if att is not winner:
+                    continue
+                if kind == "piece":
+                    yield value
+                elif kind == "error":
+                    settled.add(winner)
+                    self.breaker.failure(winner.name)
+                    self._count(winner.name, "errors")
+                    raise value
+            settled.add(winner)
+            self.breaker.success(winner.name)
+        finally:
+            # Consumer stopped early (e.g. a Streamlit rerun mid-answer) or an error
+            # escaped: stop every call still running, and free the half-open trial
+            # slot of any attempt without an outcome, or its circuit never closes
+            for att in running:
+                att.cancel.set()
+                if att not in settled:
+                    self.breaker.release(att.name)
+
+    def stats(self) -> Dict[str, Dict]:
+        """Per provider: wins, hedges fired at it, errors, p50/p95 first byte (s), breaker state."""
+        with self._lock:
+            counts = {n: dict(c) for n, c in self._counts.items()}
+        for name, row in counts.items():
+            row.update(samples=self.tracker.count(name), p50=self.tracker.quantile(name, 0.5),
+                       p95=self.tracker.quantile(name, 0.95), deadline=self.tracker.deadline(name),
+                       breaker=self.breaker.state(name))
+        return counts
+
+    def ping(self) -> str:
+        results = [f"{name}: {p.ping()}" for name, p in zip(self.names, self.providers)]
+        ok = all("✅" in r for r in results)
+        return ("✅ " if ok else "❌ ") + " | ".join(results)
+
+    def close(self):
+        for p in self.providers:
+            close = getattr(p, "close", None)
+            if close is not None:
+                close()
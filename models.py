@@ -1,9 +1,73 @@
 import os
 import json
 import time
+import random
+import asyncio
+import email.utils
 import requests
-from typing import Optional
-import google.generativeai as genai
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import InvalidHeader
+from urllib3.util.retry import Retry
+from context_budget import ContextPacker, TokenCounter
+import tracing
+
+# Client async là tuỳ chọn (dùng cho nhiều request đồng thời, ví dụ HTTP API);
+# chỉ import khi dùng tới vì aiohttp làm chậm lúc khởi động app
+def _aiohttp():
+    try:
+        import aiohttp
+    except ImportError:  # pragma: no cover - optional
+        raise RuntimeError("aiohttp is not installed; async client is unavailable.") from None
+    return aiohttp
+
+# Các mã lỗi tạm thời được retry (429 tôn trọng header Retry-After)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Chờ tối đa bao nhiêu giây cho một lần retry, kể cả khi Retry-After đòi lâu hơn
+RETRY_MAX_WAIT = float(os.getenv("LLM_RETRY_MAX_WAIT", "30"))
+
+def _parse_retry_after(value: str) -> float:
+    # Giây (cho phép số thực, ví dụ "0.2") hoặc HTTP-date; ValueError nếu không đọc được
+    try:
+        seconds = float(value)
+    except ValueError:
+        when = email.utils.parsedate_to_datetime(value)   # ValueError/TypeError nếu hỏng
+        seconds = when.timestamp() - time.time()
+    if seconds != seconds:   # NaN
+        raise ValueError(f"Invalid Retry-After: {value!r}")
+    return min(max(0.0, seconds), RETRY_MAX_WAIT)
+
+def _backoff_delay(base: float, attempt: int, retry_after: Optional[str] = None) -> float:
+    # Retry-After (giây) nếu server gửi, ngược lại exponential backoff với full jitter
+    if retry_after:
+        try:
+            return _parse_retry_after(retry_after)
+        except (TypeError, ValueError):
+            pass
+    return min(random.uniform(0, base ** (attempt - 1)), RETRY_MAX_WAIT)
+
+class _JitteredRetry(Retry):
+    """urllib3 Retry với full jitter; Retry-After vẫn được ưu tiên.
+
+    Retry-After dạng số thực được chấp nhận, bị giới hạn bởi ``RETRY_MAX_WAIT``,
+    và header không đọc được thì dùng backoff thay vì báo lỗi ``InvalidHeader``.
+    """
+
+    def parse_retry_after(self, retry_after: str) -> float:
+        try:
+            return _parse_retry_after(retry_after)
+        except (TypeError, ValueError):
+            raise InvalidHeader(f"Invalid Retry-After header: {retry_after}") from None
+
+    def sleep_for_retry(self, response) -> bool:
+        try:
+            return super().sleep_for_retry(response)
+        except InvalidHeader:
+            return False
+
+    def get_backoff_time(self) -> float:
+        backoff = super().get_backoff_time()
+        return min(random.uniform(0, backoff), RETRY_MAX_WAIT) if backoff > 0 else 0.0
 
 class LLMProvider:
     def __init__(self, provider: str):
@@ -11,7 +75,6 @@ class LLMProvider:
 
         # Các tham số có thể override qua Secrets
         self.max_tokens = int(os.getenv("GITHUB_MODELS_MAX_TOKENS", "600"))
-        self.max_context_chars = int(os.getenv("MAX_CONTEXT_CHARS", "12000"))
         # Timeout: tuple(connect, read). Có thể override bằng GITHUB_MODELS_TIMEOUT_READ/CONNECT
         connect_to = float(os.getenv("GITHUB_MODELS_TIMEOUT_CONNECT", "10"))
         read_to = float(os.getenv("GITHUB_MODELS_TIMEOUT_READ", "180"))
@@ -19,6 +82,10 @@ class LLMProvider:
         # Số lần retry khi timeout/5xx
         self.retries = int(os.getenv("GITHUB_MODELS_RETRIES", "3"))
         self.backoff_base = float(os.getenv("GITHUB_MODELS_BACKOFF_BASE", "2"))
+        # Số connection keep-alive giữ trong pool (dùng chung giữa các request)
+        self.pool_size = int(os.getenv("GITHUB_MODELS_POOL_SIZE", "10"))
+        self.session = self._make_session()
+        self._aio_session = None
 
         if self.provider == "github":
             self.gh_token = os.getenv("GITHUB_MODELS_TOKEN")
@@ -31,20 +98,182 @@ class LLMProvider:
             self.gg_model = os.getenv("GOOGLE_MODEL", "gemini-1.5-pro")
             if not self.gg_key:
                 raise ValueError("Missing GOOGLE_API_KEY in secrets.")
+            # SDK Gemini chỉ nạp khi dùng provider google (import mất ~1s)
+            import google.generativeai as genai
             genai.configure(api_key=self.gg_key)
             self.gg_client = genai.GenerativeModel(self.gg_model)
         else:
             raise ValueError("Provider must be 'github' or 'google'.")
+        # Đếm token theo model để xếp trích dẫn vừa ngân sách prompt
+        self.model = self.gh_model if self.provider == "github" else self.gg_model
+        self.packer = ContextPacker(TokenCounter(self.model))
 
     @staticmethod
     def from_env():
         provider = os.getenv("PROVIDER", "github").lower()
         return LLMProvider(provider)
 
+    def pack_context(self, question: str, chunks: List[Dict], system_prompt: str) -> Dict:
+        """Chọn các đoạn trích (nguyên đoạn, theo score) vừa ngân sách token.
+
+        Trả về dict của ContextPacker.pack: ``context`` để truyền vào
+        generate_answer*, ``chunks`` đã dùng và ``tokens`` đã tiêu.
+        """
+        with tracing.span("context.build", provider=self.provider) as attrs:
+            packed = self.packer.pack(chunks, question, system_prompt, self.max_tokens)
+            attrs.update(chunks=len(packed["chunks"]), tokens=packed["tokens"]["context"])
+        return packed
+
     def generate_answer(self, question: str, context: str, system_prompt: str, temperature: float = 0.3) -> str:
+        with tracing.span("llm.total", provider=self.provider, stream=False):
+            if self.provider == "github":
+                return self._generate_github(question, context, system_prompt, temperature)
+            return self._generate_google(question, context, system_prompt, temperature)
+
+    def generate_answer_stream(self, question: str, context: str, system_prompt: str,
+                               temperature: float = 0.3) -> Iterator[str]:
+        """Như generate_answer nhưng trả về từng đoạn text ngay khi model sinh ra."""
         if self.provider == "github":
-            return self._generate_github(question, context, system_prompt, temperature)
-        return self._generate_google(question, context, system_prompt, temperature)
+            pieces = self._stream_github(question, context, system_prompt, temperature)
+        else:
+            pieces = self._stream_google(question, context, system_prompt, temperature)
+        return self._traced_stream(pieces)
+
+    def _traced_stream(self, pieces: Iterator[str]) -> Iterator[str]:
+        # llm.first_byte: từ lúc gửi request tới đoạn text đầu tiên; llm.total: tới khi hết stream
+        with tracing.span("llm.total", provider=self.provider, stream=True):
+            start = time.perf_counter()
+            first = True
+            for piece in pieces:
+                if first:
+                    tracing.record("llm.first_byte", time.perf_counter() - start, provider=self.provider)
+                    first = False
+                yield piece
+
+    def _make_session(self) -> requests.Session:
+        # Connect error và 429/5xx được retry ở tầng adapter (backoff có jitter,
+        # tôn trọng Retry-After); read timeout do _post_with_retries xử lý:
+        # read=False để urllib3 ném lại ReadTimeoutError gốc (requests đổi thành
+        # ReadTimeout) thay vì gói thành ConnectionError "Max retries exceeded".
+        n = max(0, self.retries - 1)
+        retry = _JitteredRetry(
+            total=n,
+            connect=n,
+            read=False,
+            status=n,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=None,   # POST tới chat/completions cũng được retry
+            backoff_factor=self.backoff_base / 2,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def close(self):
+        self.session.close()
+
+    # ---------- Async client (aiohttp, tuỳ chọn) ----------
+    def _aio(self):
+        # Một ClientSession (một connection pool) cho mọi request async; phải
+        # dùng trong cùng event loop đã tạo ra nó.
+        aiohttp = _aiohttp()
+        if self._aio_session is None or self._aio_session.closed:
+            self._aio_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(sock_connect=self.timeout[0], sock_read=self.timeout[1]),
+            )
+        return self._aio_session
+
+    async def aclose(self):
+        if self._aio_session is not None and not self._aio_session.closed:
+            await self._aio_session.close()
+
+    async def _apost_with_retries(self, url: str, payload: dict):
+        aiohttp = _aiohttp()
+        session = self._aio()
+        for attempt in range(1, self.retries + 1):
+            try:
+                with tracing.span("llm.connect", provider=self.provider, attempt=attempt):
+                    resp = await session.post(url, headers=self._github_headers(), data=json.dumps(payload))
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt >= self.retries:
+                    raise
+                await asyncio.sleep(_backoff_delay(self.backoff_base, attempt))
+                continue
+            if resp.status in RETRY_STATUSES and attempt < self.retries:
+                delay = _backoff_delay(self.backoff_base, attempt, resp.headers.get("Retry-After"))
+                await resp.read()   # đọc hết body để connection được trả lại pool
+                resp.release()
+                await asyncio.sleep(delay)
+                continue
+            if resp.status >= 400:
+                body = await resp.text()
+                resp.release()
+                snippet = (body[:1000] + "...") if len(body) > 1000 else body
+                raise RuntimeError(f"GitHub Models API error: HTTP {resp.status} {resp.reason} | Body: {snippet}")
+            return resp
+        raise RuntimeError("Unknown error while calling GitHub Models")
+
+    async def agenerate_answer(self, question: str, context: str, system_prompt: str,
+                               temperature: float = 0.3) -> str:
+        """Bản async của generate_answer; các request dùng chung một connection pool."""
+        with tracing.span("llm.total", provider=self.provider, stream=False):
+            if self.provider == "github":
+                url = f"{self.gh_base}/chat/completions"
+                payload = self._github_payload(question, context, system_prompt, temperature)
+                resp = await self._apost_with_retries(url, payload)
+                async with resp:
+                    data = await resp.json(content_type=None)
+                return data["choices"][0]["message"]["content"]
+            prompt = self._build_prompt(system_prompt, question, context)
+            resp = await self.gg_client.generate_content_async(
+                prompt, generation_config={"temperature": float(temperature)})
+            return self._google_text(resp)
+
+    async def agenerate_answer_stream(self, question: str, context: str, system_prompt: str,
+                                      temperature: float = 0.3) -> AsyncIterator[str]:
+        with tracing.span("llm.total", provider=self.provider, stream=True):
+            start = time.perf_counter()
+            first = True
+            async for piece in self._astream(question, context, system_prompt, temperature):
+                if first:
+                    tracing.record("llm.first_byte", time.perf_counter() - start, provider=self.provider)
+                    first = False
+                yield piece
+
+    async def _astream(self, question: str, context: str, system_prompt: str,
+                       temperature: float) -> AsyncIterator[str]:
+        if self.provider == "github":
+            url = f"{self.gh_base}/chat/completions"
+            payload = self._github_payload(question, context, system_prompt, temperature)
+            payload["stream"] = True
+            resp = await self._apost_with_retries(url, payload)
+            async with resp:
+                async for raw in resp.content:
+                    piece = self._sse_piece(raw.decode("utf-8", errors="replace").strip())
+                    if piece is None:
+                        break
+                    if piece:
+                        yield piece
+            return
+        prompt = self._build_prompt(system_prompt, question, context)
+        resp = await self.gg_client.generate_content_async(
+            prompt, generation_config={"temperature": float(temperature)}, stream=True)
+        produced = False
+        async for chunk in resp:
+            try:
+                piece = chunk.text
+            except ValueError:
+                piece = ""
+            if piece:
+                produced = True
+                yield piece
+        if not produced:
+            raise RuntimeError("Google (Gemini) returned no text (response blocked or empty).")
 
     # ---------- GitHub Models ----------
     def _github_headers(self):
@@ -63,61 +292,79 @@ class LLMProvider:
         snippet = (body[:1000] + "...") if len(body) > 1000 else body
         return f"HTTP {resp.status_code} {resp.reason} | Body: {snippet}"
 
-    def _post_with_retries(self, url: str, payload: dict) -> requests.Response:
-        last_exc: Optional[Exception] = None
+    def _post_with_retries(self, url: str, payload: dict, stream: bool = False) -> requests.Response:
+        # Với stream=True chỉ retry tới khi nhận được header phản hồi.
+        # Phản hồi 429/5xx cuối cùng (sau khi adapter đã retry) được trả về để caller báo lỗi.
         for attempt in range(1, self.retries + 1):
             try:
-                resp = requests.post(
-                    url,
-                    headers=self._github_headers(),
-                    data=json.dumps(payload),
-                    timeout=self.timeout,
-                )
-                # Retry khi gặp 5xx
-                if resp.status_code >= 500:
-                    last_exc = RuntimeError(self._summarize_http_error(resp))
-                    raise last_exc
-                return resp
-            except (requests.exceptions.ReadTimeout, requests.exceptions.ConnectTimeout, requests.exceptions.ConnectionError) as e:
-                last_exc = e
-                if attempt < self.retries:
-                    time.sleep(self.backoff_base ** (attempt - 1))  # 1s, 2s, 4s...
-                else:
+                # Với stream=True post() trả về ngay khi nhận header -> đo được connect + TTFB
+                with tracing.span("llm.connect", provider=self.provider, attempt=attempt):
+                    return self.session.post(
+                        url,
+                        headers=self._github_headers(),
+                        data=json.dumps(payload),
+                        timeout=self.timeout,
+                        stream=stream,
+                    )
+            except requests.exceptions.ReadTimeout:
+                if attempt >= self.retries:
                     raise
-        # Fallback (hiếm khi tới đây)
-        if isinstance(last_exc, Exception):
-            raise last_exc
+                time.sleep(_backoff_delay(self.backoff_base, attempt))
         raise RuntimeError("Unknown error while calling GitHub Models")
 
-    def _generate_github(self, question: str, context: str, system_prompt: str, temperature: float) -> str:
-        url = f"{self.gh_base}/chat/completions"
-
-        # Cắt context quá dài để tránh thời gian suy luận quá lâu
+    def _github_payload(self, question: str, context: str, system_prompt: str, temperature: float) -> dict:
+        # context đã được pack_context giới hạn theo token (không cắt giữa đoạn)
         ctx = context or ""
-        truncated = False
-        if self.max_context_chars > 0 and len(ctx) > self.max_context_chars:
-            ctx = ctx[: self.max_context_chars]
-            truncated = True
-
         messages = [{"role": "system", "content": system_prompt}]
         if ctx:
-            extra = "\n\n[Context truncated]\n" if truncated else ""
-            messages.append({"role": "system", "content": f"Use this course context when relevant:{extra}\n{ctx}"})
+            messages.append({"role": "system", "content": f"Use this course context when relevant:\n{ctx}"})
         messages.append({"role": "user", "content": question})
 
-        payload = {
+        return {
             "model": self.gh_model,
             "messages": messages,
             "temperature": float(temperature),
             "max_tokens": int(self.max_tokens),
         }
 
+    def _generate_github(self, question: str, context: str, system_prompt: str, temperature: float) -> str:
+        url = f"{self.gh_base}/chat/completions"
+        payload = self._github_payload(question, context, system_prompt, temperature)
         resp = self._post_with_retries(url, payload)
         if not resp.ok:
             raise RuntimeError(f"GitHub Models API error: {self._summarize_http_error(resp)}")
         data = resp.json()
         return data["choices"][0]["message"]["content"]
 
+    def _stream_github(self, question: str, context: str, system_prompt: str, temperature: float) -> Iterator[str]:
+        url = f"{self.gh_base}/chat/completions"
+        payload = self._github_payload(question, context, system_prompt, temperature)
+        payload["stream"] = True
+        resp = self._post_with_retries(url, payload, stream=True)
+        with resp:
+            if not resp.ok:
+                raise RuntimeError(f"GitHub Models API error: {self._summarize_http_error(resp)}")
+            for raw in resp.iter_lines():
+                piece = self._sse_piece(raw.decode("utf-8", errors="replace") if raw else "")
+                if piece is None:
+                    break
+                if piece:
+                    yield piece
+
+    @staticmethod
+    def _sse_piece(line: str) -> Optional[str]:
+        # Server-Sent Events: mỗi dòng "data: {...}", kết thúc bằng "data: [DONE]" (-> None)
+        if not line.startswith("data:"):
+            return ""
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return None
+        try:
+            event = json.loads(data)
+        except ValueError:
+            return ""
+        return "".join((c.get("delta") or {}).get("content") or "" for c in event.get("choices") or [])
+
     # ---------- Google (Gemini) ----------
     def _generate_google(self, question: str, context: str, system_prompt: str, temperature: float) -> str:
         prompt = self._build_prompt(system_prompt, question, context)
@@ -125,7 +372,40 @@ class LLMProvider:
             prompt,
             generation_config={"temperature": float(temperature)}
         )
-        return getattr(resp, "text", "").strip() or "Xin lỗi, tôi không thể tạo câu trả lời lúc này."
+        return self._google_text(resp)
+
+    @staticmethod
+    def _google_text(resp) -> str:
+        try:
+            text = (resp.text or "").strip()
+        except ValueError:
+            # Bị chặn (safety) hoặc không có candidate
+            text = ""
+        if not text:
+            # Như bản stream: không trả câu xin lỗi như một câu trả lời hợp lệ (cache, batch_qa ghi "ok")
+            raise RuntimeError("Google (Gemini) returned no text (response blocked or empty).")
+        return text
+
+    def _stream_google(self, question: str, context: str, system_prompt: str, temperature: float) -> Iterator[str]:
+        prompt = self._build_prompt(system_prompt, question, context)
+        resp = self.gg_client.generate_content(
+            prompt,
+            generation_config={"temperature": float(temperature)},
+            stream=True,
+        )
+        produced = False
+        for chunk in resp:
+            try:
+                piece = chunk.text
+            except ValueError:
+                # Chunk bị chặn (safety) hoặc không có text
+                piece = ""
+            if piece:
+                produced = True
+                yield piece
+        if not produced:
+            # Không trả câu xin lỗi như một câu trả lời: caller sẽ lưu nó vào cache
+            raise RuntimeError("Google (Gemini) returned no text (response blocked or empty).")
 
     def _build_prompt(self, system_prompt: str, question: str, context: str) -> str:
         ctx = f"\n\nContext (course/vendor docs):\n{context}\n" if context else ""
@@ -141,7 +421,7 @@ class LLMProvider:
                 "max_tokens": 5,
             }
             try:
-                resp = requests.post(url, headers=self._github_headers(), data=json.dumps(payload), timeout=self.timeout)
+                resp = self.session.post(url, headers=self._github_headers(), data=json.dumps(payload), timeout=self.timeout)
                 if not resp.ok:
                     return f"❌ GitHub Models ping failed: {self._summarize_http_error(resp)}"
                 return "✅ GitHub Models ping OK"
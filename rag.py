@@ -1,31 +1,55 @@
 import os
 import glob
 import re
-from typing import List, Dict, Optional, Iterable
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from pypdf import PdfReader
-
-def _read_text_file(path: str) -> str:
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return f.read()
-    except UnicodeDecodeError:
-        with open(path, "r", encoding="utf-16", errors="ignore") as f:
-            return f.read()
-
-def _read_pdf_file(path: str) -> str:
-    try:
-        reader = PdfReader(path)
-        texts = []
-        for page in reader.pages:
-            t = page.extract_text() or ""
-            texts.append(t)
-        return "\n".join(texts).strip()
-    except Exception:
-        return ""
-
-def _chunk_text(text: str, max_chars: int = 1200, overlap: int = 150) -> List[str]:
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional, Iterable, Tuple
+import numpy as np
+import scipy.sparse as sp
+from extract import extract_documents, extract_cached, content_sha256
+from dedup import NearDuplicateIndex
+from bm25 import BM25Index
+import dense
+from analyzer import DEFAULT_ANALYZER, get_analyzer
+from chunk_store import ChunkStore, ChunkView
+from search_cache import SEARCH_CACHE_SIZE, SearchCache, normalize_query
+import tracing
+
+# Bump whenever chunking, tokenization or the on-disk layout changes so that
+# stale snapshots are ignored instead of mis-read.
+SNAPSHOT_VERSION = 4
+DEFAULT_CACHE_DIR = os.getenv("RAG_CACHE_DIR", os.path.join(".cache", "rag"))
+
+EMPTY_INDEX_TEXT = "No documents found. Please add files into data/ or enable vendor sources."
+
+# Every chunk belongs to one source group. Document frequencies are kept per
+# group, so switching a group on/off only changes which statistics are summed.
+GROUP_LOCAL = 0
+GROUP_VENDOR = 1
+GROUP_UPLOAD = 2
+_N_GROUPS = 3
+
+# Chunk size and overlap (characters) used when splitting documents
+CHUNK_CHARS = int(os.getenv("RAG_CHUNK_CHARS", "1200"))
+CHUNK_OVERLAP = int(os.getenv("RAG_CHUNK_OVERLAP", "150"))
+
+# Retrieval backends selectable per index (see RAGIndex.set_backend)
+BACKENDS = ("tfidf", "bm25", "hybrid")
+# Candidates taken from each retriever before reciprocal-rank fusion
+HYBRID_CANDIDATES = 50
+
+ALL_GROUPS = tuple(range(_N_GROUPS))
+
+# Per-session cap on uploaded chunk text (MB of UTF-8, as stored in the ChunkStore); older uploads are evicted beyond it
+SESSION_UPLOAD_MB = float(os.getenv("RAG_SESSION_UPLOAD_MB", "16"))
+
+def available_backends() -> List[str]:
+    # "hybrid" needs the optional embedding model (sentence-transformers)
+    return [b for b in BACKENDS if b != "hybrid" or dense.is_available()]
+
+def _chunk_text(text: str, max_chars: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP) -> List[str]:
     paras = [p.strip() for p in re.split(r"\n{2,}", text) if p.strip()]
     chunks = []
     for p in paras:
@@ -41,105 +65,889 @@ def _chunk_text(text: str, max_chars: int = 1200, overlap: int = 150) -> List[st
                 start = max(0, end - overlap)
     return chunks
 
+def _file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _atomic_save(path: str, write, mode: str = "wb"):
+    tmp = f"{path}.tmp"
+    with open(tmp, mode, **({} if "b" in mode else {"encoding": "utf-8"})) as f:
+        write(f)
+    os.replace(tmp, path)
+
+def _digest(texts: List[str]) -> str:
+    h = hashlib.sha1()
+    for t in texts:
+        h.update(t.encode("utf-8", errors="ignore"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+def top_k_rows(scores, active: np.ndarray, top_k: int) -> List[tuple]:
+    """Per row of the sparse ``scores`` matrix, the ``top_k`` best active columns.
+
+    Only the non-zero entries are ranked (``argpartition`` + a sort of ``top_k``
+    items); if fewer than ``top_k`` chunks match, the rest is filled with
+    zero-score active chunks. Returns ``[(row ids, scores), ...]``.
+    """
+    scores = scores.tocsr()
+    k = min(top_k, int(active.sum()))
+    out = []
+    for q in range(scores.shape[0]):
+        lo, hi = scores.indptr[q], scores.indptr[q + 1]
+        idx = scores.indices[lo:hi]
+        val = scores.data[lo:hi]
+        keep = active[idx] & (val > 0)
+        idx, val = idx[keep], val[keep]
+        if len(idx) > k:
+            part = np.argpartition(-val, k - 1)[:k]
+            idx, val = idx[part], val[part]
+        order = np.lexsort((idx, -val))
+        out.append(_pad_top_k(idx[order], val[order], active, k))
+    return out
+
+def _pad_top_k(idx: np.ndarray, val: np.ndarray, active: np.ndarray, k: int) -> tuple:
+    # Fewer matches than k: fill up with zero-score active chunks
+    if len(idx) < k:
+        extra = np.flatnonzero(active)
+        extra = extra[~np.isin(extra, idx)][:k - len(idx)]
+        idx = np.concatenate([idx, extra])
+        val = np.concatenate([val, np.zeros(len(extra))])
+    return idx, val
+
+def _nbytes(obj) -> int:
+    if isinstance(obj, np.ndarray):
+        return int(obj.nbytes)
+    if sp.issparse(obj):
+        obj = obj.tocsr()
+        return int(obj.data.nbytes + obj.indices.nbytes + obj.indptr.nbytes)
+    if isinstance(obj, (tuple, list)):
+        return sum(_nbytes(o) for o in obj)
+    if isinstance(obj, BM25Index):
+        return sum(len(a) * a.itemsize for a in (obj.offsets, obj.docs, obj.impacts)) \
+            + 8 * len(obj.upper) + int(obj.doc_ids.nbytes)
+    return 0
+
+class _OverlayVocab:
+    """Copy-on-write vocabulary: reads fall through to a frozen base vocabulary,
+    new terms get ids after the base's, so term columns line up with the base."""
+
+    def __init__(self, base: Dict[str, int]):
+        self._base = base
+        self._own: Dict[str, int] = {}
+
+    def get(self, term: str, default=None):
+        tid = self._own.get(term)
+        return self._base.get(term, default) if tid is None else tid
+
+    def __setitem__(self, term: str, tid: int):
+        self._own[term] = tid
+
+    def __len__(self) -> int:
+        return len(self._base) + len(self._own)
+
+    def __iter__(self):
+        return iter(self._own)
+
+    def items(self):
+        return list(self._base.items()) + list(self._own.items())
+
+class _Source:
+    __slots__ = ("group", "digest", "rows", "dropped")
+
+    def __init__(self, group: int, digest: str, rows: List[int], dropped: List[str]):
+        self.group = group
+        self.digest = digest
+        self.rows = rows
+        self.dropped = dropped   # chunk texts skipped as near-duplicates
+
 class RAGIndex:
-    def __init__(self, data_dir: str = "data"):
+    """TF-IDF index that is updated incrementally.
+
+    Adding or removing a source only tokenizes that source and records a delta
+    (raw term counts + document-frequency changes). IDF weights and the
+    normalized matrix are recomputed lazily on the next ``search()``, and
+    source toggles are applied as row masks over the same matrix.
+
+    Backends (``BACKENDS``) are fitted lazily from the same raw term counts
+    and return ``{text, source, score}`` dicts; "hybrid" fuses TF-IDF with a
+    dense embedding retriever by reciprocal rank (score = fused RRF score).
+    Models are cached per (backend, source groups), so callers may pass
+    ``backend``/``groups`` to ``search_batch`` instead of changing the
+    index-wide defaults; after ``freeze()`` the content is read-only and the
+    index can be searched from several threads.
+    """
+
+    def __init__(self, data_dir: str = "data", cache_dir: Optional[str] = DEFAULT_CACHE_DIR, dedup: bool = True,
+                 backend: str = "tfidf", chunk_chars: int = CHUNK_CHARS, chunk_overlap: int = CHUNK_OVERLAP,
+                 analyzer: str = DEFAULT_ANALYZER, search_cache_size: int = SEARCH_CACHE_SIZE):
+        if chunk_chars <= 0 or not 0 <= chunk_overlap < chunk_chars:
+            raise ValueError("chunk_chars must be positive and 0 <= chunk_overlap < chunk_chars.")
         self.data_dir = data_dir
-        self.vectorizer: Optional[TfidfVectorizer] = None
-        self.matrix = None
-        self.local_chunks: List[Dict] = []
-        self.external_chunks: List[Dict] = []
+        self.chunk_chars = chunk_chars
+        self.chunk_overlap = chunk_overlap
+        # Snapshot of the data/ part of the index; None disables persistence
+        self.cache_dir = cache_dir
         self.use_local = True
+        self.backend = "tfidf"
+        self.set_backend(backend)
+        # Tokenization is pluggable (see analyzer.ANALYZERS); it is part of the snapshot key
+        self.analyzer = analyzer
+        self._analyzer = get_analyzer(analyzer)
+        self._vocab: Dict[str, int] = {}
+        self._chunks = ChunkStore()                      # row -> text, source
+        self._group = np.zeros(0, dtype=np.int8)         # row -> source group
+        self._alive = np.zeros(0, dtype=bool)            # row -> not removed
+        self._tf = sp.csr_matrix((0, 0), dtype=np.float64)  # raw counts of flushed rows
+        self._df = np.zeros((_N_GROUPS, 0), dtype=np.int64)
+        self._pending: List[tuple] = []                  # (term ids, counts) of unflushed rows
+        self._pending_drop: List[_Source] = []
+        self._sources: Dict[str, _Source] = {}
+        self._detached: Dict[str, _Source] = {}          # removed, but revivable until next flush
+        self._dedup = NearDuplicateIndex() if dedup else None
+        self._fitted: Dict[tuple, object] = {}           # (backend, groups) -> model fitted since last flush
+        self._dense: Optional[dense.DenseRetriever] = None
+        self._stale = True
+        # Bumped on every content change; part of the search cache key
+        self.generation = 0
+        # LRU of search results (0 disables it, e.g. to time retrieval itself)
+        self._search_cache = SearchCache(search_cache_size)
+        self._built = False
+        self._frozen = False
+        self._base: Optional["RAGIndex"] = None
+        self._lock = threading.RLock()
+        # Uploads: source key -> content sha256, least recently seen first
+        self.upload_cap: Optional[int] = None            # max UTF-8 bytes of upload chunks; None = unbounded
+        self._uploads: "OrderedDict[str, str]" = OrderedDict()
+        self._evicted: set = set()                       # hashes evicted while still in the uploader
+        self._rejected: set = set()                      # hashes larger than upload_cap on their own
+
+    @classmethod
+    def overlay(cls, base: "RAGIndex", upload_cap: Optional[int] = None) -> "RAGIndex":
+        """Small index on top of a frozen ``base`` (e.g. one session's uploads).
+
+        It shares the base's analyzer and vocabulary (copy-on-write) and fits
+        its models with the collection statistics of base + overlay, so its
+        scores are comparable with the base's and results can be merged.
+        """
+        if not base._frozen:
+            raise ValueError("The base index must be frozen before creating an overlay.")
+        # A session seldom repeats a question; the shared cache of the base is what pays off
+        idx = cls(data_dir=None, cache_dir=None, backend=base.backend, chunk_chars=base.chunk_chars,
+                  chunk_overlap=base.chunk_overlap, analyzer=base.analyzer, search_cache_size=0)
+        idx._analyzer = base._analyzer
+        idx._vocab = _OverlayVocab(base._vocab)
+        idx._base = base
+        idx._built = True
+        idx.upload_cap = upload_cap
+        return idx
 
+    def freeze(self):
+        """Apply pending changes and make the content read-only."""
+        with self._lock:
+            if not self._built and self.data_dir:
+                self.build()
+            self._refresh()
+            self._frozen = True
+
+    def _check_mutable(self):
+        if self._frozen:
+            raise RuntimeError("This index is frozen; add documents to an overlay instead.")
+
+    def set_backend(self, backend: str):
+        backend = backend.lower().strip()
+        if backend not in BACKENDS:
+            raise ValueError(f"Backend must be one of {', '.join(BACKENDS)}.")
+        self.backend = backend
+
+    # ---------- source management ----------
     def disable_local_docs(self):
         self.use_local = False
-        self._rebuild()
+
+    def enable_local_docs(self):
+        self.use_local = True
 
     def reset_external_docs(self):
-        self.external_chunks = []
-        self._rebuild()
+        self._check_mutable()
+        # Vendor sources are only detached here: if the same page is re-added
+        # before the next search it is reattached without re-tokenizing.
+        for key in [k for k, s in self._sources.items() if s.group == GROUP_VENDOR]:
+            self._detached[key] = self._sources.pop(key)
+            self._changed()
 
     def add_external_docs(self, docs: Iterable[Dict]):
         # docs: [{text, source}]
+        self._check_mutable()
+        by_source: Dict[str, List[str]] = {}
         for d in docs:
             if d.get("text") and d.get("source"):
-                self.external_chunks.append({"text": d["text"], "source": d["source"]})
-        self._rebuild()
+                by_source.setdefault(d["source"], []).append(d["text"])
+        for source, texts in by_source.items():
+            chunks = [ch for t in texts for ch in self._chunk(t)]
+            self._set_source(source, GROUP_VENDOR, chunks)
 
     def add_uploaded_files(self, uploaded_files) -> int:
-        count = 0
+        """Sync the index with the uploader's current files; returns how many were (re)indexed.
+
+        Uploads are keyed by content hash, so files already indexed cost one
+        hash per call, and text extracted from the same bytes before (by any
+        session) comes from ``extract.text_cache``. Files no longer in
+        ``uploaded_files`` leave the index. With ``upload_cap`` set, the least
+        recently seen uploads are evicted to make room for a new file, and a
+        file whose chunks alone exceed the cap is rejected; evicted and
+        rejected files stay out while they are still in ``uploaded_files``.
+        """
+        self._check_mutable()
+        files, digests, present, keys = [], [], set(), set()
         for uf in uploaded_files:
-            name = uf.name
             try:
-                if name.lower().endswith(".pdf"):
-                    from io import BytesIO
-                    bio = BytesIO(uf.read())
-                    reader = PdfReader(bio)
-                    full = []
-                    for p in reader.pages:
-                        full.append(p.extract_text() or "")
-                    text = "\n".join(full).strip()
-                else:
-                    text = uf.read().decode("utf-8", errors="ignore")
-                chunks = _chunk_text(text)
-                for ch in chunks:
-                    self.external_chunks.append({"text": ch, "source": f"uploaded:{name}"})
-                count += 1
+                data = uf.getvalue() if hasattr(uf, "getvalue") else uf.read()
             except Exception:
                 continue
-        self._rebuild()
-        return count
+            sha = content_sha256(data)
+            key = f"uploaded:{uf.name}"
+            present.add(sha)
+            keys.add(key)
+            if self._uploads.get(key) == sha:
+                self._uploads.move_to_end(key)
+            elif sha not in self._evicted and sha not in self._rejected:
+                files.append((uf.name, data))
+                digests.append(sha)
+        # Forget evictions once the file has left the uploader, so it can be uploaded again
+        self._evicted &= present
+        self._rejected &= present
+        for key in [k for k in self._uploads if k not in keys]:
+            del self._uploads[key]
+            self._drop_source(key)
+        added = []
+        for (name, text), sha in zip(extract_cached(files, digests), digests):
+            key = f"uploaded:{name}"
+            # A new version replaces the old one even if it ends up rejected
+            self._uploads.pop(key, None)
+            self._drop_source(key)
+            chunks = self._chunk(text) if text else []
+            size = sum(len(c.encode("utf-8")) for c in chunks)
+            if self.upload_cap is not None and size > self.upload_cap:
+                self._rejected.add(sha)
+                continue
+            self._make_room(size)
+            self._uploads[key] = sha
+            if chunks:
+                self._set_source(key, GROUP_UPLOAD, chunks)
+                added.append(key)
+        # A file indexed early in this call may have made room for a later one
+        return sum(1 for key in added if key in self._sources)
+
+    def _upload_bytes(self, key: str) -> int:
+        src = self._sources.get(key)
+        if src is None:
+            return 0
+        return sum(self._chunks.text_bytes(r) for r in src.rows) + sum(len(t.encode("utf-8")) for t in src.dropped)
+
+    def _make_room(self, size: int):
+        # Evict the least recently seen uploads until ``size`` more bytes fit under the cap
+        if self.upload_cap is None:
+            return
+        total = sum(self._upload_bytes(key) for key in self._uploads)
+        while total + size > self.upload_cap and self._uploads:
+            key, sha = self._uploads.popitem(last=False)
+            total -= self._upload_bytes(key)
+            self._evicted.add(sha)
+            self._drop_source(key)
 
     def build(self):
-        # read local files (md, txt, pdf)
+        self._check_mutable()
+        with tracing.span("index.build") as attrs:
+            self._build(attrs)
+
+    def _build(self, attrs: Dict):
+        # read local files (md, txt, pdf); unchanged files come from the snapshot
         paths = []
         for ext in ("*.md", "*.txt", "*.pdf"):
             paths.extend(glob.glob(os.path.join(self.data_dir, "**", ext), recursive=True))
-        local = []
+        snapshot = self._load_snapshot()
+        manifest: Dict[str, Dict] = {}
+        changed = snapshot is None
+        plan = []   # (path, snapshot entry or None)
         for p in sorted(set(paths)):
-            text = ""
-            if p.lower().endswith(".pdf"):
-                text = _read_pdf_file(p)
+            try:
+                stat = os.stat(p)
+            except OSError:
+                continue
+            entry = snapshot["files"].get(p) if snapshot else None
+            sha = None
+            if entry is not None and (entry["mtime"] != stat.st_mtime or entry["size"] != stat.st_size):
+                changed = True
+                sha = _file_sha256(p)
+                if sha != entry["sha256"]:
+                    entry = None
+            if entry is None:
+                changed = True
+                sha = sha or _file_sha256(p)
             else:
-                text = _read_text_file(p)
-            if not text:
+                sha = entry["sha256"]
+            manifest[p] = {"mtime": stat.st_mtime, "size": stat.st_size, "sha256": sha}
+            plan.append((p, entry))
+        # Changed files are extracted in parallel; results come back in plan order
+        todo = [(p, p) for p, entry in plan if entry is None]
+        attrs.update(files=len(plan), extracted=len(todo))
+        extracted = extract_documents(todo)
+        for p, entry in plan:
+            if entry is not None:
+                start, end = entry["rows"]
+                texts = list(snapshot["chunks"].texts(range(start, end)))
+                counts = [self._snapshot_row(snapshot, r) for r in range(start, end)]
+            else:
+                _, text = next(extracted)
+                if text is None:
+                    # Failed or timed out: keep it out of the snapshot so the next build retries it
+                    del manifest[p]
+                    attrs["failed"] = attrs.get("failed", 0) + 1
+                    continue
+                texts = self._chunk(text) if text else []
+                counts = None
+            if texts:
+                self._set_source(p, GROUP_LOCAL, texts, counts)
+        extracted.close()
+        for key in [k for k, s in self._sources.items() if s.group == GROUP_LOCAL and k not in manifest]:
+            self._drop_source(key)
+        if snapshot is not None and set(snapshot["files"]) != set(manifest):
+            changed = True
+        if changed:
+            self._save_snapshot(manifest)
+        self._built = True
+        if self.backend == "hybrid":
+            self._refresh()   # batch-embed new chunks now rather than on the first question
+
+    def _chunk(self, text: str) -> List[str]:
+        return _chunk_text(text, self.chunk_chars, self.chunk_overlap)
+
+    def _set_source(self, key: str, group: int, texts: List[str], counts: Optional[List[tuple]] = None):
+        digest = _digest(texts)
+        current = self._sources.get(key)
+        if current is not None and current.digest == digest:
+            return
+        detached = self._detached.pop(key, None)
+        if detached is not None:
+            if detached.digest == digest and detached.group == group:
+                self._sources[key] = detached
+                return
+            self._release(detached)
+        if current is not None:
+            self._drop_source(key)
+        rows, dropped = [], []
+        for i, text in enumerate(texts):
+            r = len(self._chunks)
+            if self._dedup is not None:
+                dup, exact_key, sig = self._dedup.find(group, text)
+                # A match against a detached source does not count: it may go away
+                if dup is not None and (dup in rows or self._chunks.source(dup) in self._sources):
+                    dropped.append(text)
+                    continue
+                self._dedup.add(r, group, exact_key, sig)
+            rows.append(r)
+            self._chunks.append(text, key)
+            self._pending.append(counts[i] if counts is not None else self._count_terms(text, grow=True))
+        self._group = np.concatenate([self._group, np.full(len(rows), group, dtype=np.int8)])
+        self._alive = np.concatenate([self._alive, np.ones(len(rows), dtype=bool)])
+        self._sources[key] = _Source(group, digest, rows, dropped)
+        self._changed()
+
+    def _drop_source(self, key: str):
+        src = self._sources.pop(key, None)
+        if src is not None:
+            self._release(src)
+
+    def _release(self, src: _Source):
+        # Rows stay in the matrix until the next flush, but stop shadowing
+        # new near-duplicates right away.
+        if self._dedup is not None:
+            for r in src.rows:
+                self._dedup.remove(r)
+        self._pending_drop.append(src)
+        self._changed()
+        if self._dedup is not None and src.rows:
+            self._restore_dropped(src.group)
+
+    def _restore_dropped(self, group: int):
+        # Chunks skipped as copies of released rows are indexed again once no
+        # other live (or still revivable) copy is left.
+        live = lambda r: self._chunks.source(r) in self._sources or self._chunks.source(r) in self._detached
+        added = 0
+        for key, src in self._sources.items():
+            if src.group != group or not src.dropped:
                 continue
-            for ch in _chunk_text(text):
-                local.append({"text": ch, "source": p})
-        self.local_chunks = local
-        self._rebuild()
-
-    def _rebuild(self):
-        # merge selected sources
-        chunks = []
-        if self.use_local:
-            chunks.extend(self.local_chunks)
-        if self.external_chunks:
-            chunks.extend(self.external_chunks)
-
-        if not chunks:
-            chunks = [{"text": "No documents found. Please add files into data/ or enable vendor sources.", "source": "N/A"}]
-
-        corpus = [c["text"] for c in chunks]
-        self.vectorizer = TfidfVectorizer(
-            strip_accents="unicode",
-            lowercase=True,
-            stop_words="english",
-            max_features=60000
-        )
-        self.matrix = self.vectorizer.fit_transform(corpus)
-        self._chunks = chunks  # keep merged view
-
-    def search(self, query: str, top_k: int = 4) -> List[Dict]:
-        if self.vectorizer is None or self.matrix is None:
+            kept = []
+            for text in src.dropped:
+                dup, exact_key, sig = self._dedup.find(group, text)
+                if dup is not None and live(dup):
+                    kept.append(text)
+                    continue
+                r = len(self._chunks)
+                self._dedup.add(r, group, exact_key, sig)
+                src.rows.append(r)
+                self._chunks.append(text, key)
+                self._pending.append(self._count_terms(text, grow=True))
+                added += 1
+            src.dropped = kept
+        if added:
+            self._group = np.concatenate([self._group, np.full(added, group, dtype=np.int8)])
+            self._alive = np.concatenate([self._alive, np.ones(added, dtype=bool)])
+
+    def _changed(self):
+        # Applied on the next search; cached results of the old content stop matching
+        self._stale = True
+        self.generation += 1
+
+    def dedup_stats(self) -> Dict:
+        """How much near-duplicate removal shrinks the current index."""
+        kept = sum(len(s.rows) for s in self._sources.values())
+        dropped = sum(len(s.dropped) for s in self._sources.values())
+        total = kept + dropped
+        return {
+            "chunks": kept,
+            "duplicates_dropped": dropped,
+            "shrink_ratio": (dropped / total) if total else 0.0,
+        }
+
+    def size_stats(self) -> Dict[str, int]:
+        """Approximate in-memory size in bytes of the chunk text, raw counts and fitted models."""
+        stats = {
+            "chunk_text": self._chunks.nbytes(),
+            "term_counts": _nbytes(self._tf) + _nbytes(self._df),
+            "vocab": sum(len(t.encode("utf-8")) for t in self._vocab),
+        }
+        for (backend, _), model in self._fitted.items():
+            stats[f"model_{backend}"] = stats.get(f"model_{backend}", 0) + _nbytes(model)
+        stats["total"] = sum(stats.values())
+        return stats
+
+    # ---------- on-disk snapshot of data/ ----------
+    def _snapshot_dir(self) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, "snapshot")
+
+    def _load_snapshot(self) -> Optional[Dict]:
+        d = self._snapshot_dir()
+        if d is None:
+            return None
+        try:
+            with open(os.path.join(d, "manifest.json"), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if (manifest.get("version") != SNAPSHOT_VERSION or manifest.get("data_dir") != self.data_dir
+                    or manifest.get("chunking") != [self.chunk_chars, self.chunk_overlap]
+                    or manifest.get("analyzer") != self.analyzer):
+                return None
+            # Chunk text is memory-mapped as well and decoded per file on reuse
+            chunks = ChunkStore.load(d, "chunks")
+            with open(os.path.join(d, "vocab.json"), "r", encoding="utf-8") as f:
+                vocab = json.load(f)
+            # The matrix is memory-mapped; only rows of unchanged files are read
+            data = np.load(os.path.join(d, "tf_data.npy"), mmap_mode="r")
+            indices = np.load(os.path.join(d, "tf_indices.npy"), mmap_mode="r")
+            indptr = np.load(os.path.join(d, "tf_indptr.npy"), mmap_mode="r")
+            if (manifest.get("rows") != len(chunks) or len(indptr) != len(chunks) + 1
+                    or manifest.get("nnz") != len(indices) or indptr[-1] != len(indices)):
+                return None
+        except Exception:
+            return None
+        return {
+            "files": manifest.get("files", {}),
+            "chunks": chunks,
+            "vocab": vocab,
+            "col_map": None,
+            "data": data,
+            "indices": indices,
+            "indptr": indptr,
+        }
+
+    def _snapshot_row(self, snapshot: Dict, r: int) -> tuple:
+        if snapshot["col_map"] is None:
+            col_map = np.empty(len(snapshot["vocab"]), dtype=np.int64)
+            for i, term in enumerate(snapshot["vocab"]):
+                tid = self._vocab.get(term)
+                if tid is None:
+                    tid = len(self._vocab)
+                    self._vocab[term] = tid
+                col_map[i] = tid
+            snapshot["col_map"] = col_map
+        lo, hi = int(snapshot["indptr"][r]), int(snapshot["indptr"][r + 1])
+        ids = snapshot["col_map"][np.asarray(snapshot["indices"][lo:hi])]
+        return ids, np.asarray(snapshot["data"][lo:hi], dtype=np.float64)
+
+    def _save_snapshot(self, files: Dict[str, Dict]):
+        d = self._snapshot_dir()
+        if d is None:
+            return
+        self._flush()
+        # Files are stored before de-duplication, so a copy is not lost when
+        # the file it duplicated changes later.
+        row_counts: List[tuple] = []
+        chunks = ChunkStore()
+        for p, meta in files.items():
+            src = self._sources.get(p)
+            start = len(chunks)
+            if src is not None:
+                for r in src.rows:
+                    lo, hi = self._tf.indptr[r], self._tf.indptr[r + 1]
+                    row_counts.append((self._tf.indices[lo:hi], self._tf.data[lo:hi]))
+                    chunks.append(self._chunks.text(r), p)
+                for text in src.dropped:
+                    row_counts.append(self._count_terms(text, grow=True))
+                    chunks.append(text, p)
+            meta["rows"] = [start, len(chunks)]
+        tf = self._rows_to_csr(row_counts, len(self._vocab))
+        # Store only the columns used by data/ so vendor terms do not pile up
+        used = np.unique(tf.indices)
+        remap = np.zeros(max(len(self._vocab), 1), dtype=np.int64)
+        remap[used] = np.arange(len(used))
+        terms = [""] * len(self._vocab)
+        for term, tid in self._vocab.items():
+            terms[tid] = term
+        manifest = {
+            "version": SNAPSHOT_VERSION,
+            "data_dir": self.data_dir,
+            "chunking": [self.chunk_chars, self.chunk_overlap],
+            "analyzer": self.analyzer,
+            "rows": len(chunks),
+            "nnz": int(tf.nnz),
+            "files": files,
+        }
+        try:
+            os.makedirs(d, exist_ok=True)
+            _atomic_save(os.path.join(d, "tf_data.npy"), lambda f: np.save(f, tf.data.astype(np.float32)))
+            _atomic_save(os.path.join(d, "tf_indices.npy"), lambda f: np.save(f, remap[tf.indices].astype(np.int32)))
+            _atomic_save(os.path.join(d, "tf_indptr.npy"), lambda f: np.save(f, tf.indptr.astype(np.int64)))
+            chunks.save(d, "chunks", _atomic_save)
+            _atomic_save(os.path.join(d, "vocab.json"),
+                         lambda f: json.dump([terms[i] for i in used], f, ensure_ascii=False), "w")
+            # Manifest last: a half-written snapshot fails the size checks on load
+            _atomic_save(os.path.join(d, "manifest.json"),
+                         lambda f: json.dump(manifest, f, ensure_ascii=False, indent=1), "w")
+        except Exception:
+            pass
+
+    # ---------- delta application ----------
+    def _count_terms(self, text: str, grow: bool):
+        ids = []
+        for tok in self._analyzer(text):
+            tid = self._vocab.get(tok)
+            if tid is None:
+                if not grow:
+                    continue
+                tid = len(self._vocab)
+                self._vocab[tok] = tid
+            ids.append(tid)
+        if not ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        term_ids, counts = np.unique(np.asarray(ids, dtype=np.int64), return_counts=True)
+        return term_ids, counts.astype(np.float64)
+
+    @staticmethod
+    def _rows_to_csr(rows: List[tuple], n_cols: int):
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(ids) for ids, _ in rows])
+        if not rows:
+            return sp.csr_matrix((0, n_cols), dtype=np.float64)
+        indices = np.concatenate([ids for ids, _ in rows])
+        data = np.concatenate([counts for _, counts in rows]).astype(np.float64)
+        return sp.csr_matrix((data, indices, indptr), shape=(len(rows), n_cols))
+
+    def _flush(self):
+        # Releasing may restore dropped near-duplicates, i.e. add pending rows and terms
+        detached, self._detached = self._detached, {}
+        for src in detached.values():
+            self._release(src)
+        n_terms = len(self._vocab)
+        n_flushed = self._tf.shape[0]
+        if self._df.shape[1] < n_terms:
+            self._df = np.pad(self._df, ((0, 0), (0, n_terms - self._df.shape[1])))
+        if self._tf.shape[1] < n_terms:
+            self._tf.resize((n_flushed, n_terms))
+
+        for src in self._pending_drop:
+            for r in src.rows:
+                if not self._alive[r]:
+                    continue
+                self._alive[r] = False
+                if r < n_flushed:
+                    cols = self._tf.indices[self._tf.indptr[r]:self._tf.indptr[r + 1]]
+                    self._df[src.group, cols] -= 1
+        self._pending_drop = []
+
+        if self._pending:
+            block = self._rows_to_csr(self._pending, n_terms)
+            for i, (ids, _) in enumerate(self._pending):
+                r = n_flushed + i
+                if self._alive[r]:
+                    self._df[self._group[r], ids] += 1
+            self._tf = sp.vstack([self._tf, block], format="csr")
+            self._pending = []
+
+        if (~self._alive).sum() > max(1000, len(self._alive) // 2):
+            self._compact()
+
+    def _compact(self):
+        keep = np.flatnonzero(self._alive)
+        remap = np.full(len(self._alive), -1, dtype=np.int64)
+        remap[keep] = np.arange(len(keep))
+        self._tf = self._tf[keep]
+        self._chunks = self._chunks.take(keep)
+        self._group = self._group[keep]
+        self._alive = np.ones(len(keep), dtype=bool)
+        for src in self._sources.values():
+            src.rows = [int(remap[r]) for r in src.rows]
+        if self._dedup is not None:
+            self._dedup.renumber({int(old): int(new) for old, new in enumerate(remap) if new >= 0})
+        if self._dense is not None:
+            self._dense.reset()
+
+    def _groups(self, groups: Optional[Iterable[int]] = None) -> Tuple[int, ...]:
+        if groups is None:
+            return tuple(g for g in ALL_GROUPS if self.use_local or g != GROUP_LOCAL)
+        return tuple(sorted(set(int(g) for g in groups)))
+
+    def _active_mask(self, groups: Tuple[int, ...]) -> np.ndarray:
+        return self._alive & np.isin(self._group, groups)
+
+    def _refresh(self, backend: Optional[str] = None, groups: Optional[Tuple[int, ...]] = None):
+        backend = backend or self.backend
+        groups = self._groups(groups)
+        with self._lock:
+            # detached sources that were not re-added must leave the index too
+            if self._stale or self._detached:
+                with tracing.span("index.flush", pending=len(self._pending)):
+                    self._flush()
+                self._fitted = {}
+                self._stale = False
+            return self._model(backend, groups)
+
+    def _model(self, backend: str, groups: Tuple[int, ...]):
+        key = (backend, groups)
+        if key not in self._fitted:
+            with tracing.span("index.fit", backend=backend):
+                self._fitted[key] = self._fit(backend, groups)
+        return self._fitted[key]
+
+    def _dense_retriever(self) -> dense.DenseRetriever:
+        if self._dense is None:
+            # Overlays embed with the base's model and cache, into their own graph
+            self._dense = (self._base._dense_retriever().share() if self._base is not None
+                           else dense.DenseRetriever(self.cache_dir))
+        return self._dense
+
+    def _collection_stats(self, groups: Tuple[int, ...]):
+        """(documents, document frequencies, total length) of the active rows."""
+        stats = self._fitted.get(("stats", groups))
+        if stats is None:
+            active = self._active_mask(groups)
+            stats = (int(active.sum()), self._df[list(groups)].sum(axis=0),
+                     float(self._tf[np.flatnonzero(active)].sum()))
+            self._fitted[("stats", groups)] = stats
+        return stats
+
+    def _fit(self, backend: str, groups: Tuple[int, ...]):
+        active = self._active_mask(groups)
+        background = None
+        if self._base is not None:
+            with self._base._lock:
+                background = self._base._collection_stats(groups)
+        if backend == "bm25":
+            return BM25Index.from_rows(self._tf, np.flatnonzero(active), background=background)
+        if backend == "hybrid":
+            rows = np.flatnonzero(self._alive)
+            self._dense_retriever().sync(rows, list(self._chunks.texts(rows)))
+            return self._model("tfidf", groups)
+        n_docs = int(active.sum())
+        df = self._df[list(groups)].sum(axis=0)
+        if background is not None:
+            # Overlay: idf over base + overlay documents
+            n_docs += background[0]
+            df = df.copy()
+            df[:len(background[1])] += background[1]
+        # Same smoothing as TfidfVectorizer(smooth_idf=True)
+        idf = np.log((1.0 + n_docs) / (1.0 + df)) + 1.0
+        from sklearn.preprocessing import normalize   # deferred: sklearn dominates import time
+        weights = normalize(self._tf @ sp.diags(idf), norm="l2", copy=False)
+        # Stored transposed: a query row times this matrix only walks the
+        # chunk lists of the query's own terms.
+        return idf, weights.T.tocsr()
+
+    def _query_matrix(self, queries: List[str], idf: np.ndarray):
+        rows = [self._count_terms(q, grow=False) for q in queries]
+        q = self._rows_to_csr(rows, len(idf)) @ sp.diags(idf)
+        from sklearn.preprocessing import normalize
+        return normalize(q, norm="l2", copy=False).tocsr()
+
+    def _base_norm_ratio(self, queries: List[str], groups: Tuple[int, ...]) -> np.ndarray:
+        """Per query, |query vector on base terms| / |full query vector| (overlay only).
+
+        The base normalizes a query without the terms only the overlay knows;
+        multiplying base cosine scores by this ratio makes them comparable
+        with the overlay's.
+        """
+        idf, _ = self._refresh("tfidf", groups)
+        q = self._rows_to_csr([self._count_terms(t, grow=False) for t in queries], len(idf)) @ sp.diags(idf)
+        q = q.multiply(q).tocsc()
+        full = np.sqrt(np.asarray(q.sum(axis=1)).ravel())
+        on_base = np.sqrt(np.asarray(q[:, :len(self._base._vocab)].sum(axis=1)).ravel())
+        return np.divide(on_base, full, out=np.ones_like(full), where=full > 0)
+
+    def _results(self, idxs: np.ndarray, scores: np.ndarray) -> List[ChunkView]:
+        return [self._chunks.view(int(i), float(score)) for i, score in zip(idxs, scores)]
+
+    def search(self, query: str, top_k: int = 4) -> List[ChunkView]:
+        return self.search_batch([query], top_k=top_k)[0]
+
+    def search_batch(self, queries: List[str], top_k: int = 4, groups: Optional[Iterable[int]] = None,
+                     backend: Optional[str] = None) -> List[List[ChunkView]]:
+        """Score many queries at once (one sparse matrix product for TF-IDF).
+
+        ``groups`` (source groups to search) and ``backend`` default to the
+        index-wide settings (``use_local``, ``set_backend``). Results are
+        cached per (normalized query, top_k, backend, groups, ``generation``);
+        only the queries missing from the cache are scored.
+        """
+        backend = (backend or self.backend).lower().strip()
+        if backend not in BACKENDS:
+            raise ValueError(f"Backend must be one of {', '.join(BACKENDS)}.")
+        groups = self._groups(groups)
+        with tracing.span("retrieval", backend=backend, queries=len(queries)) as attrs:
+            generation = self.generation
+            keys = [(normalize_query(q), top_k, backend, groups, generation) for q in queries]
+            hits = [self._search_cache.get(key) for key in keys]
+            todo = [i for i, h in enumerate(hits) if h is None]
+            attrs["cached"] = len(queries) - len(todo)
+            if todo:
+                for i, h in zip(todo, self._search_batch([queries[i] for i in todo], top_k, groups, backend)):
+                    hits[i] = tuple(h)
+                    self._search_cache.put(keys[i], hits[i])
+            return [list(h) for h in hits]
+
+    def warmup(self, queries: Iterable[str], top_k: int = 4, groups: Optional[Iterable[int]] = None,
+               backend: Optional[str] = None) -> int:
+        """Precompute and cache results for ``queries`` (e.g. ``search_cache.hot_queries()``)."""
+        queries = [q for q in queries if normalize_query(q)]
+        with tracing.span("search.warmup", queries=len(queries)):
+            if queries:
+                self.search_batch(queries, top_k, groups, backend)
+        return len(queries)
+
+    def search_cache_stats(self) -> Dict[str, int]:
+        return dict(self._search_cache.stats(), generation=self.generation)
+
+    def _search_batch(self, queries: List[str], top_k: int, groups: Tuple[int, ...],
+                      backend: str) -> List[List[ChunkView]]:
+        if not self._built:
             self.build()
-        q_vec = self.vectorizer.transform([query])
-        sims = cosine_similarity(q_vec, self.matrix)[0]
-        idxs = sims.argsort()[::-1][:top_k]
-        results = []
-        for i in idxs:
-            results.append({
-                "text": self._chunks[i]["text"],
-                "source": self._chunks[i]["source"],
-                "score": float(sims[i])
-            })
-        return results
+        model = self._refresh(backend, groups)
+        active = self._active_mask(groups)
+        if not active.any():
+            return [[ChunkView(EMPTY_INDEX_TEXT, "N/A", 0.0)] for _ in queries]
+        if not queries:
+            return []
+        if backend == "bm25":
+            k = min(top_k, int(active.sum()))
+            hits = []
+            for q in queries:
+                idxs, vals = model.search(*self._count_terms(q, grow=False), k)
+                hits.append(_pad_top_k(idxs, vals, active, k))
+        elif backend == "hybrid":
+            idf, weights_t = model
+            n_cand = max(HYBRID_CANDIDATES, top_k)
+            sparse_hits = top_k_rows(self._query_matrix(queries, idf) @ weights_t, active, n_cand)
+            hits = []
+            for q, (sparse_idxs, sparse_vals) in zip(queries, sparse_hits):
+                sparse_rank = sparse_idxs[sparse_vals > 0].tolist()
+                fused = dense.reciprocal_rank_fusion([sparse_rank, self._dense.search(q, active, n_cand)])[:top_k]
+                idxs = np.array([d for d, _ in fused], dtype=np.int64)
+                vals = np.array([sc for _, sc in fused])
+                hits.append(_pad_top_k(idxs, vals, active, min(top_k, int(active.sum()))))
+        else:
+            idf, weights_t = model
+            # Cosine similarity == dot product, since both sides are L2-normalized
+            hits = top_k_rows(self._query_matrix(queries, idf) @ weights_t, active, top_k)
+        return [self._results(idxs, vals) for idxs, vals in hits]
+
+def _merge_results(a: List[ChunkView], b: List[ChunkView], top_k: int) -> List[ChunkView]:
+    merged = [r for r in a + b if r.source != "N/A"]
+    if not merged:
+        return a[:top_k]
+    merged.sort(key=lambda r: -r.score)
+    return merged[:top_k]
+
+class SessionIndex:
+    """One user's view: a shared, frozen base index plus a private upload overlay.
+
+    The base (data/ + vendor pages) is never mutated by a session. Uploads go
+    to a small overlay (``RAGIndex.overlay``) whose scores are comparable with
+    the base's, and both result lists are merged by score at query time.
+    Backend and source toggles are per-session search parameters.
+    """
+
+    def __init__(self, base: RAGIndex):
+        self.base = base
+        self.overlay = RAGIndex.overlay(base, upload_cap=int(SESSION_UPLOAD_MB * 2 ** 20))
+        self.backend = base.backend
+        self.use_local = True
+        self.use_vendor = True
+
+    def rebase(self, base: RAGIndex):
+        """Switch to a new shared base (e.g. after a vendor sync), keeping uploads."""
+        if base is self.base:
+            return
+        old = self.overlay
+        self.base = base
+        self.overlay = RAGIndex.overlay(base, upload_cap=old.upload_cap)
+        for key, src in old._sources.items():
+            texts = list(old._chunks.texts(src.rows)) + src.dropped
+            self.overlay._set_source(key, src.group, texts)
+        self.overlay._uploads = old._uploads
+        self.overlay._evicted = old._evicted
+        self.overlay._rejected = old._rejected
+
+    def set_backend(self, backend: str):
+        backend = backend.lower().strip()
+        if backend not in BACKENDS:
+            raise ValueError(f"Backend must be one of {', '.join(BACKENDS)}.")
+        self.backend = backend
+
+    def add_uploaded_files(self, uploaded_files) -> int:
+        return self.overlay.add_uploaded_files(uploaded_files)
+
+    @property
+    def evicted_uploads(self) -> int:
+        """Files still in the uploader that were evicted by the session cap."""
+        return len(self.overlay._evicted)
+
+    @property
+    def rejected_uploads(self) -> int:
+        """Files still in the uploader that are larger than the whole session cap."""
+        return len(self.overlay._rejected)
+
+    def groups(self) -> Tuple[int, ...]:
+        groups = [GROUP_UPLOAD]
+        if self.use_local:
+            groups.append(GROUP_LOCAL)
+        if self.use_vendor:
+            groups.append(GROUP_VENDOR)
+        return tuple(sorted(groups))
+
+    def search(self, query: str, top_k: int = 4) -> List[ChunkView]:
+        return self.search_batch([query], top_k=top_k)[0]
+
+    def search_batch(self, queries: List[str], top_k: int = 4) -> List[List[ChunkView]]:
+        groups = self.groups()
+        hits = self.base.search_batch(queries, top_k, groups=groups, backend=self.backend)
+        if self.overlay._sources:
+            extra = self.overlay.search_batch(queries, top_k, groups=groups, backend=self.backend)
+            if self.backend == "tfidf":
+                # BM25 sums per-term impacts and hybrid scores are rank-based;
+                # only cosine scores depend on the query's normalization.
+                ratios = self.overlay._base_norm_ratio(queries, groups)
+                hits = [[r.with_score(float(r.score * f)) for r in rs] for rs, f in zip(hits, ratios)]
+            hits = [_merge_results(a, b, top_k) for a, b in zip(hits, extra)]
+        return hits
@@ -0,0 +1,100 @@
+import os
+import re
+import glob
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional
+import yaml
+
+# Số kết quả truy hồi giữ trong LRU cache của mỗi chỉ mục (0 = tắt)
+SEARCH_CACHE_SIZE = int(os.getenv("RAG_SEARCH_CACHE_SIZE", "1024"))
+# Truy vấn nóng được tính sẵn sau mỗi lần xây chỉ mục: danh sách trong file cấu hình
+# + tiêu đề markdown của các file khớp mẫu (tương đối với data/)
+HOT_QUERIES_FILE = os.getenv("RAG_HOT_QUERIES_FILE", "hot_queries.yaml")
+HOT_QUERY_HEADINGS = os.getenv("RAG_HOT_QUERY_HEADINGS", os.path.join("**", "syllabus*.md"))
+HOT_QUERIES_MAX = int(os.getenv("RAG_HOT_QUERIES_MAX", "200"))
+
+_HEADING_RE = re.compile(r"^#{1,6}\s+(.+?)\s*#*\s*$")
+_MARKUP_RE = re.compile(r"[*_`]+")
+
+def normalize_query(query: str) -> str:
+    """Cache key form of a query: NFC, whitespace collapsed.
+
+    Case and punctuation are kept on purpose: the analyzer splits
+    ``bodyParser`` but not ``bodyparser``, so they may retrieve differently.
+    """
+    return " ".join(unicodedata.normalize("NFC", query or "").split())
+
+class SearchCache:
+    """Thread-safe LRU of search results.
+
+    Keys are built by the index (normalized query, top_k, backend, groups and
+    the index's content generation), so a change to the index never serves
+    stale results: old keys simply stop being asked for and age out.
+    """
+
+    def __init__(self, max_entries: int = SEARCH_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._results: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[tuple]:
+        with self._lock:
+            hits = self._results.get(key)
+            if hits is None:
+                self.misses += 1
+                return None
+            self._results.move_to_end(key)
+            self.hits += 1
+            return hits
+
+    def put(self, key: Hashable, hits: tuple):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._results[key] = hits
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._results), "hits": self.hits, "misses": self.misses}
+
+def _headings(path: str) -> List[str]:
+    out = []
+    try:
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            for line in f:
+                m = _HEADING_RE.match(line.strip())
+                if m:
+                    out.append(_MARKUP_RE.sub("", m.group(1)).strip())
+    except OSError:
+        pass
+    return out
+
+def hot_queries(data_dir: Optional[str] = "data", path: Optional[str] = HOT_QUERIES_FILE,
+                headings: Optional[str] = HOT_QUERY_HEADINGS, limit: int = HOT_QUERIES_MAX) -> List[str]:
+    """Queries to precompute: ``queries`` from ``path`` (YAML), then the
+    markdown headings of files matching ``headings`` under ``data_dir``."""
+    queries: List[str] = []
+    if path and os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = yaml.safe_load(f) or {}
+            queries += [str(q) for q in data.get("queries", []) if q]
+        except (OSError, yaml.YAMLError):
+            pass
+    if data_dir and headings:
+        for p in sorted(glob.glob(os.path.join(data_dir, headings), recursive=True)):
+            queries += _headings(p)
+    # Same query from several files (e.g. two copies of the syllabus) is warmed once
+    unique = OrderedDict((normalize_query(q), None) for q in queries if normalize_query(q))
+    return list(unique)[:limit]
@@ -0,0 +1,397 @@
+"""Standalone async HTTP API: ``/search`` and a streaming ``/answer``.
+
+Usage (from the repo root, needs ``aiohttp``):
+    python server.py --port 8080
+    gunicorn server:create_app --bind :8080 --worker-class aiohttp.GunicornWebWorker --workers 4
+
+Each worker process loads the shared index (``VendorSync``: built in the
+background, refreshed periodically, like the Streamlit app) and one
+``LLMProvider`` (``PROVIDER`` and the usual secrets from the environment).
+
+- ``GET /search?q=...&k=4`` or ``POST /search`` ``{"query", "top_k", "backend",
+  "local", "vendor"}`` -> ``{"results": [{text, source, score}], "generation"}``
+- ``POST /answer`` ``{"question", "top_k", "temperature", "stream"}`` ->
+  server-sent events (``citations``, then ``message`` pieces, then ``done`` or
+  ``error``), or one JSON object with ``"stream": false``.
+- ``GET /healthz`` (503 while the index warms up) and ``GET /metrics`` (Prometheus).
+
+Identical in-flight questions (same normalized question and same retrieved
+context, see ``AnswerCache.context_key``) share one upstream LLM call
+(``SingleFlight``). Retrieval and LLM calls each pass through a ``Gate``:
+beyond its concurrency limit requests wait in a bounded queue, and past the
+queue (or after waiting too long) they get 503 with ``Retry-After``.
+"""
+import os
+import json
+import asyncio
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Optional
+from aiohttp import web
+import tracing
+from prompts import SYSTEM_PROMPT
+from answer_cache import AnswerCache, normalize_question
+from rag import GROUP_LOCAL, GROUP_VENDOR, GROUP_UPLOAD
+
+# Số truy hồi chạy song song (thread pool) và số lượt gọi LLM đồng thời mỗi worker
+API_SEARCH_CONCURRENCY = int(os.getenv("API_SEARCH_CONCURRENCY", "4"))
+API_LLM_CONCURRENCY = int(os.getenv("API_LLM_CONCURRENCY", "32"))
+# Số request được xếp hàng chờ; vượt quá (hoặc chờ quá API_QUEUE_TIMEOUT giây) thì trả 503
+API_QUEUE_SIZE = int(os.getenv("API_QUEUE_SIZE", "64"))
+API_QUEUE_TIMEOUT = float(os.getenv("API_QUEUE_TIMEOUT", "10"))
+# Gộp các câu hỏi giống nhau đang chờ vào một lượt gọi LLM (0 để tắt, ví dụ khi đo)
+API_SINGLE_FLIGHT = os.getenv("API_SINGLE_FLIGHT", "1") == "1"
+API_MAX_TOP_K = 20
+
+class Overloaded(Exception):
+    """Raised when a ``Gate`` has no room; answered with 503."""
+
+class Gate:
+    """At most ``limit`` concurrent holders, at most ``queue`` waiting; the rest are rejected."""
+
+    def __init__(self, name: str, limit: int, queue: int = API_QUEUE_SIZE, timeout: float = API_QUEUE_TIMEOUT):
+        if limit < 1 or queue < 0:
+            raise ValueError("Gate needs limit >= 1 and queue >= 0.")
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self._sem = asyncio.Semaphore(limit)
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._sem.locked() and self.waiting >= self.queue:
+            self.rejected += 1
+            raise Overloaded(f"{self.name}: queue full")
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._sem.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise Overloaded(f"{self.name}: waited more than {self.timeout:g}s") from None
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._sem.release()
+
+    def stats(self) -> Dict[str, int]:
+        return {"active": self.active, "waiting": self.waiting, "rejected": self.rejected}
+
+class _Flight:
+    """One upstream stream and the pieces it produced so far (replayed to late joiners)."""
+
+    def __init__(self):
+        self.pieces: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self) -> AsyncIterator[str]:
+        i = 0
+        while True:
+            while i < len(self.pieces):
+                yield self.pieces[i]
+                i += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+class SingleFlight:
+    """Coalesces identical in-flight streams: one producer, any number of followers.
+
+    The producer runs as its own task, so a follower that disconnects does not
+    cut the others off; it is cancelled only when every follower is gone.
+    Finished flights are forgotten (this is not a cache).
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._flights: Dict[str, _Flight] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def stream(self, key: str, start: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        flight = self._flights.get(key) if self.enabled else None
+        if flight is None:
+            flight = _Flight()
+            if self.enabled:
+                self._flights[key] = flight
+            flight.task = asyncio.create_task(self._produce(key, flight, start))
+            self.calls += 1
+        else:
+            self.shared += 1
+        flight.subscribers += 1
+        try:
+            async for piece in flight.follow():
+                yield piece
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                self._forget(key, flight)
+                flight.task.cancel()
+
+    def _forget(self, key: str, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def _produce(self, key: str, flight: _Flight, start: Callable[[], AsyncIterator[str]]):
+        try:
+            async for piece in start():
+                flight.pieces.append(piece)
+                flight.notify()
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            self._forget(key, flight)
+            flight.notify()
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._flights), "calls": self.calls, "shared": self.shared}
+
+class ServerState:
+    """Everything one worker loads once: the index, the LLM and the admission gates."""
+
+    def __init__(self, vendor_sync=None, llm=None, backend: str = "tfidf"):
+        if vendor_sync is None:
+            from vendor_sync import VendorSync
+            vendor_sync = VendorSync()
+        if llm is None:
+            from models import LLMProvider
+            llm = LLMProvider.from_env()
+        self.vendor_sync = vendor_sync
+        self.llm = llm
+        self.backend = backend
+        self.model = f"{llm.provider}:{getattr(llm, 'gh_model', None) or getattr(llm, 'gg_model', '')}"
+        self.executor = ThreadPoolExecutor(API_SEARCH_CONCURRENCY, thread_name_prefix="api-search")
+        self.search_gate = Gate("search", API_SEARCH_CONCURRENCY)
+        self.llm_gate = Gate("llm", API_LLM_CONCURRENCY)
+        self.flights = SingleFlight(API_SINGLE_FLIGHT)
+
+    def index(self):
+        if not self.vendor_sync.ready:
+            raise Overloaded("index is warming up")
+        return self.vendor_sync.current
+
+    async def search(self, query: str, top_k: int, backend: Optional[str] = None,
+                     local: bool = True, vendor: bool = True):
+        gen = self.index()
+        # Same groups as an app session without uploads, so both share the base's cached results
+        groups = [GROUP_UPLOAD] + [g for g, on in ((GROUP_LOCAL, local), (GROUP_VENDOR, vendor)) if on]
+        async with self.search_gate.slot():
+            hits = await asyncio.get_running_loop().run_in_executor(
+                self.executor, lambda: gen.index.search_batch([query], top_k, groups=groups,
+                                                              backend=backend or self.backend))
+        return gen, hits[0]
+
+    async def _generate(self, question: str, context: str, temperature: float) -> AsyncIterator[str]:
+        async with self.llm_gate.slot():
+            async for piece in self.llm.agenerate_answer_stream(question, context, SYSTEM_PROMPT, temperature):
+                yield piece
+
+    def answer_stream(self, question: str, chunks: List, context: str, temperature: float) -> AsyncIterator[str]:
+        key = hashlib.sha256("\n".join([
+            normalize_question(question),
+            AnswerCache.context_key(chunks, self.model, temperature, SYSTEM_PROMPT),
+        ]).encode("utf-8")).hexdigest()
+        return self.flights.stream(key, lambda: self._generate(question, context, temperature))
+
+    def stats(self) -> Dict:
+        ready = self.vendor_sync.ready
+        return {"ready": ready, "generation": self.vendor_sync.current.number if ready else None,
+                "search": self.search_gate.stats(), "llm": self.llm_gate.stats(),
+                "single_flight": self.flights.stats(),
+                "search_cache": self.vendor_sync.current.index.search_cache_stats() if ready else {}}
+
+    async def close(self):
+        self.vendor_sync.stop(timeout=1)
+        self.executor.shutdown(wait=False)
+        aclose = getattr(self.llm, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+STATE = web.AppKey("state", ServerState)
+
+def _json(data, status: int = 200, headers: Optional[Dict[str, str]] = None) -> web.Response:
+    return web.json_response(data, status=status, headers=headers,
+                             dumps=lambda d: json.dumps(d, ensure_ascii=False))
+
+def _unavailable(e: Overloaded) -> web.Response:
+    return _json({"error": str(e)}, status=503, headers={"Retry-After": "1"})
+
+def _bad_request(message: str) -> web.Response:
+    return _json({"error": message}, status=400)
+
+async def _params(request: web.Request) -> Dict:
+    if request.method == "GET":
+        return dict(request.query)
+    try:
+        body = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text=json.dumps({"error": "Body must be JSON."}), content_type="application/json")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text=json.dumps({"error": "Body must be a JSON object."}),
+                                 content_type="application/json")
+    return body
+
+def _flag(value, default: bool = True) -> bool:
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return value.strip().lower() not in ("0", "false", "no", "off", "")
+    return bool(value)
+
+def _top_k(params: Dict) -> int:
+    return max(1, min(API_MAX_TOP_K, int(params.get("top_k", params.get("k", 4)))))
+
+def _cite(chunks) -> List[Dict]:
+    return [{"source": c["source"], "score": round(float(c["score"]), 4)} for c in chunks]
+
+async def search(request: web.Request) -> web.Response:
+    state = request.app[STATE]
+    params = await _params(request)
+    query = str(params.get("query") or params.get("q") or "").strip()
+    if not query:
+        return _bad_request("Missing query.")
+    try:
+        top_k = _top_k(params)
+        with tracing.trace(), tracing.span("api.search"):
+            gen, hits = await state.search(query, top_k, params.get("backend"),
+                                           _flag(params.get("local")), _flag(params.get("vendor")))
+    except Overloaded as e:
+        return _unavailable(e)
+    except ValueError as e:
+        return _bad_request(str(e))
+    return _json({"results": [h.to_dict() for h in hits], "generation": gen.number})
+
+async def answer(request: web.Request) -> web.StreamResponse:
+    state = request.app[STATE]
+    params = await _params(request)
+    question = str(params.get("question") or "").strip()
+    if not question:
+        return _bad_request("Missing question.")
+    try:
+        top_k = _top_k(params)
+        temperature = float(params.get("temperature", 0.3))
+    except ValueError as e:
+        return _bad_request(str(e))
+    stream = _flag(params.get("stream"))
+    with tracing.trace(), tracing.span("api.answer", stream=stream) as attrs:
+        try:
+            chunks, context = [], ""
+            if _flag(params.get("rag")):
+                _, chunks = await state.search(question, top_k, params.get("backend"),
+                                               _flag(params.get("local")), _flag(params.get("vendor")))
+            if chunks:
+                packed = state.llm.pack_context(question, chunks, SYSTEM_PROMPT)
+                chunks, context = packed["chunks"], packed["context"]
+            pieces = state.answer_stream(question, chunks, context, temperature)
+            # Wait for the first piece before answering, so overload and upstream errors are real statuses
+            first = await pieces.__anext__()
+        except StopAsyncIteration:
+            first = ""
+        except Overloaded as e:
+            attrs["rejected"] = True
+            return _unavailable(e)
+        except ValueError as e:
+            return _bad_request(str(e))
+        except Exception as e:
+            return _json({"error": f"LLM error: {e}"}, status=502)
+
+        if not stream:
+            try:
+                text = first + "".join([p async for p in pieces])
+            except Exception as e:
+                return _json({"error": f"LLM error: {e}"}, status=502)
+            return _json({"answer": text, "citations": _cite(chunks)})
+
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await resp.prepare(request)
+
+        async def event(name: str, data):
+            await resp.write(f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+        try:
+            await event("citations", _cite(chunks))
+            if first:
+                await event("message", first)
+            async for piece in pieces:
+                await event("message", piece)
+        except ConnectionResetError:
+            # Client went away: leave the flight (its upstream call stops if nobody else follows it)
+            await pieces.aclose()
+            attrs["disconnected"] = True
+            return resp
+        except Exception as e:
+            await event("error", str(e))
+        else:
+            await event("done", {})
+        await resp.write_eof()
+        return resp
+
+async def healthz(request: web.Request) -> web.Response:
+    stats = request.app[STATE].stats()
+    return _json(stats, status=200 if stats["ready"] else 503)
+
+async def metrics(request: web.Request) -> web.Response:
+    stats = request.app[STATE].stats()
+    gauges = {"api_ready": float(stats["ready"])}
+    if stats["generation"] is not None:
+        gauges["index_generation"] = stats["generation"]
+    for gate in ("search", "llm"):
+        for key, value in stats[gate].items():
+            gauges[f"api_{gate}_{key}"] = value
+    for key, value in stats["single_flight"].items():
+        gauges[f"api_single_flight_{key}"] = value
+    for key in ("entries", "hits", "misses"):
+        if key in stats["search_cache"]:
+            gauges[f"search_cache_{key}"] = stats["search_cache"][key]
+    return web.Response(text=tracing.tracer.to_prometheus(gauges), content_type="text/plain")
+
+async def create_app(vendor_sync=None, llm=None) -> web.Application:
+    """App factory (also the gunicorn entry point); the index warms up in the background."""
+    state = ServerState(vendor_sync, llm)
+    app = web.Application()
+    app[STATE] = state
+    app.router.add_route("GET", "/search", search)
+    app.router.add_post("/search", search)
+    app.router.add_post("/answer", answer)
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/metrics", metrics)
+
+    async def on_startup(app):
+        state.vendor_sync.start()
+
+    async def on_cleanup(app):
+        await state.close()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default=os.getenv("API_HOST", "0.0.0.0"))
+    ap.add_argument("--port", type=int, default=int(os.getenv("API_PORT", "8080")))
+    args = ap.parse_args()
+    web.run_app(create_app(), host=args.host, port=args.port, access_log=None)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import os
+import json
+import time
+import uuid
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+
+# Số span gần nhất giữ trong bộ nhớ (ring buffer, dùng chung cho cả process)
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "5000"))
+QUANTILES = (0.5, 0.95, 0.99)
+
+_current_trace: ContextVar[Optional[str]] = ContextVar("trace_id", default=None)
+
+class Tracer:
+    """In-process span recorder backed by a fixed-size ring buffer.
+
+    A span is a dict ``{name, start, duration, trace, ...attrs}``; ``trace``
+    groups the spans of one request (see ``trace()``). Percentiles and the
+    Prometheus/JSONL exports cover the spans still in the buffer.
+    """
+
+    def __init__(self, maxlen: int = TRACE_BUFFER_SIZE):
+        self._spans = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def record(self, name: str, duration: float, start: Optional[float] = None, **attrs):
+        span = {"name": name, "start": time.time() - duration if start is None else start,
+                "duration": float(duration), "trace": _current_trace.get()}
+        span.update(attrs)
+        with self._lock:
+            self._spans.append(span)
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """Time the block; the yielded dict can receive extra attributes."""
+        start_wall, start = time.time(), time.perf_counter()
+        try:
+            yield attrs
+        except BaseException as e:
+            attrs.setdefault("error", type(e).__name__)
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start, start=start_wall, **attrs)
+
+    @contextmanager
+    def trace(self, trace_id: Optional[str] = None):
+        """Tag every span recorded in this context with one request id."""
+        token = _current_trace.set(trace_id or uuid.uuid4().hex[:16])
+        try:
+            yield _current_trace.get()
+        finally:
+            _current_trace.reset(token)
+
+    def spans(self, name: Optional[str] = None) -> List[Dict]:
+        with self._lock:
+            spans = list(self._spans)
+        return [s for s in spans if name is None or s["name"] == name]
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+    def summary(self, quantiles: Iterable[float] = QUANTILES) -> Dict[str, Dict]:
+        """Per span name: count, error count, mean, sum and latency quantiles (seconds)."""
+        by_name: Dict[str, List[Dict]] = {}
+        for s in self.spans():
+            by_name.setdefault(s["name"], []).append(s)
+        out = {}
+        for name, spans in sorted(by_name.items()):
+            d = np.array([s["duration"] for s in spans])
+            row = {"count": len(d), "errors": sum(1 for s in spans if "error" in s),
+                   "mean": float(d.mean()), "sum": float(d.sum())}
+            for q in quantiles:
+                row[f"p{q * 100:g}"] = float(np.quantile(d, q))
+            out[name] = row
+        return out
+
+    def to_prometheus(self, gauges: Optional[Dict[str, float]] = None, prefix: str = "sdn302") -> str:
+        """Prometheus text exposition: one summary over spans plus optional gauges."""
+        metric = f"{prefix}_span_seconds"
+        lines = [f"# HELP {metric} Latency of traced operations (spans in the ring buffer).",
+                 f"# TYPE {metric} summary"]
+        for name, row in self.summary().items():
+            label = name.replace("\\", "\\\\").replace('"', '\\"')
+            for q in QUANTILES:
+                lines.append(f'{metric}{{span="{label}",quantile="{q:g}"}} {row[f"p{q * 100:g}"]:.6f}')
+            lines.append(f'{metric}_sum{{span="{label}"}} {row["sum"]:.6f}')
+            lines.append(f'{metric}_count{{span="{label}"}} {row["count"]}')
+        for key, value in sorted((gauges or {}).items()):
+            lines.append(f"# TYPE {prefix}_{key} gauge")
+            lines.append(f"{prefix}_{key} {float(value):g}")
+        return "\n".join(lines) + "\n"
+
+    def to_jsonl(self) -> str:
+        return "".join(json.dumps(s, ensure_ascii=False, default=str) + "\n" for s in self.spans())
+
+# Tracer mặc định của process
+tracer = Tracer()
+span = tracer.span
+record = tracer.record
+trace = tracer.trace
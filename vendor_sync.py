@@ -0,0 +1,166 @@
+import os
+import time
+import hashlib
+import threading
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+import tracing
+from search_cache import hot_queries
+from web_ingest import load_vendor_urls, fetch_vendor_pages, cached_vendor_pages, pages_to_docs
+
+if TYPE_CHECKING:
+    from rag import RAGIndex
+
+# Chu kỳ làm mới nguồn vendor ở nền (giây); mặc định 12h như cache cũ
+VENDOR_SYNC_INTERVAL = float(os.getenv("VENDOR_SYNC_INTERVAL", str(12 * 60 * 60)))
+
+def docs_key(docs: List[Dict]) -> str:
+    h = hashlib.sha1()
+    for d in docs:
+        h.update(d["source"].encode("utf-8", errors="ignore") + b"\0")
+        h.update(d["text"].encode("utf-8", errors="ignore") + b"\0")
+    return h.hexdigest()
+
+def build_base_index(docs: List[Dict], data_dir: str = "data") -> "RAGIndex":
+    """The shared, frozen index: data/ (from its snapshot when unchanged) plus
+    vendor pages, with the hot queries' results already cached."""
+    from rag import RAGIndex   # imported by the worker thread, off the first render
+    idx = RAGIndex(data_dir=data_dir)
+    idx.build()
+    if docs:
+        idx.add_external_docs(docs)
+    idx.freeze()
+    idx.warmup(hot_queries(data_dir))
+    return idx
+
+def page_status(pages: List[Dict]) -> List[Dict]:
+    """Per-URL fetch results without the page text (which lives only in the index)."""
+    return [dict({k: v for k, v in p.items() if k != "text"}, chars=len(p["text"])) for p in pages]
+
+class Generation:
+    """One published base index and the fetch results it was built from."""
+    __slots__ = ("number", "index", "key", "pages", "built_at", "build_seconds")
+
+    def __init__(self, number: int, index: "RAGIndex", key: str, pages: List[Dict], build_seconds: float):
+        self.number = number
+        self.index = index
+        self.key = key
+        self.pages = page_status(pages)
+        self.built_at = time.time()
+        self.build_seconds = build_seconds
+
+class VendorSync:
+    """Refreshes vendor pages on a background thread and publishes new base indexes.
+
+    ``current`` is swapped in one attribute assignment once a new generation
+    is fully built and frozen, so readers never see a half-built index and
+    never wait for a refresh. A refresh whose pages did not change keeps the
+    current index and only updates the fetch status. The first generation is
+    built from data/ and the on-disk HTTP cache (no network): by the worker
+    right after ``start()`` (poll ``ready``), or by the first ``current`` read.
+    """
+
+    def __init__(self, build: Callable[[List[Dict]], "RAGIndex"] = build_base_index,
+                 load_urls: Callable[[], List[str]] = lambda: load_vendor_urls("sources.yaml"),
+                 interval: float = VENDOR_SYNC_INTERVAL, fetch: Callable[[List[str]], List[Dict]] = fetch_vendor_pages):
+        self._build = build
+        self._load_urls = load_urls
+        self._fetch = fetch
+        self.interval = interval
+        self._current: Optional[Generation] = None
+        self._lock = threading.Lock()          # serializes publishers, not readers
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.running = False
+        self.last_check: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.pages: List[Dict] = []
+
+    @property
+    def ready(self) -> bool:
+        """Whether a generation has been published (``current`` will not block)."""
+        return self._current is not None
+
+    @property
+    def current(self) -> Generation:
+        gen = self._current
+        if gen is None:
+            with self._lock:
+                if self._current is None:
+                    pages = cached_vendor_pages(self._load_urls())
+                    self._publish(pages, pages_to_docs(pages))
+                gen = self._current
+        return gen
+
+    def start(self):
+        """Start the worker: it builds the first generation, then refreshes right away."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="vendor-sync", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def request_refresh(self):
+        """Ask the worker to refresh now (returns immediately)."""
+        self._wake.set()
+
+    def _run(self):
+        try:
+            with tracing.span("index.warmup"):
+                self.current
+        except Exception as e:   # the next refresh (or a reader) retries the build
+            self.last_error = f"{type(e).__name__}: {e}"
+        while not self._stop.is_set():
+            try:
+                self.sync_once()
+            except Exception as e:   # keep serving the last good generation
+                self.last_error = f"{type(e).__name__}: {e}"
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def sync_once(self) -> Generation:
+        """Fetch every URL and publish a new generation if the pages changed."""
+        self.running = True
+        try:
+            with tracing.span("vendor.refresh") as attrs:
+                pages = self._fetch(self._load_urls())
+                docs = pages_to_docs(pages)
+                with self._lock:
+                    self.pages = page_status(pages)
+                    self.last_check = time.time()
+                    if self._current is not None and self._current.key == docs_key(docs):
+                        attrs["published"] = False
+                    else:
+                        self._publish(pages, docs)
+                        attrs["published"] = True
+                    attrs["generation"] = self._current.number
+                self.last_error = None
+                return self._current
+        finally:
+            self.running = False
+
+    def _publish(self, pages: List[Dict], docs: List[Dict]):
+        started = time.perf_counter()
+        index = self._build(docs)
+        number = self._current.number + 1 if self._current is not None else 0
+        self._current = Generation(number, index, docs_key(docs), pages, time.perf_counter() - started)
+
+    def status(self) -> Dict:
+        gen = self.current
+        return {
+            "generation": gen.number,
+            "age": time.time() - gen.built_at,
+            "build_seconds": gen.build_seconds,
+            "chunks": gen.index.dedup_stats()["chunks"],
+            "running": self.running,
+            "last_check": self.last_check,
+            "next_check": (self.last_check + self.interval) if self.last_check else None,
+            "last_error": self.last_error,
+            "pages": self.pages or gen.pages,
+        }
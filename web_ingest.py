@@ -1,5 +1,22 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+import requests
 import yaml
-import trafilatura
+import tracing
+
+# Tải song song có giới hạn; override qua env/Secrets
+FETCH_WORKERS = int(os.getenv("VENDOR_FETCH_WORKERS", "8"))
+FETCH_TIMEOUT = float(os.getenv("VENDOR_FETCH_TIMEOUT", "20"))
+# Khoảng cách tối thiểu (giây) giữa 2 request tới cùng một host
+HOST_MIN_INTERVAL = float(os.getenv("VENDOR_HOST_MIN_INTERVAL", "1.0"))
+HTTP_CACHE_DIR = os.getenv("VENDOR_HTTP_CACHE_DIR", os.path.join(".cache", "http"))
+USER_AGENT = "SDN302-Assistant/1.0 (+https://github.com/phucpt10/SDN302-Assistant)"
 
 def load_vendor_urls(path: str = "sources.yaml"):
     try:
@@ -12,26 +29,156 @@ def load_vendor_urls(path: str = "sources.yaml"):
     except Exception:
         return []
 
-def fetch_one(url: str) -> str:
+def _extract(html: str) -> str:
+    import trafilatura   # nạp lúc cần (trafilatura + lxml import chậm)
+    text = trafilatura.extract(
+        html,
+        include_formatting=False,
+        include_links=False,
+        include_images=False,
+        include_tables=False
+    )
+    return (text or "").strip()
+
+class HostRateLimiter:
+    """Cho phép tối đa một request mỗi ``min_interval`` giây trên mỗi host."""
+
+    def __init__(self, min_interval: float = HOST_MIN_INTERVAL):
+        self.min_interval = min_interval
+        self._next: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url: str):
+        host = urlparse(url).netloc.lower()
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next.get(host, 0.0))
+            self._next[host] = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+class HttpCache:
+    """Cache trên đĩa: mỗi URL một file JSON gồm ETag/Last-Modified và text đã trích xuất."""
+
+    def __init__(self, cache_dir: Optional[str] = HTTP_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def _path(self, url: str) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, url: str) -> Optional[Dict]:
+        path = self._path(url)
+        if path is None:
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            return entry if entry.get("url") == url else None
+        except Exception:
+            return None
+
+    def put(self, url: str, entry: Dict):
+        path = self._path(url)
+        if path is None:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = f"{path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(dict(entry, url=url), f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except Exception:
+            pass
+
+def fetch_page(
+    url: str,
+    session: requests.Session,
+    cache: HttpCache,
+    limiter: Optional[HostRateLimiter] = None,
+    timeout: float = FETCH_TIMEOUT,
+) -> Dict:
+    """Tải một trang với conditional GET.
+
+    Trả về ``{url, text, status, detail, elapsed}`` với status là ``fetched``
+    (tải và trích xuất lại), ``not_modified`` (304), ``unchanged`` (200 nhưng
+    nội dung giống cache), ``stale`` (lỗi mạng, dùng bản cache) hoặc ``error``.
+    """
+    started = time.monotonic()
+    cached = cache.get(url)
+    headers = {"User-Agent": USER_AGENT}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    def result(text: str, status: str, detail: str = "") -> Dict:
+        elapsed = time.monotonic() - started
+        tracing.record("vendor.fetch", elapsed, url=url, status=status)
+        return {"url": url, "text": text, "status": status, "detail": detail, "elapsed": elapsed}
+
     try:
-        downloaded = trafilatura.fetch_url(url)
-        if not downloaded:
-            return ""
-        text = trafilatura.extract(
-            downloaded,
-            include_formatting=False,
-            include_links=False,
-            include_images=False,
-            include_tables=False
-        )
-        return (text or "").strip()
-    except Exception:
-        return ""
-
-def fetch_vendor_docs(urls):
-    docs = []
-    for u in urls:
-        text = fetch_one(u)
-        if text:
-            docs.append({"text": text, "source": u})
-    return docs
+        if limiter is not None:
+            limiter.wait(url)
+        resp = session.get(url, headers=headers, timeout=timeout)
+        if resp.status_code == 304 and cached:
+            cache.put(url, dict(cached, checked_at=time.time()))
+            return result(cached.get("text", ""), "not_modified")
+        if not resp.ok:
+            raise RuntimeError(f"HTTP {resp.status_code} {resp.reason}")
+        body_hash = hashlib.sha256(resp.content).hexdigest()
+        validators = {
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+            "body_sha256": body_hash,
+            "checked_at": time.time(),
+        }
+        if cached and cached.get("body_sha256") == body_hash:
+            cache.put(url, dict(cached, **validators))
+            return result(cached.get("text", ""), "unchanged")
+        text = _extract(resp.text)
+        cache.put(url, dict(validators, text=text))
+        return result(text, "fetched")
+    except Exception as e:
+        if cached and cached.get("text"):
+            return result(cached["text"], "stale", str(e))
+        return result("", "error", str(e))
+
+def fetch_vendor_pages(
+    urls: List[str],
+    workers: int = FETCH_WORKERS,
+    timeout: float = FETCH_TIMEOUT,
+    cache_dir: Optional[str] = HTTP_CACHE_DIR,
+    host_min_interval: float = HOST_MIN_INTERVAL,
+) -> List[Dict]:
+    """Tải song song các URL (thread pool), giữ nguyên thứ tự đầu vào."""
+    if not urls:
+        return []
+    cache = HttpCache(cache_dir)
+    limiter = HostRateLimiter(host_min_interval)
+    workers = max(1, min(workers, len(urls)))
+    with tracing.span("vendor.sync", urls=len(urls)), requests.Session() as session:
+        adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(lambda u: fetch_page(u, session, cache, limiter, timeout), urls))
+
+def cached_vendor_pages(urls: List[str], cache_dir: Optional[str] = HTTP_CACHE_DIR) -> List[Dict]:
+    """Các trang lấy từ cache HTTP trên đĩa, không gọi mạng (status ``cached`` hoặc ``missing``)."""
+    cache = HttpCache(cache_dir)
+    pages = []
+    for url in urls:
+        entry = cache.get(url) or {}
+        text = entry.get("text", "")
+        pages.append({"url": url, "text": text, "status": "cached" if text else "missing",
+                      "detail": "", "elapsed": 0.0})
+    return pages
+
+def pages_to_docs(pages: List[Dict]) -> List[Dict]:
+    return [{"text": p["text"], "source": p["url"]} for p in pages if p["text"]]
+
+def fetch_vendor_docs(urls, **kwargs):
+    return pages_to_docs(fetch_vendor_pages(list(urls), **kwargs))